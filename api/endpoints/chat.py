@@ -2,13 +2,15 @@ from fastapi import APIRouter, Depends, Form, Request, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from prompts.prompts import get_prompt
-from services import knowlege_service
+from services.chat_pipeline import StageTimer, prepare_chat
 from services.chat_service import ChatService
 from sqlalchemy.orm import Session
 from models.database import get_db
+from utils.background_tasks import post_response_executor
 from utils.data_handle import convert_table_to_csv, extract_table_from_markdown
-from utils.llm_handle import generate_response, generate_and_update_title
-from utils.retriever import get_rag_retriever, get_rag_retriever_by_kb
+from utils.llm_handle import generate_and_update_summary, generate_and_update_title, generate_response
+from utils.response_cache import response_cache
+from utils.sse_stream import get_stream_stats, record_stage_timings
 import logging
 
 app = APIRouter()
@@ -80,8 +82,7 @@ async def create_new_conversation(
 @app.post("/api/chat")
 async def chat_endpoint(
     request: Request,
-    data: dict,  
-    db: Session = Depends(get_db)
+    data: dict
 ):
     user_id = request.session.get("user_id")
     if not user_id:
@@ -91,43 +92,30 @@ async def chat_endpoint(
     scenario = data.get("scenario")
     conversation_id = data.get("conversation_id")
     knowledge_base_id = data.get("knowledge_base_id")
-    
-    is_new_conversation = False
-    # if not conversation_id:
-    #     new_conversation = await ChatService.create_new_conversation(user_id, scenario, scenario, knowledge_base_id, db)
-    #     conversation_id = new_conversation.id
-    #     is_new_conversation = True
-    
-    conversation = await ChatService.get_conversation_info(conversation_id,db)
-    print(f"conversation{conversation.title}")
-    if conversation.title == "新对话":
-        is_new_conversation = True
-        generate_and_update_title(user_message=message, conversation_id=conversation_id, db=db)
-        print(f"conversation{conversation}")
-    await ChatService.create_new_message(conversation_id, "user", message, db)
+    # 多知识库联合检索：传入知识库ID列表
+    knowledge_base_ids = list(dict.fromkeys(data.get("knowledge_base_ids") or []))
+    if len(knowledge_base_ids) <= 1 and knowledge_base_id:
+        knowledge_base_ids = [knowledge_base_id]
+
+    # 对话相关的数据库操作与知识库检索并发执行
+    timer = StageTimer()
+    prepared = await prepare_chat(conversation_id, message, scenario, knowledge_base_ids, timer)
+    if prepared is None:
+        return JSONResponse(status_code=404, content={"error": "对话不存在"})
 
-    
-    # 获取对话历史
-    history = await ChatService.get_conversation_history(conversation_id, db)
-    
-    # 获取检索器并检索相关文档
-    context = ""
-    if knowledge_base_id:
-        retriever = await get_rag_retriever_by_kb(knowledge_base_id, db)
-        if retriever:
-            try:
-                docs = await retriever.get_relevant_documents(message)
-                context = "\n\n".join([doc.page_content for doc in docs])
-                logger.info(f"从知识库 {knowledge_base_id} 检索到 {len(docs)} 个相关文档")
-            except Exception as e:
-                logger.error(f"检索失败: {e}")
-                context = ""
-    
-    knowledge_base = await knowlege_service.get_knowledge_base_by_id(kb_id=knowledge_base_id, db=db)
-    if not knowledge_base:
-        knowledge_base_name = "无"
-    else:
-        knowledge_base_name = knowledge_base.name
+    if prepared["title"] == "新对话":
+        # 标题生成是一次独立的 LLM 调用，交给后台执行器与回答并行生成，不占用本次请求的连接和会话
+        post_response_executor.submit_with_db(
+            "title_generation", generate_and_update_title, message, conversation_id
+        )
+    if prepared["needs_compaction"]:
+        # 历史过长时在后台把较早的轮次并入摘要
+        post_response_executor.submit_with_db(
+            "history_summary", generate_and_update_summary, conversation_id, prepared["user_message_id"]
+        )
+
+    history = prepared["history"]
+    context = prepared["context"]
 
     # 生成对话提示
     prompt = get_prompt(
@@ -135,12 +123,45 @@ async def chat_endpoint(
         context=context,
         history=history,
         question=message,
-        knowledge_base_name=knowledge_base_name
+        knowledge_base_name=prepared["knowledge_base_name"]
 
     )
-    print(f"最终传给模型的prompt是：{prompt}")
+    logger.debug(f"最终传给模型的prompt是：{prompt}")
+
+    # 回答缓存：仅用于没有对话历史的首轮提问（多轮对话的回答依赖上下文）
+    cached_answer = None
+    on_complete = None
+    if response_cache is not None and not history:
+        # 精确匹配未命中时才生成查询向量做语义匹配；检索未命中缓存时向量已在查询向量缓存中
+        retriever = prepared["retriever"]
+        embed = (lambda: timer.run("embed", retriever.embed(message))) if retriever else None
+        cache_args = (scenario, prepared["cache_kb_id"], prepared["kb_version"], context, message)
+        cached_answer, query_vector = await response_cache.alookup(*cache_args, embed=embed)
+        if cached_answer:
+            logger.info(f"命中回答缓存，场景: {scenario}, 知识库: {prepared['cache_kb_id']}")
+        else:
+            on_complete = lambda answer: response_cache.store(*cache_args, answer, query_vector=query_vector)
+
+    timer.mark("prepare")
+    record_stage_timings(timer.timings)
+    logger.info(f"对话 {conversation_id} 生成前各阶段耗时: {timer.summary()}")
+
     # 返回流式响应
-    return StreamingResponse(generate_response(request,prompt,conversation_id,is_new_conversation,message,db), media_type="text/event-stream")
+    return StreamingResponse(
+        generate_response(request, prompt, conversation_id,
+                          cached_answer=cached_answer, on_complete=on_complete),
+        media_type="text/event-stream",
+        headers={"Server-Timing": timer.server_timing()}
+    )
+
+
+# 流式响应指标（首 token 延迟、生成速度）
+@app.get("/api/stream-stats")
+async def stream_stats():
+    return {
+        **get_stream_stats(),
+        "post_response_tasks": post_response_executor.stats()
+    }
 
 
 # 删除对话
@@ -1,17 +1,29 @@
+import asyncio
 import datetime
 import os
 import shutil
 from typing import List
 import uuid
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, UploadFile, File, logger
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, logger
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from models.database import get_db
 from models.knowledge_models import KnowledgeBase, KnowledgeFile
-from schemas.knowledge_schemas import KnowledgeBaseCreate, KnowledgeBaseResponse, KnowledgeBaseUpdate
+from schemas.knowledge_schemas import BatchRetrieveRequest, KnowledgeBaseCreate, KnowledgeBaseResponse, KnowledgeBaseUpdate
 from services import knowlege_service
+from services.ingest_queue import get_batch_progress
+from utils.embedding_cache import embedding_cache
 from utils.file_handle import UPLOAD_DIR, document_processor
+from utils.response_cache import response_cache
+from utils.vector_snapshot import vector_snapshots
+from utils.retriever import (
+    BATCH_RETRIEVE_MAX_QUERIES,
+    get_query_embedding_cache_stats,
+    get_retrieval_cache_stats,
+    get_retriever_cache_stats,
+    get_rag_retriever_by_kb,
+)
 from pathlib import Path
 
 app = APIRouter()
@@ -69,16 +81,33 @@ async def update_knowledge(
 @app.post("/api/knowledge-bases/{kb_id}/upload")
 async def upload_document(
     kb_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
     """上传文档到知识库"""
     # 检查知识库是否存在
 
-    result = await knowlege_service.upload_document(kb_id, file, background_tasks, db)
+    result = await knowlege_service.upload_document(kb_id, file, db)
     return result
 
+@app.post("/api/knowledge-bases/{kb_id}/upload-batch")
+async def upload_documents_batch(
+    kb_id: str,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """批量上传文档到知识库（多个PDF文件或 zip/tar 压缩包）"""
+    result = await knowlege_service.upload_documents_batch(kb_id, files, db)
+    return result
+
+@app.get("/api/ingest-batches/{batch_id}")
+async def get_ingest_batch_progress(batch_id: str, db: Session = Depends(get_db)):
+    """查询批量上传的整体处理进度"""
+    progress = get_batch_progress(db, batch_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return progress
+
 @app.delete("/api/knowledge-bases/{kb_id}")
 async def delete_knowledge(kb_id: str, db: Session = Depends(get_db)):
     """删除知识库及其所有文件"""
@@ -93,32 +122,51 @@ async def delete_file(
     file_id: str,
     db: Session = Depends(get_db)
 ):
-    """从知识库中删除单个文件"""
-    # 这里需要实现从ChromaDB中删除特定文件的所有向量
-    # 由于ChromaDB不支持按metadata批量删除，这里简化为删除整个集合重新构建
-    # 实际生产环境需要考虑更优的实现
-    
-    file_record = db.query(KnowledgeFile).filter(
-        KnowledgeFile.id == file_id,
-        KnowledgeFile.knowledge_base_id == kb_id
-    ).first()
-    
-    if not file_record:
-        raise HTTPException(status_code=404, detail="文件不存在")
-    
-    # TODO: 实现从ChromaDB中删除特定文件的向量
-    # 当前简化实现：删除文件记录，实际需要重建集合
-    
-    # 删除文件记录
-    db.delete(file_record)
-    
-    # 删除物理文件
-    if os.path.exists(file_record.file_path):
-        os.remove(file_record.file_path)
-    
-    db.commit()
-    
-    return {"message": "文件删除成功"}
+    """从知识库中删除单个文件（同时删除该文件的全部向量）"""
+    result = await knowlege_service.delete_knowledge_file(db, kb_id, file_id)
+    return result
+
+@app.post("/api/knowledge-bases/{kb_id}/batch-retrieve")
+async def batch_retrieve(kb_id: str, payload: BatchRetrieveRequest, db: Session = Depends(get_db)):
+    """批量检索：一次请求检索多条查询（如整份需求文档的各个需求项），按查询顺序返回结果"""
+    kb = await knowlege_service.get_knowledge_base_by_id(kb_id=kb_id, db=db)
+    if not kb:
+        raise HTTPException(status_code=404, detail="知识库不存在")
+    queries = [query.strip() for query in payload.queries if query and query.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="查询列表不能为空")
+    if len(queries) > BATCH_RETRIEVE_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"单次最多检索 {BATCH_RETRIEVE_MAX_QUERIES} 条查询")
+
+    retriever = await get_rag_retriever_by_kb(kb_id, db, collection_name=kb.collection_name)
+    if not retriever:
+        raise HTTPException(status_code=404, detail="向量集合不存在")
+
+    results = await retriever.get_relevant_documents_batch(
+        queries, n_results=payload.n_results, kb_version=kb.version or 0
+    )
+    return {
+        "knowledge_base_id": kb_id,
+        "results": [
+            {
+                "query": query,
+                "documents": [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+            }
+            for query, docs in zip(queries, results)
+        ]
+    }
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """获取检索相关各级缓存的统计信息"""
+    return {
+        "retriever": get_retriever_cache_stats(),
+        "query_embedding": get_query_embedding_cache_stats(),
+        "retrieval_result": get_retrieval_cache_stats(),
+        "embedding": await asyncio.to_thread(embedding_cache.stats) if embedding_cache else None,
+        "response": response_cache.stats() if response_cache else None,
+        "vector_snapshot": vector_snapshots.stats()
+    }
 
 @app.get("/api/knowledge-bases/{kb_id}/collection-info")
 async def get_collection_info(kb_id: str, db: Session = Depends(get_db)):
@@ -0,0 +1,99 @@
+"""
+/api/chat 并发延迟压测
+
+模拟 N 个并发用户向已启动的服务发起流式对话请求，统计首 token 延迟（TTFT）和完整响应耗时的 p50/p95/p99。
+在改动前后分别对同一服务运行，对比结果即可评估检索链路阻塞事件循环带来的影响。
+
+用法：
+    python benchmarks/bench_chat_latency.py --base-url http://localhost:8000 \\
+        --username tester --password 123456 --kb-id <知识库ID> --users 20 --rounds 3
+"""
+import argparse
+import asyncio
+import math
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    """计算百分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    response = await client.post("/login", json={"username": username, "password": password})
+    if "session" not in client.cookies:
+        raise RuntimeError(f"登录失败: HTTP {response.status_code}")
+
+
+async def one_chat(client: httpx.AsyncClient, args) -> tuple:
+    """发起一次对话，返回 (首 token 延迟, 总耗时)"""
+    response = await client.post(
+        "/api/conversation/new",
+        data={"scenario": args.scenario, "knowledge_base_id": args.kb_id or ""}
+    )
+    conversation_id = response.json()["conversation_id"]
+
+    payload = {
+        "message": args.message,
+        "scenario": args.scenario,
+        "conversation_id": conversation_id,
+        "knowledge_base_id": args.kb_id
+    }
+    start = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/api/chat", json=payload) as stream:
+        async for line in stream.aiter_lines():
+            if line.startswith("data:") and first_token is None:
+                first_token = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return first_token if first_token is not None else total, total
+
+
+async def user_loop(user_no: int, args, ttft: list, totals: list):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=300) as client:
+        await login(client, args.username, args.password)
+        for _ in range(args.rounds):
+            try:
+                first, total = await one_chat(client, args)
+                ttft.append(first)
+                totals.append(total)
+            except Exception as e:
+                print(f"用户 {user_no} 请求失败: {e}")
+
+
+async def main(args):
+    ttft, totals = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(i, args, ttft, totals) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    print(f"并发用户: {args.users}, 每用户请求: {args.rounds}, 成功: {len(totals)}, 总耗时: {elapsed:.1f}s")
+    for name, values in (("首token延迟", ttft), ("完整响应", totals)):
+        if not values:
+            continue
+        print(
+            f"{name}: mean={statistics.mean(values):.3f}s "
+            f"p50={percentile(values, 50):.3f}s "
+            f"p95={percentile(values, 95):.3f}s "
+            f"p99={percentile(values, 99):.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/api/chat 并发延迟压测")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--kb-id", default=None, help="知识库ID，不传则不走检索")
+    parser.add_argument("--scenario", default="product_manual")
+    parser.add_argument("--message", default="如何备份MySQL数据库？")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个用户的请求次数")
+    asyncio.run(main(parser.parse_args()))
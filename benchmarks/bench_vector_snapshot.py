@@ -0,0 +1,120 @@
+"""
+内存向量快照 vs collection.query 检索延迟对比
+
+对同一集合分别用 Chroma 的 collection.query 和内存快照（utils/vector_snapshot.py）检索，
+统计单次查询耗时的 p50/p95/p99，并给出快照结果相对 Chroma 的 top-k 重合率。
+查询向量取自集合中随机向量并加入少量噪声，不调用嵌入接口。
+
+用法：
+    # 使用已有知识库集合
+    python benchmarks/bench_vector_snapshot.py --collection <集合名> --queries 500
+    # 使用随机生成的临时集合
+    python benchmarks/bench_vector_snapshot.py --synthetic 20000 --queries 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_latency import percentile
+from utils.vector_snapshot import VectorSnapshotRegistry
+
+
+def build_synthetic_collection(count: int, dimensions: int):
+    """在内存 Chroma 客户端中创建随机向量集合"""
+    client = chromadb.Client()
+    collection = client.get_or_create_collection(name="bench_snapshot")
+    rng = np.random.default_rng(0)
+    for offset in range(0, count, 5000):
+        size = min(5000, count - offset)
+        vectors = rng.normal(size=(size, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"chunk-{offset + i}" for i in range(size)],
+            embeddings=vectors,
+            documents=[f"文档片段 {offset + i}" for i in range(size)],
+            metadatas=[{"start_index": offset + i} for i in range(size)]
+        )
+    return collection
+
+
+def sample_queries(collection, count: int, noise: float):
+    """从集合中随机取向量并加噪声作为查询向量"""
+    total = collection.count()
+    rng = np.random.default_rng(1)
+    queries = []
+    for offset in rng.integers(0, total, size=count):
+        vector = np.asarray(collection.get(limit=1, offset=int(offset), include=["embeddings"])["embeddings"][0])
+        queries.append((vector + rng.normal(scale=noise, size=vector.shape)).astype(np.float32).tolist())
+    return queries
+
+
+def time_queries(query_fn, queries, n_results: int):
+    latencies, ids = [], []
+    for query in queries:
+        start = time.perf_counter()
+        result = query_fn(query, n_results)
+        latencies.append(time.perf_counter() - start)
+        ids.append(result["ids"][0])
+    return latencies, ids
+
+
+def report(name: str, latencies):
+    print(
+        f"{name}: mean={statistics.mean(latencies) * 1000:.2f}ms "
+        f"p50={percentile(latencies, 50) * 1000:.2f}ms "
+        f"p95={percentile(latencies, 95) * 1000:.2f}ms "
+        f"p99={percentile(latencies, 99) * 1000:.2f}ms"
+    )
+
+
+def main(args):
+    if args.synthetic:
+        collection = build_synthetic_collection(args.synthetic, args.dimensions)
+    else:
+        client = chromadb.PersistentClient(path=args.db_path)
+        collection = client.get_collection(name=args.collection)
+    print(f"集合 {collection.name}: {collection.count()} 个向量")
+
+    queries = sample_queries(collection, args.queries, args.noise)
+    registry = VectorSnapshotRegistry(enabled=True, min_queries=1, max_vectors=10 ** 9, refresh_seconds=0)
+    start = time.perf_counter()
+    snapshot = registry.load(collection)
+    print(f"快照加载耗时: {(time.perf_counter() - start) * 1000:.0f}ms, 内存: {snapshot.nbytes / 1024 / 1024:.1f}MB")
+
+    chroma_latencies, chroma_ids = time_queries(
+        lambda query, k: collection.query(query_embeddings=[query], n_results=k, include=["distances"]),
+        queries, args.n_results
+    )
+    snapshot_latencies, snapshot_ids = time_queries(
+        lambda query, k: snapshot.query([query], k, include=["distances"]),
+        queries, args.n_results
+    )
+
+    report("collection.query", chroma_latencies)
+    report("内存快照", snapshot_latencies)
+    overlap = statistics.mean(
+        len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(chroma_ids, snapshot_ids)
+    )
+    print(f"top-{args.n_results} 重合率: {overlap:.4f}（Chroma HNSW 为近似检索，快照为精确检索）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="内存向量快照检索延迟压测")
+    parser.add_argument("--db-path", default=os.getenv("RAG_DB_PATH", "./chroma_db"))
+    parser.add_argument("--collection", help="要测试的集合名")
+    parser.add_argument("--synthetic", type=int, default=0, help="生成指定数量的随机向量集合进行测试")
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--n-results", type=int, default=12)
+    parser.add_argument("--noise", type=float, default=0.02, help="查询向量噪声")
+    parsed = parser.parse_args()
+    if not parsed.synthetic and not parsed.collection:
+        parser.error("需要指定 --collection 或 --synthetic")
+    main(parsed)
@@ -0,0 +1,105 @@
+"""
+压测用的本地模拟上游服务
+
+模拟 DashScope 兼容的嵌入接口（/v1/embeddings）和 DeepSeek 的对话接口（/v1/chat/completions，支持流式），
+按固定延迟返回确定性的结果，使 bench_chat_latency.py 可以在没有外部 API 的环境中对比改动前后的延迟。
+被测服务启动时设置：
+    ALIYUN_BASE_URL=http://127.0.0.1:9100/v1  DEEPSEEK_API_BASE=http://127.0.0.1:9100/v1
+
+用法：
+    python benchmarks/fake_upstream.py --port 9100 --embed-latency 0.1 --first-token-latency 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+settings = argparse.Namespace(
+    embed_latency=0.1, first_token_latency=0.2, token_interval=0.02, tokens=50, completion_latency=0.3
+)
+
+
+def fake_vector(text: str, dimensions: int) -> list:
+    """由文本哈希生成确定性的单位向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=dimensions)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or 1024
+    await asyncio.sleep(settings.embed_latency)
+    return JSONResponse({
+        "object": "list",
+        "model": body.get("model"),
+        "data": [
+            {"object": "embedding", "index": index, "embedding": fake_vector(text, dimensions)}
+            for index, text in enumerate(texts)
+        ],
+        "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)}
+    })
+
+
+def completion_chunk(content=None, finish_reason=None) -> str:
+    chunk = {
+        "id": "fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "deepseek-chat",
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": content} if content is not None else {},
+            "finish_reason": finish_reason
+        }]
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if not body.get("stream"):
+        await asyncio.sleep(settings.completion_latency)
+        return JSONResponse({
+            "id": "fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "deepseek-chat",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "模拟标题"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        })
+
+    async def stream():
+        await asyncio.sleep(settings.first_token_latency)
+        for index in range(settings.tokens):
+            if index:
+                await asyncio.sleep(settings.token_interval)
+            yield completion_chunk(f"词{index}")
+        yield completion_chunk(finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="压测用的本地模拟上游服务")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--embed-latency", type=float, default=0.1, help="嵌入接口延迟（秒）")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="流式对话首 token 延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="流式对话 token 间隔（秒）")
+    parser.add_argument("--tokens", type=int, default=50, help="每次流式回答的 token 数")
+    parser.add_argument("--completion-latency", type=float, default=0.3, help="非流式对话（标题/摘要）延迟（秒）")
+    args = parser.parse_args()
+    for key in ("embed_latency", "first_token_latency", "token_interval", "tokens", "completion_latency"):
+        setattr(settings, key, getattr(args, key))
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
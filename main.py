@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
@@ -5,6 +7,10 @@ import secrets
 from models.database import init_db
 from api.api_v1 import api_router
 from api.endpoints import auth, chat, knowledg_api as kb
+from services.ingest_queue import ingest_worker_pool
+from utils.background_tasks import post_response_executor
+from utils.context_packer import load_encoding
+from utils.pdf_extract import shutdown_pool
 
 app = FastAPI()
 
@@ -21,3 +27,30 @@ app.include_router(api_router, prefix="/api/v1")
 app.include_router(auth.router)
 app.include_router(chat.app)
 app.include_router(kb.app)
+
+
+# 启动/停止入库 worker 池（停止后关闭 PDF 解析进程池，避免子进程在应用退出后残留）
+@app.on_event("startup")
+async def start_ingest_workers():
+    ingest_worker_pool.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    ingest_worker_pool.stop()
+    shutdown_pool()
+
+
+# 启动/停止响应后的后台任务执行器
+@app.on_event("startup")
+async def start_post_response_executor():
+    post_response_executor.start()
+
+@app.on_event("shutdown")
+async def stop_post_response_executor():
+    await post_response_executor.stop()
+
+
+# 启动时加载 tiktoken 编码（可能需要下载词表），避免首个对话请求阻塞事件循环
+@app.on_event("startup")
+async def load_tokenizer():
+    await asyncio.to_thread(load_encoding)
@@ -20,6 +20,8 @@ class Conversation(Base):
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     scenario = Column(String(50), default="requeirement_analysis")  # 对话场景
     knowledge_base_id = Column(String(36), ForeignKey("knowledge_bases.id", ondelete="SET NULL"), nullable=True)
+    summary = Column(Text, nullable=True)  # 较早对话的滚动摘要
+    summary_until_id = Column(Integer, nullable=True)  # 已并入摘要的最后一条消息ID
     
     # 关系
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.timestamp")
@@ -1,10 +1,14 @@
 # app/models/database.py
+import logging
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # 加载环境变量
 load_dotenv()
 
@@ -17,23 +21,32 @@ MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "aitest_rag")
 
 
 
-# 构建 MySQL 连接 URL
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
+# 构建 MySQL 连接 URL（设置 DATABASE_URL 时优先使用，如测试中使用 sqlite://）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or \
+    f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
 
-# 创建引擎，配置连接池
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_size=20,  
-    max_overflow=30,  
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    # MySQL 特定配置
-    connect_args={
-        "charset": "utf8mb4",  # 支持表情符号
-        "connect_timeout": 10  # 连接超时时间
-    },
-    echo=False  # 设置为 True 可以看到 SQL 语句（调试用）
-)
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # SQLite：允许跨线程使用连接；内存数据库所有会话共用同一个连接
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool if SQLALCHEMY_DATABASE_URL in ("sqlite://", "sqlite:///:memory:") else None
+    )
+else:
+    # 创建引擎，配置连接池
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_size=20,  
+        max_overflow=30,  
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        # MySQL 特定配置
+        connect_args={
+            "charset": "utf8mb4",  # 支持表情符号
+            "connect_timeout": 10  # 连接超时时间
+        },
+        echo=False  # 设置为 True 可以看到 SQL 语句（调试用）
+    )
 
 with engine.connect() as conn:
     print("Database connection successful!")
@@ -52,6 +65,22 @@ Base = declarative_base()
 def init_db():
     """初始化数据库（创建表结构）"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+def _add_missing_columns():
+    """create_all 不会修改已存在的表，为已有表补齐模型中新增的可空列"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+                logger.info(f"已为表 {table.name} 添加列 {column.name}")
 
 # 数据库依赖注入
 def get_db():
@@ -16,6 +16,8 @@ class KnowledgeBase(Base):
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     file_count = Column(Integer, default=0)
+    chunk_count = Column(Integer, default=0)  # 已入库文件的分片总数
+    version = Column(Integer, default=0)  # 内容版本号，入库/删除文件时递增，用于使检索缓存失效
     
         # 关联文件
     files = relationship("KnowledgeFile", back_populates="knowledge_base", cascade="all, delete-orphan")
@@ -32,6 +34,7 @@ class KnowledgeFile(Base):
     filename = Column(String(500), nullable=False)
     file_path = Column(String(1000), nullable=False)
     file_size = Column(Integer)  # 文件大小（字节）
+    file_hash = Column(String(64), index=True)  # 文件内容 SHA-256，用于去重
     file_type = Column(String(50))  # 文件类型：pdf, docx, txt等
     status = Column(String(20), default="pending")  # pending, processing, completed, failed
     chunk_count = Column(Integer, default=0)  # 文档分片数量
@@ -42,4 +45,25 @@ class KnowledgeFile(Base):
     knowledge_base = relationship("KnowledgeBase", back_populates="files")
     
     def __repr__(self):
-        return f"<KnowledgeFile(id={self.id}, filename='{self.filename}')>"
\ No newline at end of file
+        return f"<KnowledgeFile(id={self.id}, filename='{self.filename}')>"
+
+class IngestJob(Base):
+    """文档入库任务表（持久化任务队列）"""
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    file_id = Column(String(36), ForeignKey("knowledge_files.id", ondelete="CASCADE"), nullable=False, index=True)
+    knowledge_base_id = Column(String(36), ForeignKey("knowledge_bases.id", ondelete="CASCADE"), nullable=False)
+    batch_id = Column(String(36), index=True)  # 批量上传的批次ID
+    status = Column(String(20), default="queued", index=True)  # queued, running, completed, failed, cancelled
+    attempts = Column(Integer, default=0)  # 已执行次数
+    committed_chunks = Column(Integer, default=0)  # 检查点：已写入向量库的分片数
+    worker_id = Column(String(100))  # 当前执行的 worker
+    heartbeat_at = Column(DateTime)  # 最近一次心跳（检查点）时间
+    next_attempt_at = Column(DateTime)  # 失败重试时最早可再次领取的时间（指数退避）
+    error = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<IngestJob(id={self.id}, file_id={self.file_id}, status='{self.status}')>"
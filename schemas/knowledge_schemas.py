@@ -28,6 +28,11 @@ class KnowledgeBaseResponse(BaseModel):
     description: str
     collection_name: str
     file_count: int
+    chunk_count: Optional[int] = 0
     created_at: datetime
     updated_at: datetime
-    files: List[KnowledgeFileResponse] = []
\ No newline at end of file
+    files: List[KnowledgeFileResponse] = []
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[str]
+    n_results: int = Field(3, ge=1, le=50)
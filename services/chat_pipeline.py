@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from models.database import SessionLocal
+from services import knowlege_service
+from services.chat_service import ChatService
+from utils.context_packer import pack_context
+from utils.retriever import federated_retrieve, get_rag_retriever_by_kb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """记录请求各阶段耗时，用于定位首 token 延迟的来源"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings = {}
+
+    async def run(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def mark(self, name: str):
+        """记录从请求开始到当前的耗时"""
+        self.timings[name] = time.perf_counter() - self.started_at
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头格式，浏览器开发者工具中可直接查看"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items())
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.timings.items())
+
+
+def _prepare_conversation(conversation_id: str, message: str) -> Optional[dict]:
+    """对话相关的数据库操作：读取对话、写入用户消息、读取历史（在线程中执行，使用独立会话）"""
+    db = SessionLocal()
+    try:
+        conversation = ChatService.get_conversation_info(conversation_id, db)
+        if not conversation:
+            return None
+        user_message = ChatService.create_new_message(conversation_id, "user", message, db)
+        history, needs_compaction = ChatService.get_conversation_history(
+            conversation_id, db, exclude_message_id=user_message.id
+        )
+        return {
+            "title": conversation.title,
+            "user_message_id": user_message.id,
+            "history": history,
+            "needs_compaction": needs_compaction
+        }
+    finally:
+        db.close()
+
+
+def _load_knowledge_bases(kb_ids: List[str]) -> list:
+    """查询知识库（在线程中执行，使用独立会话，与对话相关的数据库操作并行）"""
+    db = SessionLocal()
+    try:
+        knowledge_bases = knowlege_service.get_knowledge_bases_by_ids(kb_ids, db)
+        # 会话关闭后仍需读取知识库属性
+        db.expunge_all()
+        return knowledge_bases
+    finally:
+        db.close()
+
+
+async def _retrieve_context(kb_ids: List[str], message: str, scenario: str, timer: StageTimer) -> dict:
+    """知识库查询 + 检索 + 上下文打包"""
+    result = {"knowledge_bases": [], "context": "", "retriever": None}
+    if not kb_ids:
+        return result
+
+    knowledge_bases = await timer.run("kb_lookup", asyncio.to_thread(_load_knowledge_bases, kb_ids))
+    result["knowledge_bases"] = knowledge_bases
+    if not knowledge_bases:
+        return result
+
+    try:
+        if len(knowledge_bases) > 1:
+            # 多知识库：并发检索所有集合，按距离合并为全局 top-k，并标注来源
+            docs = await timer.run("retrieval", federated_retrieve(knowledge_bases, message))
+        else:
+            kb = knowledge_bases[0]
+            retriever = await timer.run(
+                "retriever", get_rag_retriever_by_kb(kb.id, None, collection_name=kb.collection_name)
+            )
+            if not retriever:
+                return result
+            result["retriever"] = retriever
+            # 传入知识库版本号，知识库内容未变化时直接命中检索结果缓存，不生成查询向量；
+            # 未命中时才生成查询向量（进入查询向量缓存，回答缓存的语义匹配可直接复用）
+            docs = await timer.run(
+                "search", retriever.get_relevant_documents(message, kb_version=kb.version or 0)
+            )
+        # 合并重叠分片，并按场景 token 预算截取
+        result["context"] = pack_context(docs, scenario)
+        logger.info(f"从 {len(knowledge_bases)} 个知识库检索到 {len(docs)} 个相关文档")
+    except Exception as e:
+        logger.error(f"检索失败: {e}")
+        result["context"] = ""
+    return result
+
+
+async def prepare_chat(
+    conversation_id: str,
+    message: str,
+    scenario: str,
+    kb_ids: List[str],
+    timer: StageTimer
+) -> Optional[dict]:
+    """
+    生成回答前的准备流程：对话相关的数据库操作与知识库检索并发执行，知识库只查询一次
+    并发的各阶段各自使用独立的数据库会话（Session 不是线程安全的）
+    :return: 对话不存在时返回 None
+    """
+    conversation, retrieval = await asyncio.gather(
+        timer.run("conversation", asyncio.to_thread(_prepare_conversation, conversation_id, message)),
+        _retrieve_context(kb_ids, message, scenario, timer)
+    )
+    if conversation is None:
+        return None
+
+    knowledge_bases = retrieval["knowledge_bases"]
+    return {
+        **conversation,
+        **retrieval,
+        "knowledge_base_name": "、".join(kb.name for kb in knowledge_bases) or "无",
+        # 单知识库时使用版本号区分缓存；多知识库时以排序后的ID集合作为缓存命名空间
+        "kb_version": (knowledge_bases[0].version or 0) if len(knowledge_bases) == 1 else None,
+        "cache_kb_id": ",".join(sorted(kb.id for kb in knowledge_bases)) or None
+    }
@@ -1,11 +1,45 @@
 
+import os
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from models.chat import Conversation, Message
 from sqlalchemy import desc
 from fastapi.responses import JSONResponse
 
 from models.knowledge_models import KnowledgeBase
+from utils.context_packer import count_tokens, truncate_to_tokens
+
+load_dotenv()
+
+# 对话历史（摘要之外的原始消息）的 token 预算，超过后较早的轮次并入摘要
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# 压缩时保留的最近对话轮数（一问一答为一轮）
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "2"))
+
+ROLE_LABELS = {"user": "用户", "assistant": "助手", "system": "系统"}
+
+
+def format_history(summary, messages, budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    将摘要和消息格式化为紧凑的角色标注文本
+    从最新的消息往前放入，超出预算的较早消息跳过，最新一条消息过长时截断
+    """
+    lines = []
+    used = 0
+    for msg in reversed(messages):
+        line = f"{ROLE_LABELS.get(msg.role, msg.role)}：{msg.content}"
+        tokens = count_tokens(line)
+        if used + tokens > budget:
+            if not lines:
+                lines.append(truncate_to_tokens(line, budget) + "……")
+            break
+        lines.append(line)
+        used += tokens
+    lines.reverse()
+    if summary:
+        lines.insert(0, f"较早对话摘要：{summary}")
+    return "\n".join(lines)
 
 
 
@@ -81,7 +115,7 @@ class ChatService:
         return new_conversation
     
     @staticmethod
-    async def create_new_message(conversation_id: int, role: str, content: str, db: Session) -> Message:
+    def create_new_message(conversation_id: int, role: str, content: str, db: Session) -> Message:
         user_message = Message(
             conversation_id=conversation_id,
             role=role,
@@ -93,17 +127,53 @@ class ChatService:
         return user_message
 
     @staticmethod
-    async def get_conversation_history(conversation_id: int, db: Session):
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.timestamp.asc()).limit(7).all()
-        
-        history = [
-            {"role": msg.role, "content": msg.content, "timestamp": msg.timestamp.isoformat()}
-            for msg in messages[:-1]
-        ]
-        
-        return history
+    def get_conversation_history(conversation_id: str, db: Session, exclude_message_id: int = None):
+        """
+        获取用于提示词的对话历史
+        返回 (历史文本, 是否需要压缩)：历史文本为 “摘要 + 尚未并入摘要的消息” 的紧凑格式；
+        未并入摘要的消息超过 token 预算时只保留最近 K 轮，并提示调用方在后台更新摘要
+        """
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        messages = ChatService._get_unsummarized_messages(conversation, db, exclude_message_id)
+
+        needs_compaction = False
+        if sum(count_tokens(msg.content) for msg in messages) > HISTORY_TOKEN_BUDGET:
+            older, recent = ChatService._split_recent_turns(messages)
+            if older:
+                messages, needs_compaction = recent, True
+
+        summary = conversation.summary if conversation else None
+        return format_history(summary, messages, HISTORY_TOKEN_BUDGET), needs_compaction
+
+    @staticmethod
+    def _get_unsummarized_messages(conversation, db: Session, exclude_message_id: int = None):
+        """获取尚未并入摘要的消息（按时间顺序）"""
+        if not conversation:
+            return []
+        query = db.query(Message).filter(Message.conversation_id == conversation.id)
+        if conversation.summary_until_id:
+            query = query.filter(Message.id > conversation.summary_until_id)
+        if exclude_message_id:
+            query = query.filter(Message.id != exclude_message_id)
+        return query.order_by(Message.timestamp.asc(), Message.id.asc()).all()
+
+    @staticmethod
+    def _split_recent_turns(messages):
+        """按用户消息划分轮次，拆分为 (较早的消息, 最近 K 轮的消息)"""
+        user_positions = [i for i, msg in enumerate(messages) if msg.role == "user"]
+        if HISTORY_RECENT_TURNS <= 0:
+            return messages, []
+        if len(user_positions) <= HISTORY_RECENT_TURNS:
+            return [], messages
+        split = user_positions[-HISTORY_RECENT_TURNS]
+        return messages[:split], messages[split:]
+
+    @staticmethod
+    def get_messages_to_summarize(conversation, db: Session, exclude_message_id: int = None):
+        """获取需要并入摘要的消息：未并入摘要的消息中，除最近 K 轮之外的部分"""
+        messages = ChatService._get_unsummarized_messages(conversation, db, exclude_message_id)
+        older, _ = ChatService._split_recent_turns(messages)
+        return older
 
     @staticmethod
     async def get_conversation_message(conversation_id: int, db: Session) -> Conversation:
@@ -166,7 +236,7 @@ class ChatService:
         return ai_messages
 
     @staticmethod
-    async def get_conversation_info(conversation_id: str, db: Session):
+    def get_conversation_info(conversation_id: str, db: Session):
         conversation = db.query(Conversation).filter(
             Conversation.id == conversation_id,
         ).first()
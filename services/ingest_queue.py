@@ -0,0 +1,202 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from models.knowledge_models import IngestJob, KnowledgeFile
+from services.knowlege_service import get_db_context, process_document_async
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 入库 worker 线程数，0 表示当前进程不处理任务（可单独运行 python -m services.ingest_queue）
+# 注意：集合写锁只在进程内有效，Chroma PersistentClient 也不支持多个进程同时写同一目录，
+# 因此同一个 RAG_DB_PATH 只应由一个进程执行入库：单独运行 worker 进程时，应用进程需设置 INGEST_WORKERS=0
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# 空闲时轮询任务表的间隔（秒）
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2"))
+# 任务心跳超过该时间（秒）未更新，视为 worker 已崩溃，重新入队
+INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", "600"))
+# 单个任务的最大执行次数
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+# 失败重试的退避时间（秒）：第 n 次失败后等待 base * 2^(n-1)，不超过上限
+INGEST_RETRY_BASE_SECONDS = float(os.getenv("INGEST_RETRY_BASE_SECONDS", "30"))
+INGEST_RETRY_MAX_SECONDS = float(os.getenv("INGEST_RETRY_MAX_SECONDS", "900"))
+
+
+def retry_delay(attempts: int) -> float:
+    """第 attempts 次执行失败后的重试等待时间（秒）"""
+    return min(INGEST_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), INGEST_RETRY_MAX_SECONDS)
+
+
+def enqueue_ingest_job(db: Session, file_id: str, kb_id: str, batch_id: Optional[str] = None) -> IngestJob:
+    """创建入库任务（由调用方提交事务）"""
+    job = IngestJob(file_id=file_id, knowledge_base_id=kb_id, batch_id=batch_id, status="queued")
+    db.add(job)
+    return job
+
+
+def get_batch_progress(db: Session, batch_id: str) -> Optional[dict]:
+    """汇总批次内所有入库任务的进度"""
+    rows = db.query(IngestJob.status, func.count(IngestJob.id), func.sum(IngestJob.committed_chunks)).filter(
+        IngestJob.batch_id == batch_id
+    ).group_by(IngestJob.status).all()
+    if not rows:
+        return None
+
+    counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0}
+    committed_chunks = 0
+    for status, count, chunks in rows:
+        counts[status] = count
+        committed_chunks += int(chunks or 0)
+    total = sum(counts.values())
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        **counts,
+        "committed_chunks": committed_chunks,
+        "progress": round((counts["completed"] + counts["failed"] + counts["cancelled"]) / total, 4),
+        "finished": counts["queued"] == 0 and counts["running"] == 0
+    }
+
+
+def requeue_stale_jobs() -> int:
+    """将心跳超时的运行中任务重新入队，保留检查点以便续传"""
+    deadline = datetime.now() - timedelta(seconds=INGEST_JOB_STALE_SECONDS)
+    with get_db_context() as db:
+        jobs = db.query(IngestJob).filter(
+            IngestJob.status == "running",
+            IngestJob.heartbeat_at < deadline
+        ).with_for_update(skip_locked=True).all()
+        for job in jobs:
+            job.status = "queued"
+            job.worker_id = None
+            logger.warning(f"入库任务 {job.id} 心跳超时，已重新入队（检查点: {job.committed_chunks}）")
+        db.commit()
+        return len(jobs)
+
+
+def claim_next_job(worker_id: str) -> Optional[str]:
+    """领取一个排队中且已到重试时间的任务，多进程之间通过 SKIP LOCKED 避免重复领取"""
+    with get_db_context() as db:
+        job = db.query(IngestJob).filter(
+            IngestJob.status == "queued",
+            or_(IngestJob.next_attempt_at.is_(None), IngestJob.next_attempt_at <= datetime.now())
+        ).order_by(IngestJob.created_at).with_for_update(skip_locked=True).first()
+        if not job:
+            return None
+        job.status = "running"
+        job.attempts = (job.attempts or 0) + 1
+        job.worker_id = worker_id
+        job.heartbeat_at = datetime.now()
+        db.commit()
+        return job.id
+
+
+def run_job(job_id: str):
+    """执行任务，失败时按最大次数决定重新入队或标记失败"""
+    with get_db_context() as db:
+        job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+        if not job:
+            return
+        file_id, kb_id = job.file_id, job.knowledge_base_id
+
+    try:
+        process_document_async(file_id, kb_id, job_id=job_id)
+        status, error = "completed", None
+    except Exception as e:
+        status, error = "failed", str(e)
+
+    with get_db_context() as db:
+        job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+        if not job or job.status == "cancelled":
+            # 文件已删除（任务随文件记录级联删除）或任务已被取消
+            return
+        if status == "failed" and job.attempts < INGEST_MAX_ATTEMPTS:
+            # 指数退避后重新入队，避免持续失败的文件被立即反复领取
+            status = "queued"
+            delay = retry_delay(job.attempts)
+            job.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+            logger.warning(
+                f"入库任务 {job_id} 第 {job.attempts} 次执行失败，{delay:.0f}s 后从检查点 {job.committed_chunks} 重试"
+            )
+        elif status == "failed":
+            # 最终失败时才把文件标记为失败
+            file_record = db.query(KnowledgeFile).filter(KnowledgeFile.id == file_id).first()
+            if file_record:
+                file_record.status = "failed"
+        job.status = status
+        job.error = error
+        job.worker_id = None
+        db.commit()
+
+
+class IngestWorkerPool:
+    """入库 worker 池：独立于请求处理线程，从任务表领取并执行入库任务"""
+
+    def __init__(self, workers: int = INGEST_WORKERS, poll_interval: float = INGEST_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    def start(self):
+        if self.workers <= 0 or self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{self._worker_prefix}-{i}",),
+                name=f"ingest-worker-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"已启动 {self.workers} 个入库 worker")
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                requeue_stale_jobs()
+                job_id = claim_next_job(worker_id)
+            except Exception as e:
+                logger.error(f"领取入库任务失败: {e}")
+                job_id = None
+
+            if not job_id:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            logger.info(f"{worker_id} 开始执行入库任务 {job_id}")
+            run_job(job_id)
+
+
+# 全局 worker 池实例
+ingest_worker_pool = IngestWorkerPool()
+
+
+if __name__ == "__main__":
+    # 独立运行入库 worker 进程：python -m services.ingest_queue
+    # 集合写锁只在进程内生效，同一个 RAG_DB_PATH 只运行一个入库进程（应用进程设置 INGEST_WORKERS=0）
+    pool = IngestWorkerPool(workers=max(INGEST_WORKERS, 1))
+    pool.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()
@@ -1,17 +1,28 @@
 
 # 创建知识库记录
+import asyncio
 from contextlib import contextmanager
 from datetime import datetime
 import os
-import shutil
 import uuid
 from models.chat import Conversation
 from utils.file_handle import document_processor
 from fastapi import HTTPException
 import logging
+from sqlalchemy import func
 from models.database import SessionLocal, get_db
-from models.knowledge_models import KnowledgeBase, KnowledgeFile
-from utils.file_handle import UPLOAD_DIR
+from models.knowledge_models import IngestJob, KnowledgeBase, KnowledgeFile
+from utils.file_handle import (
+    MAX_ARCHIVE_SIZE,
+    TEMP_UPLOAD_DIR,
+    UPLOAD_DIR,
+    FileTooLargeError,
+    IngestCancelledError,
+    compute_file_hash,
+    extract_archive_pdfs,
+    is_archive,
+    save_upload_file,
+)
 from utils.retriever import ChromaRetriever
 
 
@@ -42,6 +53,12 @@ async def get_all_knowledge(db):
 async def get_knowledge_base_by_id(kb_id, db):
     return db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
 
+# 根据ID列表批量获取知识库记录（保持传入顺序）
+def get_knowledge_bases_by_ids(kb_ids, db):
+    kbs = db.query(KnowledgeBase).filter(KnowledgeBase.id.in_(kb_ids)).all()
+    kb_map = {kb.id: kb for kb in kbs}
+    return [kb_map[kb_id] for kb_id in dict.fromkeys(kb_ids) if kb_id in kb_map]
+
 # 更新知识库记录
 async def update_knowledge_base(db, kb_id, kb_data):
     kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
@@ -63,9 +80,37 @@ async def update_knowledge_base(db, kb_id, kb_data):
     db.refresh(kb)
     return kb
 
+# 递增知识库内容版本号（由调用方提交事务）
+def bump_kb_version(db, kb_id):
+    db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).update(
+        {KnowledgeBase.version: func.coalesce(KnowledgeBase.version, 0) + 1},
+        synchronize_session=False
+    )
+
+# 按已入库文件重新统计知识库的文件数和分片总数（由调用方提交事务）
+def refresh_kb_counts(db, kb):
+    file_count, chunk_count = db.query(
+        func.count(KnowledgeFile.id), func.coalesce(func.sum(KnowledgeFile.chunk_count), 0)
+    ).filter(
+        KnowledgeFile.knowledge_base_id == kb.id,
+        KnowledgeFile.status == "completed"
+    ).one()
+    kb.file_count = file_count
+    kb.chunk_count = int(chunk_count)
+    kb.updated_at = datetime.now()
+
+# 查找知识库中内容相同（哈希一致）且未失败的文件，避免同一内容重复入库
+def find_duplicate_file(db, kb_id, file_hash):
+    return db.query(KnowledgeFile).filter(
+        KnowledgeFile.knowledge_base_id == kb_id,
+        KnowledgeFile.file_hash == file_hash,
+        KnowledgeFile.status != "failed"
+    ).order_by(KnowledgeFile.uploaded_at).first()
+
 # 上传文档到知识库
-async def upload_document(kb_id, file, background_tasks, db):
+async def upload_document(kb_id, file, db):
     # from utils.file_handle import save_document_to_knowledge_base
+    from services.ingest_queue import enqueue_ingest_job
 
     kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
     if not kb:
@@ -93,16 +138,24 @@ async def upload_document(kb_id, file, background_tasks, db):
     # )
 
     try:
-        # 保存文件
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # 分块流式保存文件，同时计算大小和哈希（不阻塞事件循环）
+        file_size, file_hash = await save_upload_file(file, save_path)
 
         # 验证文件保存成功
         if not os.path.exists(save_path):
             raise HTTPException(status_code=500, detail="文件保存失败")
-        
-        # 获取文件大小
-        file_size = os.path.getsize(save_path)
+
+        # 相同内容已在知识库中时复用已有文件记录，不重复写入向量
+        existing = find_duplicate_file(db, kb_id, file_hash)
+        if existing:
+            os.remove(save_path)
+            return {
+                "success": True,
+                "message": "文件内容已存在于知识库中，未重复入库",
+                "file_id": existing.id,
+                "filename": existing.filename,
+                "duplicate": True
+            }
         
         # 创建文件记录
         file_record = KnowledgeFile(
@@ -110,28 +163,34 @@ async def upload_document(kb_id, file, background_tasks, db):
             filename=file.filename,
             file_path=save_path,
             file_size=file_size,
+            file_hash=file_hash,
             file_type="pdf",
             status="pending"
         )
         
         db.add(file_record)
+        db.flush()
+        
+        # 创建持久化入库任务，由入库 worker 池处理
+        job = enqueue_ingest_job(db, file_record.id, kb_id)
         db.commit()
         db.refresh(file_record)
         
-        # 启动后台任务处理文档
-        background_tasks.add_task(
-            process_document_async,
-            file_record.id,
-            kb_id
-        )
-        
         return {
             "success": True,
             "message": "文件上传成功，正在后台处理",
             "file_id": file_record.id,
+            "job_id": job.id,
             "filename": file.filename
         }
         
+    except FileTooLargeError as e:
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        return {
+            "success": False,
+            "message": str(e)
+        }
     except Exception as e:
         # 清理已保存的文件（如果存在）
         if os.path.exists(save_path):
@@ -144,6 +203,87 @@ async def upload_document(kb_id, file, background_tasks, db):
             "message": "文件上传失败"
         }
 
+# 批量上传文档（多个文件或单个 zip/tar 压缩包）
+async def upload_documents_batch(kb_id, files, db):
+    from services.ingest_queue import enqueue_ingest_job
+
+    kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
+    if not kb:
+        raise HTTPException(status_code=404, detail="知识库不存在")
+
+    saved = []
+    try:
+        for file in files:
+            if is_archive(file.filename):
+                # 压缩包先流式落盘，再在线程中逐个条目流式解压
+                archive_path = os.path.join(TEMP_UPLOAD_DIR, f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}")
+                try:
+                    await save_upload_file(file, archive_path, MAX_ARCHIVE_SIZE)
+                    saved.extend(await asyncio.to_thread(extract_archive_pdfs, archive_path, UPLOAD_DIR))
+                finally:
+                    if os.path.exists(archive_path):
+                        os.remove(archive_path)
+            else:
+                save_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}")
+                saved.append({"filename": file.filename, "file_path": save_path})
+                file_size, file_hash = await save_upload_file(file, save_path)
+                saved[-1].update(file_size=file_size, file_hash=file_hash)
+
+        if not saved:
+            return {
+                "success": False,
+                "message": "未找到可处理的PDF文件"
+            }
+
+        # 与知识库中已有文件或本批次前面的文件内容相同时复用已有记录，删除多余的副本
+        batch_id = str(uuid.uuid4())
+        file_records = []
+        duplicates = []
+        new_by_hash = {}
+        for item in saved:
+            existing = new_by_hash.get(item["file_hash"]) or find_duplicate_file(db, kb_id, item["file_hash"])
+            if existing:
+                os.remove(item["file_path"])
+                duplicates.append({"file_id": existing.id, "filename": item["filename"], "duplicate": True})
+                continue
+            file_record = KnowledgeFile(
+                knowledge_base_id=kb_id,
+                filename=item["filename"],
+                file_path=item["file_path"],
+                file_size=item["file_size"],
+                file_hash=item["file_hash"],
+                file_type="pdf",
+                status="pending"
+            )
+            db.add(file_record)
+            db.flush()
+            new_by_hash[item["file_hash"]] = file_record
+            file_records.append(file_record)
+
+        # 所有文件记录和入库任务在同一个事务中创建
+        for file_record in file_records:
+            enqueue_ingest_job(db, file_record.id, kb_id, batch_id=batch_id)
+        db.commit()
+
+        return {
+            "success": True,
+            "message": f"{len(file_records)} 个文件上传成功，正在后台处理"
+                       + (f"，{len(duplicates)} 个文件内容已存在，未重复入库" if duplicates else ""),
+            "batch_id": batch_id,
+            "files": [{"file_id": record.id, "filename": record.filename} for record in file_records] + duplicates
+        }
+
+    except Exception as e:
+        db.rollback()
+        for item in saved:
+            if os.path.exists(item["file_path"]):
+                os.remove(item["file_path"])
+        logger.error(f"批量上传失败: {e}")
+        return {
+            "success": False,
+            "message": str(e) if isinstance(e, (FileTooLargeError, ValueError)) else "批量上传失败"
+        }
+
 # 删除知识库记录
 async def delete_knowledge_base(db, kb_id):
     from utils.file_handle import UPLOAD_DIR, document_processor
@@ -183,6 +323,66 @@ async def delete_knowledge_base(db, kb_id):
         print(f"删除知识库失败: {e}")
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
     
+# 从知识库中删除单个文件
+async def delete_knowledge_file(db, kb_id, file_id):
+    kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
+    if not kb:
+        raise HTTPException(status_code=404, detail="知识库不存在")
+
+    file_record = db.query(KnowledgeFile).filter(
+        KnowledgeFile.id == file_id,
+        KnowledgeFile.knowledge_base_id == kb_id
+    ).first()
+    if not file_record:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    try:
+        # 1. 先取消该文件排队中/执行中的入库任务并提交：排队的任务不再被领取，
+        #    执行中的任务在下一批写入前发现取消后停止，并清理删除期间写入的向量
+        cancelled_jobs = db.query(IngestJob).filter(
+            IngestJob.file_id == file_id,
+            IngestJob.status.in_(["queued", "running"])
+        ).update({IngestJob.status: "cancelled", IngestJob.worker_id: None}, synchronize_session=False)
+        db.commit()
+        if cancelled_jobs:
+            logger.info(f"已取消文件 {file_id} 的 {cancelled_jobs} 个入库任务")
+
+        # 2. 按 file_id 分批删除向量（在线程中执行，不阻塞事件循环）
+        deleted_chunks = await asyncio.to_thread(
+            document_processor.delete_file_vectors, kb.collection_name, file_id
+        )
+
+        # 3. 删除文件记录并更新知识库文件数和分片总数
+        file_path = file_record.file_path
+        db.delete(file_record)
+        db.flush()
+        refresh_kb_counts(db, kb)
+        kb.version = (kb.version or 0) + 1
+        db.commit()
+
+        # 4. 清除检索器缓存
+        await ChromaRetriever.clear_retriever_cache(kb_id)
+
+        # 5. 删除物理文件
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+        return {
+            "message": "文件删除成功",
+            "deleted_chunks": deleted_chunks
+        }
+
+    except Exception as e:
+        db.rollback()
+        try:
+            # 入库任务已取消，文件标记为失败，可再次删除
+            file_record.status = "failed"
+            db.commit()
+        except Exception:
+            db.rollback()
+        logger.error(f"删除文件失败: {e}")
+        raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
+
 @contextmanager
 def get_db_context():
     """用于后台任务的数据库会话上下文管理器"""
@@ -195,10 +395,25 @@ def get_db_context():
     finally:
         db.close()
 
-def process_document_async(file_id: str, kb_id: str):
-    """后台处理文档（向量化）"""
+def is_ingest_cancelled(file_id: str, job_id: str = None) -> bool:
+    """文件记录已删除或入库任务已取消（使用独立会话，读取最新状态）"""
+    with get_db_context() as db:
+        if not db.query(KnowledgeFile.id).filter(KnowledgeFile.id == file_id).first():
+            return True
+        if job_id:
+            status = db.query(IngestJob.status).filter(IngestJob.id == job_id).scalar()
+            return status is None or status == "cancelled"
+        return False
+
+def process_document_async(file_id: str, kb_id: str, job_id: str = None):
+    """
+    后台处理文档（向量化）
+    传入 job_id 时从入库任务的检查点续传，并在每批写入后更新检查点；失败状态由任务队列决定
+    每批写入前检查文件是否已被删除，已删除时停止入库并清理已写入的向量
+    """
     
     with get_db_context() as db:
+        file_record = None
         try:
             # 获取文件记录
             file_record = db.query(KnowledgeFile).filter(
@@ -214,15 +429,14 @@ def process_document_async(file_id: str, kb_id: str):
             file_record.status = "processing"
             db.commit()
             
-            # 加载PDF
-            docs = document_processor.load_pdf(file_record.file_path)
-            
-            # 分割文档
-            splits = document_processor.split_documents(docs)
+            # 逐页读取并增量分块（生成器，边解析边写入）
+            pages = document_processor.iter_pdf_pages(file_record.file_path)
+            splits = document_processor.iter_splits(pages)
             
             # 准备文件元数据
             file_metadata = {
                 "file_id": file_record.id,
+                "file_hash": file_record.file_hash or compute_file_hash(file_record.file_path),
                 "filename": file_record.filename,
                 "knowledge_base_id": kb_id,
                 "processed_at": datetime.now().isoformat()
@@ -233,36 +447,56 @@ def process_document_async(file_id: str, kb_id: str):
             if not kb:
                 raise Exception("知识库不存在")
             
+            # 读取任务检查点
+            job = db.query(IngestJob).filter(IngestJob.id == job_id).first() if job_id else None
+
+            def save_checkpoint(committed_chunks: int):
+                if job:
+                    job.committed_chunks = committed_chunks
+                    job.heartbeat_at = datetime.now()
+                # 新分片已可被检索，递增版本号使检索/回答缓存失效，避免缓存遗漏刚写入的内容
+                bump_kb_version(db, kb_id)
+                db.commit()
+
             # 保存到ChromaDB
             chunk_count = document_processor.save_to_chroma(
                 splits=splits,
                 collection_name=kb.collection_name,
-                file_metadata=file_metadata
+                file_metadata=file_metadata,
+                skip_chunks=job.committed_chunks if job else 0,
+                on_batch_committed=save_checkpoint,
+                is_cancelled=lambda: is_ingest_cancelled(file_id, job_id)
             )
+
+            # 最后一批写入后再确认一次，避免删除与最后一批写入交错时留下向量
+            if is_ingest_cancelled(file_id, job_id):
+                raise IngestCancelledError(f"文件 {file_id} 已删除")
             
-            # 更新文件记录
+            # 更新文件记录，递增版本号使缓存失效
             file_record.status = "completed"
             file_record.chunk_count = chunk_count
             file_record.processed_at = datetime.now()
+            bump_kb_version(db, kb_id)
             db.commit()
 
-            # 更新知识库文件计数
-            new_count  = db.query(KnowledgeFile).filter(
-                KnowledgeFile.knowledge_base_id == kb_id,
-                KnowledgeFile.status == "completed"
-            ).count()
-            
+            # 更新知识库文件数和分片总数
             kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
-            kb.file_count = new_count
-            kb.updated_at = datetime.now()
-            
+            refresh_kb_counts(db, kb)
             db.commit()
             logger.info(f"文档处理完成: {file_record.filename}, 分片数: {chunk_count}")
             
         except Exception as e:
-            # 更新状态为失败
-            if file_record:
+            db.rollback()
+            if isinstance(e, IngestCancelledError) or is_ingest_cancelled(file_id, job_id):
+                # 文件已删除：清理删除过程中可能写入的向量，任务视为结束
+                kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
+                if kb:
+                    document_processor.delete_file_vectors(kb.collection_name, file_id)
+                logger.info(f"文件 {file_id} 已删除，停止入库")
+                return
+            # 更新状态为失败（由任务队列执行时交给队列按重试次数处理）
+            if file_record and not job_id:
                 file_record.status = "failed"
                 db.commit()
             logger.error(f"文档处理失败: {e}")
-            raise
\ No newline at end of file
+            raise
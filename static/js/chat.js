@@ -741,14 +741,18 @@ async function sendMessage() {
         let aiResponse = "";
         let newConversationId = null;
         let conversationTitle = null;
+        // 未接收完整的事件（服务端合并发送的帧可能被拆分到多次读取中）
+        let pending = "";
         
         while (true) {
             const { value, done } = await reader.read();
             if (done) break;
             
             // 解码并处理事件流
-            const chunk = decoder.decode(value, { stream: true });
-            const events = chunk.split('\n\n').filter(event => event.trim() !== '');
+            pending += decoder.decode(value, { stream: true });
+            const parts = pending.split('\n\n');
+            pending = parts.pop();
+            const events = parts.filter(event => event.trim() !== '');
             
             for (const event of events) {
                 if (event.startsWith('data: ')) {
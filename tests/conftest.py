@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+# 测试使用临时目录和内存 SQLite，避免连接 MySQL 或写入项目目录下的向量库、缓存和上传目录
+_tmp_dir = tempfile.mkdtemp(prefix="rag_tests_")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("RAG_DB_PATH", os.path.join(_tmp_dir, "chroma"))
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp_dir, "uploads"))
+os.environ.setdefault("TEMP_UPLOAD_DIR", os.path.join(_tmp_dir, "temp_uploads"))
+os.environ.setdefault("EMBED_CACHE_PATH", os.path.join(_tmp_dir, "embedding_cache.db"))
+os.environ.setdefault("ALIYUN_API_KEY", "test-key")
+os.environ.setdefault("ALIYUN_BASE_URL", "http://localhost")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import pytest
+
+
+@pytest.fixture
+def db_tables():
+    """在内存数据库中建表，测试结束后删除"""
+    from models import chat, knowledge_models, user  # noqa: F401  注册全部表，create_all 需要解析外键
+    from models.database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def make_pdf():
+    """生成每页一段文本的简单 PDF（使用标准字体，仅支持 ASCII 文本）"""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    def make(path, page_texts):
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }))
+        for text in page_texts:
+            page = writer.add_blank_page(width=612, height=792)
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+            })
+            stream = DecodedStreamObject()
+            stream.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1"))
+            page[NameObject("/Contents")] = writer._add_object(stream)
+        with open(path, "wb") as f:
+            writer.write(f)
+        return str(path)
+
+    return make
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from models.database import SessionLocal
+from models.knowledge_models import IngestJob, KnowledgeBase
+from services import knowlege_service
+from services.ingest_queue import get_batch_progress
+from utils import file_handle
+from utils.file_handle import extract_archive_pdfs
+
+
+class FakeUpload:
+    def __init__(self, filename, content):
+        self.filename = filename
+        self._data = io.BytesIO(content)
+
+    async def read(self, size=-1):
+        return self._data.read(size)
+
+
+def write_zip(path, entries):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, content in entries.items():
+            zf.writestr(name, content)
+    return str(path)
+
+
+def test_extract_zip_keeps_only_pdfs(tmp_path):
+    archive = write_zip(tmp_path / "docs.zip", {
+        "a.pdf": b"pdf-a", "nested/b.PDF": b"pdf-b", "notes.txt": b"skip", "dir/": b""
+    })
+    dest = tmp_path / "out"
+    dest.mkdir()
+    extracted = extract_archive_pdfs(archive, str(dest))
+    assert sorted(item["filename"] for item in extracted) == ["a.pdf", "b.PDF"]
+    for item in extracted:
+        with open(item["file_path"], "rb") as f:
+            content = f.read()
+        assert item["file_size"] == len(content)
+        assert item["file_hash"] == hashlib.sha256(content).hexdigest()
+
+
+def test_extract_tar_streams_entries(tmp_path):
+    archive = tmp_path / "docs.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for name, content in {"a.pdf": b"pdf-a", "readme.md": b"skip"}.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tf.addfile(info, io.BytesIO(content))
+    extracted = extract_archive_pdfs(str(archive), str(tmp_path))
+    assert [item["filename"] for item in extracted] == ["a.pdf"]
+
+
+def test_oversized_entry_removes_already_extracted_files(tmp_path):
+    archive = write_zip(tmp_path / "docs.zip", {"small.pdf": b"x", "big.pdf": b"x" * 100})
+    dest = tmp_path / "out"
+    dest.mkdir()
+    with pytest.raises(file_handle.FileTooLargeError):
+        extract_archive_pdfs(archive, str(dest), max_size=10)
+    assert os.listdir(dest) == []
+
+
+def test_entry_count_is_limited(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_handle, "MAX_ARCHIVE_ENTRIES", 2)
+    archive = write_zip(tmp_path / "docs.zip", {f"{i}.pdf": f"pdf-{i}".encode() for i in range(3)})
+    with pytest.raises(ValueError):
+        extract_archive_pdfs(archive, str(tmp_path))
+
+
+@pytest.mark.usefixtures("db_tables")
+def test_batch_upload_of_archive_creates_one_job_per_pdf(tmp_path):
+    db = SessionLocal()
+    try:
+        kb = KnowledgeBase(name="kb", collection_name="kb_batch")
+        db.add(kb)
+        db.commit()
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("a.pdf", b"pdf-a")
+            zf.writestr("b.pdf", b"pdf-b")
+        result = asyncio.run(knowlege_service.upload_documents_batch(kb.id, [
+            FakeUpload("docs.zip", buffer.getvalue()),
+            FakeUpload("c.pdf", b"pdf-c"),
+        ], db))
+
+        assert result["success"]
+        assert sorted(item["filename"] for item in result["files"]) == ["a.pdf", "b.pdf", "c.pdf"]
+        assert db.query(IngestJob).filter(IngestJob.batch_id == result["batch_id"]).count() == 3
+        progress = get_batch_progress(db, result["batch_id"])
+        assert progress["total"] == 3
+        # 压缩包本身不保留在临时目录中
+        assert os.listdir(file_handle.TEMP_UPLOAD_DIR) == []
+    finally:
+        db.close()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError
+
+from utils.async_embedder import AsyncEmbeddingExecutor, TokenBucket
+
+
+class FakeEmbeddings:
+    def __init__(self, failures=0, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.calls = []
+
+    async def create(self, model, input, dimensions, encoding_format):
+        self.calls.append(list(input))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise APIConnectionError(request=httpx.Request("POST", "http://localhost/embeddings"))
+        # 乱序返回，执行器需要按 index 排序
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)), usage=SimpleNamespace(total_tokens=len(input)))
+
+
+def make_executor(embeddings, **kwargs):
+    return AsyncEmbeddingExecutor(
+        SimpleNamespace(embeddings=embeddings), "m", 1,
+        request_bucket=TokenBucket(1000), token_bucket=TokenBucket(100000), **kwargs
+    )
+
+
+def test_token_bucket_queues_reservations_beyond_capacity():
+    bucket = TokenBucket(rate=10, capacity=10)
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.05)
+    # 后来的请求排在欠额之后
+    assert bucket.reserve(5) == pytest.approx(1.0, abs=0.05)
+
+
+def test_embed_awaits_async_client_and_orders_results():
+    embeddings = FakeEmbeddings()
+    executor = make_executor(embeddings)
+    assert asyncio.run(executor.embed(["a", "bbb"])) == [[1.0], [3.0]]
+    assert executor.stats()["tokens"] == 2
+
+
+def test_embed_retries_connection_errors(monkeypatch):
+    monkeypatch.setattr(AsyncEmbeddingExecutor, "_retry_delay", staticmethod(lambda error, attempt: 0))
+    embeddings = FakeEmbeddings(failures=2)
+    executor = make_executor(embeddings, max_retries=3)
+    assert asyncio.run(executor.embed(["a"])) == [[1.0]]
+    assert executor.retries == 2
+    assert len(embeddings.calls) == 3
+
+
+def test_map_ordered_keeps_batches_in_flight_and_in_order():
+    embeddings = FakeEmbeddings(delay=0.05)
+    executor = make_executor(embeddings, concurrency=4)
+
+    async def batches():
+        for i in range(8):
+            yield [str(i) * (i + 1)]
+
+    async def run():
+        start = time.perf_counter()
+        results = [(batch, vectors) async for batch, vectors in executor.map_ordered(batches())]
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(run())
+    assert [batch for batch, _ in results] == [[str(i) * (i + 1)] for i in range(8)]
+    assert [vectors for _, vectors in results] == [[[float(i + 1)]] for i in range(8)]
+    # 8 个批次、并发 4，约两轮请求的时间
+    assert elapsed < 0.05 * 8 * 0.75
@@ -0,0 +1,78 @@
+import asyncio
+
+from utils import background_tasks
+from utils.background_tasks import PostResponseExecutor
+
+
+def test_concurrency_is_bounded_and_queued_tasks_finish_on_stop():
+    executor = PostResponseExecutor(concurrency=2, queue_size=10)
+    active = []
+    peak = []
+
+    async def task(index):
+        active.append(index)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(index)
+
+    async def run():
+        for index in range(5):
+            assert executor.submit(f"task-{index}", task, index)
+        await executor.stop(timeout=5)
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    stats = executor.stats()
+    assert (stats["submitted"], stats["completed"], stats["failed"]) == (5, 5, 0)
+    assert stats["max_queue_depth"] == 5
+
+
+def test_failures_are_counted_and_full_queue_drops_tasks():
+    executor = PostResponseExecutor(concurrency=1, queue_size=1)
+
+    async def failing():
+        raise RuntimeError("title generation failed")
+
+    async def run():
+        assert executor.submit("fail", failing)
+        # worker 尚未取走任务，队列已满
+        assert not executor.submit("dropped", failing)
+        await executor.stop(timeout=5)
+
+    asyncio.run(run())
+    stats = executor.stats()
+    assert (stats["failed"], stats["dropped"], stats["completed"]) == (1, 1, 0)
+
+
+def test_submit_with_db_uses_its_own_session(monkeypatch):
+    sessions = []
+
+    class FakeSession:
+        def __init__(self):
+            self.closed = self.rolled_back = False
+            sessions.append(self)
+
+        def rollback(self):
+            self.rolled_back = True
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(background_tasks, "SessionLocal", FakeSession)
+    executor = PostResponseExecutor(concurrency=1)
+    received = []
+
+    async def save_title(conversation_id, db):
+        received.append((conversation_id, db))
+
+    async def broken(db):
+        raise RuntimeError("db error")
+
+    async def run():
+        executor.submit_with_db("title", save_title, "conv-1")
+        executor.submit_with_db("broken", broken)
+        await executor.stop(timeout=5)
+
+    asyncio.run(run())
+    assert received == [("conv-1", sessions[0])]
+    assert [(s.closed, s.rolled_back) for s in sessions] == [(True, False), (True, True)]
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+
+from models.chat import Conversation, Message
+from models.database import SessionLocal
+from models.knowledge_models import KnowledgeBase
+from models.user import User
+from services import chat_pipeline
+from services.chat_pipeline import StageTimer, prepare_chat
+
+pytestmark = pytest.mark.usefixtures("db_tables")
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.embedded = []
+        self.searched = []
+
+    async def embed(self, text):
+        self.embedded.append(text)
+        return [1.0, 0.0]
+
+    async def get_relevant_documents(self, query, kb_version=None):
+        self.searched.append((query, kb_version))
+        return [Document(page_content="需求文档内容", metadata={"file_id": "f1", "page": 0})]
+
+
+@pytest.fixture
+def conversation_and_kb():
+    db = SessionLocal()
+    try:
+        user = User(username="tester", password="x")
+        kb = KnowledgeBase(name="需求库", collection_name="kb_test", version=3)
+        db.add_all([user, kb])
+        db.flush()
+        conversation = Conversation(user_id=user.id, title="对话")
+        db.add(conversation)
+        db.commit()
+        return conversation.id, kb.id
+    finally:
+        db.close()
+
+
+def test_stage_timer_records_stages():
+    async def stage():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    timer = StageTimer()
+    assert asyncio.run(timer.run("embed", stage())) == "done"
+    timer.mark("prepare")
+    assert timer.timings["embed"] >= 0.01
+    assert timer.server_timing().startswith("embed;dur=")
+    assert "prepare=" in timer.summary()
+
+
+def test_prepare_chat_retrieves_without_embedding_up_front(monkeypatch, conversation_and_kb):
+    conversation_id, kb_id = conversation_and_kb
+    retriever = FakeRetriever()
+
+    async def fake_get_retriever(kb_id, db, collection_name=None):
+        return retriever
+
+    monkeypatch.setattr(chat_pipeline, "get_rag_retriever_by_kb", fake_get_retriever)
+    timer = StageTimer()
+    prepared = asyncio.run(prepare_chat(conversation_id, "登录功能", "testcase_generation", [kb_id], timer))
+
+    # 查询向量只在检索结果缓存未命中时由检索器内部生成，准备阶段不单独请求
+    assert retriever.embedded == []
+    assert retriever.searched == [("登录功能", 3)]
+    assert "需求文档内容" in prepared["context"]
+    assert prepared["kb_version"] == 3
+    assert prepared["cache_kb_id"] == kb_id
+    assert prepared["knowledge_base_name"] == "需求库"
+    assert prepared["retriever"] is retriever
+    assert {"conversation", "kb_lookup", "retriever", "search"} <= set(timer.timings)
+
+    db = SessionLocal()
+    try:
+        messages = db.query(Message).filter(Message.conversation_id == conversation_id).all()
+        assert [(message.role, message.content) for message in messages] == [("user", "登录功能")]
+        assert prepared["user_message_id"] == messages[0].id
+    finally:
+        db.close()
+
+
+def test_prepare_chat_returns_none_for_unknown_conversation():
+    assert asyncio.run(prepare_chat("missing", "hi", "testcase_generation", [], StageTimer())) is None
@@ -0,0 +1,128 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models.chat import Conversation, Message
+from models.database import SessionLocal
+from models.user import User
+from services import chat_service
+from services.chat_service import ChatService, format_history
+from utils import llm_handle
+
+pytestmark = pytest.mark.usefixtures("db_tables")
+
+
+def message(role, content, id=None):
+    return SimpleNamespace(id=id, role=role, content=content)
+
+
+@pytest.fixture
+def conversation_id():
+    """三轮问答（每条消息约 100 token）"""
+    db = SessionLocal()
+    try:
+        user = User(username="tester", password="x")
+        db.add(user)
+        db.flush()
+        conversation = Conversation(user_id=user.id, title="对话")
+        db.add(conversation)
+        db.flush()
+        for turn in range(3):
+            db.add(Message(conversation_id=conversation.id, role="user", content=f"问题{turn} " + "需求" * 50))
+            db.flush()
+            db.add(Message(conversation_id=conversation.id, role="assistant", content=f"回答{turn} " + "用例" * 50))
+            db.flush()
+        db.commit()
+        return conversation.id
+    finally:
+        db.close()
+
+
+def message_ids(conversation_id):
+    db = SessionLocal()
+    try:
+        return [m.id for m in db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.id)]
+    finally:
+        db.close()
+
+
+def read_conversation(conversation_id):
+    db = SessionLocal()
+    try:
+        return db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    finally:
+        db.close()
+
+
+def test_format_history_keeps_newest_messages_within_budget():
+    messages = [message("user", "旧问题 " * 50), message("assistant", "旧回答"), message("user", "新问题")]
+    history = format_history("用户在设计登录模块", messages, budget=20)
+    assert history.splitlines() == ["较早对话摘要：用户在设计登录模块", "助手：旧回答", "用户：新问题"]
+    # 最新一条消息单独超出预算时截断
+    truncated = format_history(None, [message("user", "很长的问题" * 100)], budget=10)
+    assert truncated.startswith("用户：") and truncated.endswith("……")
+
+
+def test_split_recent_turns(monkeypatch):
+    messages = [message(role, f"{role}{i}") for i in range(3) for role in ("user", "assistant")]
+    older, recent = ChatService._split_recent_turns(messages)
+    assert [m.content for m in older] == ["user0", "assistant0"]
+    assert [m.content for m in recent] == ["user1", "assistant1", "user2", "assistant2"]
+
+    monkeypatch.setattr(chat_service, "HISTORY_RECENT_TURNS", 5)
+    assert ChatService._split_recent_turns(messages) == ([], messages)
+
+
+def test_history_over_budget_keeps_recent_turns_and_requests_compaction(conversation_id, monkeypatch):
+    db = SessionLocal()
+    try:
+        history, needs_compaction = ChatService.get_conversation_history(conversation_id, db)
+        assert not needs_compaction and "问题0" in history
+
+        monkeypatch.setattr(chat_service, "HISTORY_TOKEN_BUDGET", 500)
+        history, needs_compaction = ChatService.get_conversation_history(conversation_id, db)
+        assert needs_compaction
+        assert "问题0" not in history and "问题1" in history and "回答2" in history
+    finally:
+        db.close()
+
+
+def test_summary_update_is_conditional_on_previous_state(conversation_id):
+    ids = message_ids(conversation_id)
+    db = SessionLocal()
+    try:
+        assert llm_handle._save_summary(conversation_id, "摘要一", None, ids[1], db)
+        # 以过期的 summary_until_id 开始的任务不能覆盖较新的摘要
+        assert not llm_handle._save_summary(conversation_id, "过期摘要", None, ids[0], db)
+        assert llm_handle._save_summary(conversation_id, "摘要二", ids[1], ids[3], db)
+    finally:
+        db.close()
+    conversation = read_conversation(conversation_id)
+    assert (conversation.summary, conversation.summary_until_id) == ("摘要二", ids[3])
+
+
+def test_generate_summary_folds_older_turns(conversation_id, monkeypatch):
+    prompts = []
+
+    class FakeModel:
+        async def ainvoke(self, prompt):
+            prompts.append(prompt)
+            return SimpleNamespace(content="讨论了登录需求")
+
+    monkeypatch.setattr(llm_handle, "_get_cached_llm_model", lambda: FakeModel())
+    ids = message_ids(conversation_id)
+    db = SessionLocal()
+    try:
+        asyncio.run(llm_handle.generate_and_update_summary(conversation_id, db=db))
+        # 已并入摘要的消息不再出现在历史中，摘要放在最前面
+        history, needs_compaction = ChatService.get_conversation_history(conversation_id, db)
+    finally:
+        db.close()
+
+    assert len(prompts) == 1 and "问题0" in str(prompts[0]) and "问题1" not in str(prompts[0])
+    conversation = read_conversation(conversation_id)
+    assert (conversation.summary, conversation.summary_until_id) == ("讨论了登录需求", ids[1])
+    assert history.startswith("较早对话摘要：讨论了登录需求")
+    assert "问题0" not in history and "问题1" in history
+    assert not needs_compaction
@@ -0,0 +1,76 @@
+from langchain_core.documents import Document
+
+from utils.context_packer import merge_chunks, pack_context
+from utils.tokens import estimate_tokens
+
+
+def doc(text, **metadata):
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_merges_overlapping_document_scope_chunks():
+    docs = [
+        doc("A" * 1000, file_id="f1", start_index=0, offset_scope="document"),
+        doc("B" * 1000, file_id="f1", start_index=800, offset_scope="document"),
+    ]
+    merged = merge_chunks(docs)
+    assert len(merged) == 1
+    assert merged[0].page_content == "A" * 1000 + "B" * 800
+
+
+def test_merges_adjacent_chunks_and_keeps_gaps_separate():
+    docs = [
+        doc("abc", file_id="f1", start_index=0, offset_scope="document"),
+        doc("def", file_id="f1", start_index=3, offset_scope="document"),
+        doc("xyz", file_id="f1", start_index=100, offset_scope="document"),
+    ]
+    assert [d.page_content for d in merge_chunks(docs)] == ["abcdef", "xyz"]
+
+
+def test_legacy_page_offsets_do_not_merge_across_pages():
+    # 旧数据的 start_index 为页内偏移，不同页都从 0 开始
+    docs = [
+        doc("page0" * 200, source="a.pdf", page=0, start_index=0),
+        doc("page3" * 200, source="a.pdf", page=3, start_index=0),
+        doc("tail0" * 200, source="a.pdf", page=0, start_index=800),
+    ]
+    merged = merge_chunks(docs)
+    assert len(merged) == 2
+    assert merged[0].metadata["page"] == 0
+    assert merged[0].page_content.startswith("page0") and "tail0" in merged[0].page_content
+    assert merged[1].page_content == "page3" * 200
+
+
+def test_legacy_chunk_without_page_is_not_merged():
+    docs = [
+        doc("one", source="a.pdf", start_index=0),
+        doc("two", source="a.pdf", start_index=0),
+    ]
+    assert [d.page_content for d in merge_chunks(docs)] == ["one", "two"]
+
+
+def test_output_keeps_relevance_order():
+    docs = [
+        doc("first", file_id="f2", start_index=0, offset_scope="document"),
+        doc("second", file_id="f1", start_index=5, offset_scope="document"),
+        doc("third", file_id="f1", start_index=0, offset_scope="document"),
+    ]
+    # 合并片段的排名取其中最靠前的分片，片段内容按偏移量顺序拼接
+    assert [d.page_content for d in merge_chunks(docs)] == ["first", "thirdsecond"]
+
+
+def test_pack_context_respects_budget():
+    docs = [doc("甲" * 50), doc("乙" * 50), doc("丙" * 50)]
+    context = pack_context(docs, budget=110)
+    assert "甲" * 50 in context and "乙" * 50 in context
+    assert "丙" not in context
+
+
+def test_pack_context_truncates_single_oversized_chunk():
+    context = pack_context([doc("字" * 500)], budget=20)
+    assert 0 < len(context) < 500
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("测试用例") == 5
+    assert estimate_tokens("a" * 40) == 11
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from utils.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "cache.db"), max_bytes=10 ** 9)
+
+
+def stored_bytes(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+
+def test_round_trip_and_hit_stats(cache):
+    cache.put_many(["你好 世界"], [[0.5, 1.5, 2.5]], "m", 3)
+    # 规范化后相同的文本命中同一条缓存
+    assert cache.get_many(["你好   世界", "other"], "m", 3) == [[0.5, 1.5, 2.5], None]
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_key_depends_on_model_and_dimensions(cache):
+    cache.put_many(["text"], [[1.0, 2.0]], "m1", 2)
+    assert cache.get_many(["text"], "m2", 2) == [None]
+    assert cache.get_many(["text"], "m1", 4) == [None]
+
+
+def test_duplicate_keys_counted_once(cache):
+    cache.put_many(["a  b", "a b"], [[1.0] * 4, [2.0] * 4], "m", 4)
+    assert cache._total_bytes == stored_bytes(cache) == 16
+    assert cache.get_many(["a b"], "m", 4) == [[2.0] * 4]
+
+    # 覆盖已有条目时不重复计入大小
+    cache.put_many(["a b"], [[3.0] * 4], "m", 4)
+    assert cache._total_bytes == stored_bytes(cache) == 16
+
+
+def test_put_many_with_more_keys_than_sqlite_variable_limit(cache):
+    texts = [f"text-{i}" for i in range(1200)]
+    cache.put_many(texts, [[float(i)] for i in range(1200)], "m", 1)
+    cache.put_many(texts, [[float(i)] for i in range(1200)], "m", 1)
+    assert cache._total_bytes == stored_bytes(cache) == 1200 * 4
+    assert cache.get_many(texts[-2:], "m", 1) == [[1198.0], [1199.0]]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_bytes=40)
+    for i in range(5):
+        cache.put_many([f"t{i}"], [[float(i)] * 2], "m", 2)
+    cache.get_many(["t0"], "m", 2)
+    cache.put_many(["t5"], [[5.0] * 2], "m", 2)
+    assert cache.evictions > 0
+    assert cache._total_bytes == stored_bytes(cache) <= 40
+    assert cache.get_many(["t0", "t5"], "m", 2) == [[0.0, 0.0], [5.0, 5.0]]
+
+
+def test_get_or_compute_only_requests_misses(cache):
+    cache.put_many(["cached"], [[1.0]], "m", 1)
+    requested = []
+
+    def compute(texts):
+        requested.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    vectors = cache.get_or_compute(["cached", "new", "new"], "m", 1, compute)
+    assert vectors == [[1.0], [3.0], [3.0]]
+    assert requested == [["new"]]
+
+
+def test_aget_or_compute(cache):
+    async def compute(texts):
+        return [[2.0] for _ in texts]
+
+    assert asyncio.run(cache.aget_or_compute(["x"], "m", 1, compute)) == [[2.0]]
+    assert cache.get_many(["x"], "m", 1) == [[2.0]]
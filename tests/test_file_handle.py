@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import io
+import threading
+import uuid
+
+import chromadb
+import pytest
+from langchain_core.documents import Document
+
+from utils import file_handle
+from utils.file_handle import IngestCancelledError, document_processor, get_ingest_loop, make_chunk_id
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setattr(document_processor, "chromadb_client", chromadb.EphemeralClient())
+
+    async def fake_embed(executor, texts):
+        # 不请求嵌入接口，按文本长度生成固定向量
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    monkeypatch.setattr(document_processor, "_aembed_batch", fake_embed)
+    return document_processor
+
+
+def splits(texts):
+    offset = 0
+    for text in texts:
+        yield Document(page_content=text, metadata={"start_index": offset, "offset_scope": "document"})
+        offset += len(text)
+
+
+def save(processor, collection_name, file_id, texts, **kwargs):
+    return asyncio.run(processor.save_to_chroma_async(
+        splits(texts),
+        collection_name,
+        file_metadata={"file_id": file_id, "file_hash": f"{file_id}-hash"},
+        batch_size=2,
+        **kwargs
+    ))
+
+
+def test_resume_skips_committed_chunks(processor):
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    texts = ["c0", "c1", "c2", "c3", "c4"]
+    committed = []
+    assert save(processor, name, "file-a", texts, skip_chunks=2, on_batch_committed=committed.append) == 5
+    assert committed == [4, 5]
+    documents = processor.chromadb_client.get_collection(name).get()["documents"]
+    assert sorted(documents) == ["c2", "c3", "c4"]
+
+
+def test_chunk_id_is_deterministic_and_scoped_by_file():
+    chunk_id = make_chunk_id("kb_1", "file-a", "hash", 0, "text")
+    assert chunk_id == make_chunk_id("kb_1", "file-a", "hash", 0, "text")
+    assert chunk_id.startswith("kb_1_")
+    assert chunk_id != make_chunk_id("kb_1", "file-b", "hash", 0, "text")
+    assert chunk_id != make_chunk_id("kb_1", "file-a", "hash", 1, "text")
+    assert chunk_id != make_chunk_id("kb_1", "file-a", "hash", 0, "other")
+
+
+def test_reprocessing_a_file_overwrites_its_chunks(processor):
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    texts = ["first chunk", "second chunk", "third chunk"]
+    assert save(processor, name, "file-a", texts) == 3
+    assert save(processor, name, "file-a", texts) == 3
+    assert processor.chromadb_client.get_collection(name).count() == 3
+
+
+def test_delete_file_vectors_only_removes_that_file(processor):
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    save(processor, name, "file-a", ["a0", "a1", "a2"])
+    save(processor, name, "file-b", ["b0", "b1"])
+    collection = processor.chromadb_client.get_collection(name)
+    assert collection.count() == 5
+
+    assert processor.delete_file_vectors(name, "file-b") == 2
+    remaining = collection.get(include=["metadatas"])
+    assert {metadata["file_id"] for metadata in remaining["metadatas"]} == {"file-a"}
+
+
+def test_cancellation_stops_before_next_write(processor):
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    checks = []
+
+    def is_cancelled():
+        checks.append(True)
+        return len(checks) > 1
+
+    with pytest.raises(IngestCancelledError):
+        save(processor, name, "file-a", ["c0", "c1", "c2", "c3"], is_cancelled=is_cancelled)
+    assert processor.chromadb_client.get_collection(name).count() == 2
+
+
+def test_concurrent_jobs_share_one_ingest_event_loop(processor, monkeypatch):
+    loops = []
+
+    async def fake_embed(executor, texts):
+        loops.append(asyncio.get_running_loop())
+        return [[1.0, 0.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(processor, "_aembed_batch", fake_embed)
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    threads = [
+        threading.Thread(target=processor.save_to_chroma, args=(splits([f"{file_id}-0", f"{file_id}-1"]), name),
+                         kwargs={"file_metadata": {"file_id": file_id, "file_hash": file_id}})
+        for file_id in ("file-a", "file-b")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 各 worker 线程的入库协程都在同一个事件循环中执行，共用该循环上的嵌入客户端连接池
+    assert len(loops) == 2 and loops[0] is loops[1] is get_ingest_loop()
+    assert processor.chromadb_client.get_collection(name).count() == 4
+
+
+def test_chunks_are_embedded_and_written_in_batches(processor, monkeypatch):
+    embed_sizes = []
+    writes = []
+
+    async def fake_embed(executor, texts):
+        embed_sizes.append(len(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    original_write = processor._write_batch
+
+    def record_write(collection, **kwargs):
+        writes.append(len(kwargs["ids"]))
+        original_write(collection, **kwargs)
+
+    monkeypatch.setattr(processor, "_aembed_batch", fake_embed)
+    monkeypatch.setattr(processor, "_write_batch", record_write)
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    assert save(processor, name, "file-a", [f"chunk {i}" for i in range(5)]) == 5
+    # 每批一次嵌入请求、一次写入
+    assert embed_sizes == [2, 2, 1]
+    assert writes == [2, 2, 1]
+    assert processor.chromadb_client.get_collection(name).count() == 5
+
+
+def test_iter_pdf_pages_reads_pages_lazily(make_pdf, tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", ["first page", "second page", "third page"])
+    pages = document_processor.iter_pdf_pages(path)
+    first = next(pages)
+    assert first.page_content == "first page"
+    assert first.metadata["page"] == 0
+    assert [page.page_content for page in pages] == ["second page", "third page"]
+
+
+def test_iter_splits_offsets_are_continuous_across_pages():
+    pages = [
+        Document(page_content="a" * 150, metadata={"page": 0}),
+        Document(page_content="b" * 150, metadata={"page": 1}),
+    ]
+    chunks = list(document_processor.iter_splits(iter(pages), chunk_size=100, chunk_overlap=0))
+    assert [chunk.metadata["start_index"] for chunk in chunks] == [0, 100, 150, 250]
+    assert {chunk.metadata["offset_scope"] for chunk in chunks} == {"document"}
+    assert [chunk.metadata["page"] for chunk in chunks] == [0, 0, 1, 1]
+    # 偏移量对应各页文本依次拼接后的位置
+    text = "".join(page.page_content for page in pages)
+    assert all(text[chunk.metadata["start_index"]:].startswith(chunk.page_content) for chunk in chunks)
+
+
+def test_iter_splits_pulls_pages_on_demand():
+    consumed = []
+
+    def pages():
+        for page_no in range(100):
+            consumed.append(page_no)
+            yield Document(page_content=f"page {page_no} " * 5, metadata={"page": page_no})
+
+    chunks = document_processor.iter_splits(pages())
+    next(chunks)
+    assert consumed == [0]
+
+
+class FakeUpload:
+    def __init__(self, content):
+        self._data = io.BytesIO(content)
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        return self._data.read(size)
+
+
+def test_save_upload_file_streams_in_chunks_and_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_handle, "UPLOAD_CHUNK_SIZE", 4)
+    content = b"0123456789"
+    upload = FakeUpload(content)
+    path = tmp_path / "saved.pdf"
+    size, digest = asyncio.run(file_handle.save_upload_file(upload, str(path)))
+    assert (size, digest) == (10, hashlib.sha256(content).hexdigest())
+    assert path.read_bytes() == content
+    # 10 字节按 4 字节分块读取：3 次读到数据 + 1 次读到结尾
+    assert upload.reads == 4
+    assert file_handle.compute_file_hash(str(path)) == digest
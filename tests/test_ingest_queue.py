@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.database import SessionLocal
+from models.knowledge_models import IngestJob, KnowledgeBase, KnowledgeFile
+from services import ingest_queue
+
+
+pytestmark = pytest.mark.usefixtures("db_tables")
+
+
+def add_job(status="queued", created_offset=0, **fields):
+    db = SessionLocal()
+    try:
+        kb = KnowledgeBase(name="kb", collection_name=f"kb_{datetime.now().timestamp()}_{created_offset}")
+        db.add(kb)
+        db.flush()
+        file_record = KnowledgeFile(knowledge_base_id=kb.id, filename="a.pdf", file_path="a.pdf")
+        db.add(file_record)
+        db.flush()
+        job = IngestJob(
+            file_id=file_record.id,
+            knowledge_base_id=kb.id,
+            status=status,
+            created_at=datetime.now() + timedelta(seconds=created_offset),
+            **fields
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def get_job(job_id):
+    db = SessionLocal()
+    try:
+        return db.query(IngestJob).filter(IngestJob.id == job_id).first()
+    finally:
+        db.close()
+
+
+def test_claim_next_job_takes_oldest_queued_job():
+    newer = add_job(created_offset=10)
+    older = add_job(created_offset=0)
+    add_job(status="running", created_offset=-10)
+
+    assert ingest_queue.claim_next_job("worker-1") == older
+    job = get_job(older)
+    assert job.status == "running"
+    assert job.attempts == 1
+    assert job.worker_id == "worker-1"
+    assert job.heartbeat_at is not None
+
+    assert ingest_queue.claim_next_job("worker-2") == newer
+    assert ingest_queue.claim_next_job("worker-3") is None
+
+
+def test_claim_next_job_waits_for_retry_backoff():
+    add_job(next_attempt_at=datetime.now() + timedelta(minutes=5))
+    assert ingest_queue.claim_next_job("worker-1") is None
+
+    ready = add_job(next_attempt_at=datetime.now() - timedelta(seconds=1))
+    assert ingest_queue.claim_next_job("worker-1") == ready
+
+
+def test_requeue_stale_jobs_keeps_checkpoint():
+    stale = add_job(
+        status="running",
+        worker_id="dead-worker",
+        committed_chunks=40,
+        heartbeat_at=datetime.now() - timedelta(seconds=ingest_queue.INGEST_JOB_STALE_SECONDS + 60)
+    )
+    alive = add_job(status="running", worker_id="live-worker", heartbeat_at=datetime.now())
+
+    assert ingest_queue.requeue_stale_jobs() == 1
+    job = get_job(stale)
+    assert job.status == "queued"
+    assert job.worker_id is None
+    assert job.committed_chunks == 40
+    assert get_job(alive).status == "running"
+
+
+def test_failed_job_is_requeued_with_backoff(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(ingest_queue, "process_document_async", fail)
+    job_id = add_job()
+    assert ingest_queue.claim_next_job("worker-1") == job_id
+
+    before = datetime.now()
+    ingest_queue.run_job(job_id)
+    job = get_job(job_id)
+    assert job.status == "queued"
+    assert job.error == "embedding failed"
+    assert job.next_attempt_at >= before + timedelta(seconds=ingest_queue.retry_delay(1) - 1)
+    # 未到重试时间前不会被再次领取
+    assert ingest_queue.claim_next_job("worker-1") is None
+
+
+def test_retry_delay_grows_exponentially_with_cap():
+    delays = [ingest_queue.retry_delay(attempt) for attempt in range(1, 12)]
+    assert delays[1] == 2 * delays[0]
+    assert delays == sorted(delays)
+    assert delays[-1] == ingest_queue.INGEST_RETRY_MAX_SECONDS
+
+
+
+def test_cancelled_job_is_not_overwritten(monkeypatch):
+    job_id = add_job()
+    assert ingest_queue.claim_next_job("worker-1") == job_id
+
+    def cancel_during_processing(*args, **kwargs):
+        db = SessionLocal()
+        db.query(IngestJob).filter(IngestJob.id == job_id).update({IngestJob.status: "cancelled"})
+        db.commit()
+        db.close()
+
+    monkeypatch.setattr(ingest_queue, "process_document_async", cancel_during_processing)
+    ingest_queue.run_job(job_id)
+    assert get_job(job_id).status == "cancelled"
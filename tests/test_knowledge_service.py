@@ -0,0 +1,232 @@
+import asyncio
+import io
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from models.database import SessionLocal
+from models.knowledge_models import IngestJob, KnowledgeBase, KnowledgeFile
+from services import knowlege_service
+from utils import file_handle
+
+pytestmark = pytest.mark.usefixtures("db_tables")
+
+
+def add_file(tmp_path, **job_fields):
+    db = SessionLocal()
+    try:
+        kb = KnowledgeBase(name="kb", collection_name="kb_test", version=0)
+        db.add(kb)
+        db.flush()
+        file_path = tmp_path / "a.pdf"
+        file_path.write_bytes(b"%PDF")
+        file_record = KnowledgeFile(
+            knowledge_base_id=kb.id, filename="a.pdf", file_path=str(file_path), file_hash="hash", status="pending"
+        )
+        db.add(file_record)
+        db.flush()
+        job = IngestJob(file_id=file_record.id, knowledge_base_id=kb.id, status="running", **job_fields)
+        db.add(job)
+        db.commit()
+        return kb.id, file_record.id, job.id
+    finally:
+        db.close()
+
+
+def read_kb(kb_id):
+    db = SessionLocal()
+    try:
+        return db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
+    finally:
+        db.close()
+
+
+def read_job(job_id):
+    db = SessionLocal()
+    try:
+        return db.query(IngestJob).filter(IngestJob.id == job_id).first()
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    monkeypatch.setattr(
+        knowlege_service.document_processor, "iter_pdf_pages",
+        lambda file_path: iter([Document(page_content="text", metadata={"page": 0})])
+    )
+
+
+def test_every_committed_batch_bumps_kb_version(tmp_path, monkeypatch, fake_pdf):
+    kb_id, file_id, job_id = add_file(tmp_path)
+    versions = []
+
+    def fake_save(splits, collection_name, file_metadata, skip_chunks, on_batch_committed, is_cancelled):
+        for committed in (2, 4, 5):
+            on_batch_committed(committed)
+            # 每批提交后新分片即可被检索，版本号必须已变化，缓存才不会遗漏它们
+            versions.append(read_kb(kb_id).version)
+        return 5
+
+    monkeypatch.setattr(knowlege_service.document_processor, "save_to_chroma", fake_save)
+    knowlege_service.process_document_async(file_id, kb_id, job_id)
+
+    assert versions == [1, 2, 3]
+    assert read_job(job_id).committed_chunks == 5
+    kb = read_kb(kb_id)
+    assert kb.version == 4
+    assert kb.file_count == 1
+    assert kb.chunk_count == 5
+
+
+def test_resume_passes_checkpoint_to_writer(tmp_path, monkeypatch, fake_pdf):
+    kb_id, file_id, job_id = add_file(tmp_path, committed_chunks=40)
+    seen = {}
+
+    def fake_save(splits, collection_name, file_metadata, skip_chunks, on_batch_committed, is_cancelled):
+        seen["skip_chunks"] = skip_chunks
+        return 40
+
+    monkeypatch.setattr(knowlege_service.document_processor, "save_to_chroma", fake_save)
+    knowlege_service.process_document_async(file_id, kb_id, job_id)
+    assert seen["skip_chunks"] == 40
+
+
+class FakeUpload:
+    def __init__(self, filename, content):
+        self.filename = filename
+        self._data = io.BytesIO(content)
+
+    async def read(self, size=-1):
+        return self._data.read(size)
+
+
+def upload(kb_id, filename, content):
+    db = SessionLocal()
+    try:
+        return asyncio.run(knowlege_service.upload_document(kb_id, FakeUpload(filename, content), db))
+    finally:
+        db.close()
+
+
+def file_rows(kb_id):
+    db = SessionLocal()
+    try:
+        return db.query(KnowledgeFile).filter(KnowledgeFile.knowledge_base_id == kb_id).all()
+    finally:
+        db.close()
+
+
+def test_uploading_same_content_twice_reuses_existing_file(tmp_path):
+    kb_id, existing_id, _ = add_file(tmp_path)
+
+    first = upload(kb_id, "new.pdf", b"new content")
+    assert first["success"] and "duplicate" not in first
+    stored_files = len(os.listdir(file_handle.UPLOAD_DIR))
+    second = upload(kb_id, "copy.pdf", b"new content")
+
+    # 相同内容不会再创建文件记录和入库任务，向量不会重复写入
+    assert second["duplicate"] is True
+    assert second["file_id"] == first["file_id"]
+    assert len(file_rows(kb_id)) == 2
+    # 重复上传的副本已从磁盘删除
+    assert len(os.listdir(file_handle.UPLOAD_DIR)) == stored_files
+
+
+def test_failed_file_with_same_content_can_be_uploaded_again(tmp_path):
+    kb_id, _, _ = add_file(tmp_path)
+    first = upload(kb_id, "a.pdf", b"content")
+    db = SessionLocal()
+    db.query(KnowledgeFile).filter(KnowledgeFile.id == first["file_id"]).update({KnowledgeFile.status: "failed"})
+    db.commit()
+    db.close()
+
+    second = upload(kb_id, "a.pdf", b"content")
+    assert "duplicate" not in second
+    assert second["file_id"] != first["file_id"]
+
+
+def test_batch_upload_skips_duplicates_within_batch_and_kb(tmp_path):
+    kb_id, _, _ = add_file(tmp_path)
+    existing = upload(kb_id, "a.pdf", b"existing")
+
+    db = SessionLocal()
+    try:
+        result = asyncio.run(knowlege_service.upload_documents_batch(kb_id, [
+            FakeUpload("b.pdf", b"existing"),
+            FakeUpload("c.pdf", b"fresh"),
+            FakeUpload("d.pdf", b"fresh"),
+        ], db))
+    finally:
+        db.close()
+
+    files = {item["filename"]: item for item in result["files"]}
+    assert files["b.pdf"]["file_id"] == existing["file_id"]
+    assert files["d.pdf"]["file_id"] == files["c.pdf"]["file_id"]
+    assert "duplicate" not in files["c.pdf"]
+    db = SessionLocal()
+    try:
+        assert db.query(IngestJob).filter(IngestJob.batch_id == result["batch_id"]).count() == 1
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def deleted_vectors(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        knowlege_service.document_processor, "delete_file_vectors",
+        lambda collection_name, file_id: calls.append((collection_name, file_id)) or 0
+    )
+    return calls
+
+
+def test_delete_file_cancels_running_job(tmp_path, deleted_vectors):
+    kb_id, file_id, job_id = add_file(tmp_path)
+    assert not knowlege_service.is_ingest_cancelled(file_id, job_id)
+
+    db = SessionLocal()
+    try:
+        asyncio.run(knowlege_service.delete_knowledge_file(db, kb_id, file_id))
+    finally:
+        db.close()
+
+    assert read_job(job_id).status == "cancelled"
+    assert knowlege_service.is_ingest_cancelled(file_id, job_id)
+    assert deleted_vectors == [("kb_test", file_id)]
+    assert read_kb(kb_id).version == 1
+
+
+def test_file_deleted_during_ingest_cleans_up_vectors(tmp_path, monkeypatch, fake_pdf, deleted_vectors):
+    kb_id, file_id, job_id = add_file(tmp_path)
+
+    def fake_save(splits, collection_name, file_metadata, skip_chunks, on_batch_committed, is_cancelled):
+        on_batch_committed(2)
+        # 最后一批写入前文件被删除
+        db = SessionLocal()
+        db.query(IngestJob).filter(IngestJob.id == job_id).update({IngestJob.status: "cancelled"})
+        db.commit()
+        db.close()
+        return 2
+
+    monkeypatch.setattr(knowlege_service.document_processor, "save_to_chroma", fake_save)
+    knowlege_service.process_document_async(file_id, kb_id, job_id)
+
+    assert deleted_vectors == [("kb_test", file_id)]
+    assert read_kb(kb_id).chunk_count in (None, 0)
+
+
+def test_oversized_upload_is_rejected_and_removed(tmp_path, monkeypatch):
+    kb_id, _, _ = add_file(tmp_path)
+    monkeypatch.setattr(file_handle, "UPLOAD_CHUNK_SIZE", 4)
+    stored_files = len(os.listdir(file_handle.UPLOAD_DIR))
+
+    async def save_with_limit(upload_file, save_path):
+        return await file_handle.save_upload_file(upload_file, save_path, max_size=10)
+
+    monkeypatch.setattr(knowlege_service, "save_upload_file", save_with_limit)
+    result = upload(kb_id, "big.pdf", b"x" * 11)
+    assert result["success"] is False
+    assert "超过限制" in result["message"]
+    assert len(os.listdir(file_handle.UPLOAD_DIR)) == stored_files
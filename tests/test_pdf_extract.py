@@ -0,0 +1,36 @@
+import pytest
+
+from utils import file_handle, pdf_extract
+from utils.file_handle import document_processor
+
+
+@pytest.fixture
+def parallel_extraction(monkeypatch):
+    monkeypatch.setattr(pdf_extract, "PDF_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(pdf_extract, "PDF_PAGES_PER_TASK", 2)
+    monkeypatch.setattr(file_handle, "PDF_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(file_handle, "PDF_PARALLEL_MIN_PAGES", 4)
+    yield
+    pdf_extract.shutdown_pool()
+
+
+def test_extract_page_range_clamps_to_page_count(make_pdf, tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", ["p0", "p1", "p2"])
+    assert pdf_extract.count_pages(path) == 3
+    assert pdf_extract.extract_page_range(path, 1, 10) == [(1, "p1"), (2, "p2")]
+
+
+def test_parallel_extraction_keeps_page_order(make_pdf, tmp_path, parallel_extraction):
+    texts = [f"page {i}" for i in range(7)]
+    path = make_pdf(tmp_path / "doc.pdf", texts)
+    pages = list(document_processor.iter_pdf_pages(path))
+    assert [page.page_content for page in pages] == texts
+    assert [page.metadata["page"] for page in pages] == list(range(7))
+    assert pages[0].metadata["total_pages"] == 7
+
+
+def test_small_files_are_parsed_in_process(make_pdf, tmp_path, parallel_extraction):
+    path = make_pdf(tmp_path / "doc.pdf", ["only", "two"])
+    assert [page.page_content for page in document_processor.iter_pdf_pages(path)] == ["only", "two"]
+    # 页数低于阈值时不启动进程池
+    assert pdf_extract._pool is None
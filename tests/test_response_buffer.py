@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from models.chat import Conversation, Message
+from models.database import SessionLocal
+from models.user import User
+from utils.response_buffer import ResponseBuffer
+
+pytestmark = pytest.mark.usefixtures("db_tables")
+
+
+@pytest.fixture
+def conversation_id():
+    db = SessionLocal()
+    try:
+        user = User(username="tester", password="x")
+        db.add(user)
+        db.flush()
+        conversation = Conversation(user_id=user.id, title="对话")
+        db.add(conversation)
+        db.commit()
+        return conversation.id
+    finally:
+        db.close()
+
+
+def assistant_messages(conversation_id):
+    db = SessionLocal()
+    try:
+        return [
+            (message.id, message.content)
+            for message in db.query(Message).filter(Message.conversation_id == conversation_id).all()
+        ]
+    finally:
+        db.close()
+
+
+def test_getvalue_joins_parts_once():
+    buffer = ResponseBuffer("c")
+    for part in ["```", "json", "\n{}"]:
+        buffer.append(part)
+    assert len(buffer) == 10
+    assert buffer.startswith("```json")
+    assert buffer._parts == ["```json\n{}"]
+    buffer.append("!")
+    assert buffer.getvalue() == "```json\n{}!"
+
+
+def test_checkpoints_update_one_message_row(conversation_id):
+    async def run():
+        buffer = ResponseBuffer(conversation_id, checkpoint_tokens=2, checkpoint_seconds=3600)
+        snapshots = []
+        for token, text in enumerate(["a", "b", "c", "d", "e"], start=1):
+            buffer.append(text)
+            buffer.maybe_checkpoint(token)
+            await asyncio.sleep(0.05)  # 让后台检查点写入完成
+            snapshots.append(assistant_messages(conversation_id))
+        message_id = await buffer.flush()
+        return message_id, snapshots
+
+    message_id, snapshots = asyncio.run(run())
+    # 第 2、4 个 token 时写入检查点：首次插入，之后更新同一行
+    assert snapshots[0] == []
+    assert snapshots[1] == [(message_id, "ab")]
+    assert snapshots[3] == [(message_id, "abcd")]
+    assert assistant_messages(conversation_id) == [(message_id, "abcde")]
+
+
+def test_flush_without_new_content_does_not_write(conversation_id):
+    async def run():
+        buffer = ResponseBuffer(conversation_id)
+        assert await buffer.flush() is None
+        buffer.append("完整回答")
+        message_id = await buffer.flush()
+        assert await buffer.flush() == message_id
+        return message_id
+
+    message_id = asyncio.run(run())
+    assert assistant_messages(conversation_id) == [(message_id, "完整回答")]
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from utils.response_cache import ResponseCache, _parse_scenario_ttls
+
+ARGS = ("testcase_generation", "kb", 1, "context", "登录功能")
+
+
+def make_embed(vector, calls):
+    async def embed():
+        calls.append(True)
+        return vector
+    return embed
+
+
+def test_alookup_skips_embedding_on_exact_hit():
+    cache = ResponseCache()
+    cache.store(*ARGS, "答案")
+    calls = []
+    assert asyncio.run(cache.alookup(*ARGS, embed=make_embed([1.0, 0.0], calls))) == ("答案", None)
+    assert calls == []
+
+
+def test_alookup_embeds_lazily_for_semantic_match():
+    cache = ResponseCache(similarity_threshold=0.9)
+    cache.store("testcase_generation", "kb", 1, "context", "登录功能", "答案", query_vector=[1.0, 0.0])
+    calls = []
+    answer, vector = asyncio.run(cache.alookup(
+        "testcase_generation", "kb", 1, "other context", "登录的功能", embed=make_embed([0.99, 0.05], calls)
+    ))
+    assert answer == "答案"
+    assert vector == [0.99, 0.05]
+    assert calls == [True]
+    assert cache.semantic_hits == 1
+
+
+def test_alookup_survives_embedding_failure():
+    cache = ResponseCache()
+
+    async def failing_embed():
+        raise RuntimeError("embedding api down")
+
+    assert asyncio.run(cache.alookup("s", "kb", 1, "c", "q", embed=failing_embed)) == (None, None)
+    assert cache.misses == 1
+
+
+def test_exact_and_semantic_entries_are_scoped_by_kb_version():
+    cache = ResponseCache(similarity_threshold=0.9)
+    cache.store(*ARGS, "答案", query_vector=[1.0, 0.0])
+    assert cache.lookup(*ARGS) == "答案"
+    assert cache.lookup("testcase_generation", "kb", 1, "c", "登录的功能", query_vector=[0.99, 0.05]) == "答案"
+    # 知识库版本变化后，精确和语义缓存都不再命中
+    assert cache.lookup("testcase_generation", "kb", 2, "context", "登录功能", query_vector=[1.0, 0.0]) is None
+    # 相似度低于阈值不命中
+    assert cache.lookup("testcase_generation", "kb", 1, "c", "注册功能", query_vector=[0.5, 0.85]) is None
+    assert (cache.exact_hits, cache.semantic_hits, cache.misses) == (1, 1, 2)
+
+
+def test_entries_expire_by_scenario_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ResponseCache(default_ttl=60, scenario_ttls=_parse_scenario_ttls("devops_tool=10, testcase_generation=0"))
+    assert cache.ttl_for("devops_tool") == 10 and cache.ttl_for("product_manual") == 60
+
+    cache.store("devops_tool", "kb", 1, "c", "q", "运维答案", query_vector=[1.0, 0.0])
+    cache.store("product_manual", "kb", 1, "c", "q", "手册答案")
+    # TTL 为 0 的场景不缓存
+    cache.store(*ARGS, "答案")
+    assert cache.lookup(*ARGS) is None
+
+    now[0] += 11
+    assert cache.lookup("devops_tool", "kb", 1, "c", "q", query_vector=[1.0, 0.0]) is None
+    assert cache.lookup("product_manual", "kb", 1, "c", "q") == "手册答案"
+
+
+def test_semantic_bucket_keeps_most_recent_entries():
+    cache = ResponseCache(similarity_threshold=0.99, semantic_size=2)
+    vectors = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+    for index, vector in enumerate(vectors):
+        cache.store("s", "kb", 1, "c", f"q{index}", f"a{index}", query_vector=vector)
+    assert cache.lookup("s", "kb", 1, "c", "other", query_vector=vectors[0]) is None
+    assert cache.lookup("s", "kb", 1, "c", "other", query_vector=vectors[2]) == "a2"
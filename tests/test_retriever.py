@@ -0,0 +1,266 @@
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+import pytest
+
+from services import knowlege_service  # noqa: F401  应用中服务模块先于检索模块导入（两者循环引用）
+from utils import retriever as retriever_module
+from utils.retriever import ChromaRetriever
+from utils.ttl_cache import TTLCache
+
+# 查询文本 -> 查询向量（未列出的文本使用默认向量）
+QUERY_VECTORS = {
+    "backup": [1.0, 0.0, 0.0],
+    "restore": [0.0, 1.0, 0.0],
+}
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def create(self, model, input, dimensions, encoding_format):
+        texts = input if isinstance(input, list) else [input]
+        self.calls.append(texts)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        data = [
+            SimpleNamespace(index=i, embedding=QUERY_VECTORS.get(text, [0.0, 0.0, 1.0]))
+            for i, text in enumerate(texts)
+        ]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=len(texts)))
+
+
+@pytest.fixture
+def chroma_client():
+    return chromadb.EphemeralClient()
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    monkeypatch.setattr(retriever_module, "embedding_cache", None)
+    monkeypatch.setattr(retriever_module, "_query_embedding_cache", TTLCache(max_size=100))
+    monkeypatch.setattr(retriever_module, "_retrieval_result_cache", TTLCache(max_size=100))
+
+
+def make_collection(chroma_client, docs):
+    """docs: [(文本, 向量)]"""
+    name = f"kb_{uuid.uuid4().hex[:8]}"
+    collection = chroma_client.create_collection(name)
+    collection.add(
+        ids=[f"id{i}" for i in range(len(docs))],
+        documents=[text for text, _ in docs],
+        embeddings=[unit(vector) for _, vector in docs],
+        metadatas=[{"position": i} for i in range(len(docs))]
+    )
+    return name
+
+
+def make_retriever(chroma_client, docs, delay=0.0):
+    retriever = ChromaRetriever(make_collection(chroma_client, docs), chroma_client, embedding_dimensions=3)
+    retriever.openai_client = SimpleNamespace(embeddings=FakeEmbeddings(delay))
+    return retriever
+
+
+BACKUP_DOCS = [
+    ("mysqldump backup", [1.0, 0.05, 0.0]),
+    ("restore from dump", [0.0, 1.0, 0.05]),
+    ("unrelated", [0.0, 0.05, 1.0]),
+]
+
+
+def test_concurrent_retrievals_do_not_block_each_other(chroma_client):
+    retriever = make_retriever(chroma_client, BACKUP_DOCS, delay=0.2)
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            retriever.get_relevant_documents("backup", n_results=1),
+            retriever.get_relevant_documents("restore", n_results=1),
+        )
+        return results, time.perf_counter() - start
+
+    (backup, restore), elapsed = asyncio.run(run())
+    assert backup[0].page_content == "mysqldump backup"
+    assert restore[0].page_content == "restore from dump"
+    # 两次嵌入请求并发进行，总耗时接近单次请求
+    assert elapsed < 0.35
+
+
+def test_query_awaits_embedding_and_returns_chroma_results(chroma_client):
+    retriever = make_retriever(chroma_client, BACKUP_DOCS)
+    results = asyncio.run(retriever.query("restore", n_results=2))
+    assert results["documents"][0][0] == "restore from dump"
+
+
+def test_retrieval_results_are_cached_until_kb_version_changes(chroma_client):
+    retriever = make_retriever(chroma_client, BACKUP_DOCS)
+    first = asyncio.run(retriever.get_relevant_documents("backup", n_results=1, kb_version=1))
+    assert first[0].page_content == "mysqldump backup"
+
+    # 新写入的分片更接近查询，但版本号未变时仍返回缓存结果
+    retriever.collection.add(ids=["new"], documents=["backup runbook"], embeddings=[unit([1.0, 0.0, 0.0])])
+    cached = asyncio.run(retriever.get_relevant_documents("Backup!", n_results=1, kb_version=1))
+    assert cached[0].page_content == "mysqldump backup"
+    assert retriever_module.get_retrieval_cache_stats()["hits"] == 1
+
+    fresh = asyncio.run(retriever.get_relevant_documents("backup", n_results=1, kb_version=2))
+    assert fresh[0].page_content == "backup runbook"
+
+
+@pytest.fixture
+def retriever_factory(chroma_client, monkeypatch):
+    """get_rag_retriever_by_kb 使用内存 Chroma 客户端和小容量检索器缓存，并记录创建次数"""
+    created = []
+
+    class CountingRetriever(ChromaRetriever):
+        def __init__(self, *args, **kwargs):
+            created.append(kwargs["collection_name"])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(retriever_module, "_get_cached_chroma_client", lambda: chroma_client)
+    monkeypatch.setattr(retriever_module, "ChromaRetriever", CountingRetriever)
+    monkeypatch.setattr(retriever_module, "_retriever_cache", TTLCache(max_size=2, ttl=60, refresh_on_access=True))
+    fake_client = SimpleNamespace(embeddings=FakeEmbeddings())
+    monkeypatch.setattr(retriever_module, "_get_async_openai_client", lambda: fake_client)
+    return SimpleNamespace(created=created, embeddings=fake_client.embeddings)
+
+
+def test_concurrent_requests_create_one_retriever_per_kb(chroma_client, retriever_factory):
+    name = make_collection(chroma_client, BACKUP_DOCS)
+
+    async def run():
+        return await asyncio.gather(*(
+            retriever_module.get_rag_retriever_by_kb("kb-1", None, collection_name=name) for _ in range(5)
+        ))
+
+    retrievers = asyncio.run(run())
+    assert all(retriever is retrievers[0] for retriever in retrievers)
+    assert retriever_factory.created == [name]
+    assert not retriever_module._retriever_creation_locks
+
+
+def test_retriever_cache_evicts_least_recently_used(chroma_client, retriever_factory):
+    names = [make_collection(chroma_client, BACKUP_DOCS) for _ in range(3)]
+
+    async def get(kb_id, name):
+        return await retriever_module.get_rag_retriever_by_kb(kb_id, None, collection_name=name)
+
+    asyncio.run(get("kb-0", names[0]))
+    asyncio.run(get("kb-1", names[1]))
+    asyncio.run(get("kb-0", names[0]))  # kb-0 最近使用过，kb-1 成为最久未使用
+    asyncio.run(get("kb-2", names[2]))
+
+    stats = retriever_module.get_retriever_cache_stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert "kb-1" not in retriever_module._retriever_cache
+    assert "kb-0" in retriever_module._retriever_cache
+
+    assert asyncio.run(ChromaRetriever.clear_retriever_cache("kb-0")) is True
+    assert asyncio.run(ChromaRetriever.clear_retriever_cache("kb-0")) is False
+
+
+def test_missing_collection_returns_none_and_is_not_cached(retriever_factory):
+    assert asyncio.run(retriever_module.get_rag_retriever_by_kb("kb-x", None, collection_name="absent")) is None
+    assert "kb-x" not in retriever_module._retriever_cache
+
+
+def test_federated_retrieve_merges_by_distance_and_embeds_once(chroma_client, retriever_factory):
+    ops = SimpleNamespace(id="kb-ops", name="运维", collection_name=make_collection(chroma_client, [
+        ("ops backup", [1.0, 0.3, 0.0]),
+        ("ops restore", [0.0, 1.0, 0.0]),
+    ]))
+    dba = SimpleNamespace(id="kb-dba", name="DBA", collection_name=make_collection(chroma_client, [
+        ("dba backup", [1.0, 0.1, 0.0]),
+        ("dba misc", [0.0, 0.0, 1.0]),
+    ]))
+    missing = SimpleNamespace(id="kb-gone", name="已删除", collection_name="absent")
+
+    documents = asyncio.run(retriever_module.federated_retrieve([ops, dba, missing], "backup", n_results=2))
+
+    assert [doc.page_content for doc in documents] == ["dba backup", "ops backup"]
+    assert [doc.metadata["source_kb_id"] for doc in documents] == ["kb-dba", "kb-ops"]
+    assert documents[0].metadata["source_kb_name"] == "DBA"
+    assert documents[0].metadata["distance"] < documents[1].metadata["distance"]
+    # 查询只向量化一次，所有知识库共用
+    assert retriever_factory.embeddings.calls == [["backup"]]
+
+
+def test_batch_retrieval_embeds_misses_in_one_request_and_one_query(chroma_client, monkeypatch):
+    retriever = make_retriever(chroma_client, BACKUP_DOCS)
+    snapshot_queries = []
+    original_query = retriever_module.vector_snapshots.query
+
+    def counting_query(collection, **kwargs):
+        snapshot_queries.append(len(kwargs["query_embeddings"]))
+        return original_query(collection, **kwargs)
+
+    monkeypatch.setattr(retriever_module.vector_snapshots, "query", counting_query)
+    queries = ["backup", "restore", "Backup"]
+    results = asyncio.run(retriever.get_relevant_documents_batch(queries, n_results=1, kb_version=1))
+    assert [docs[0].page_content for docs in results] == ["mysqldump backup", "restore from dump", "mysqldump backup"]
+    # 规范化后相同的查询只向量化一次，所有未命中的查询合并为一次嵌入请求和一次检索
+    assert retriever.openai_client.embeddings.calls == [["backup", "restore"]]
+    assert snapshot_queries == [3]
+
+    # 再次批量检索：已缓存的查询直接复用结果，只处理新查询
+    results = asyncio.run(retriever.get_relevant_documents_batch(["restore", "other"], n_results=1, kb_version=1))
+    assert results[0][0].page_content == "restore from dump"
+    assert results[1][0].page_content == "unrelated"
+    assert retriever.openai_client.embeddings.calls[1:] == [["other"]]
+    assert snapshot_queries[1:] == [1]
+
+
+def test_batch_embedding_requests_are_split_by_api_limit(chroma_client, monkeypatch):
+    monkeypatch.setattr(retriever_module, "QUERY_EMBED_BATCH_SIZE", 2)
+    retriever = make_retriever(chroma_client, BACKUP_DOCS)
+    vectors = asyncio.run(retriever.embed_batch(["backup", "restore", "q3", "backup"]))
+    assert retriever.openai_client.embeddings.calls == [["backup", "restore"], ["q3"]]
+    assert vectors[0] == vectors[3] == QUERY_VECTORS["backup"]
+
+
+def test_mmr_drops_near_duplicates_and_prefers_diverse_candidates():
+    query = [1.0, 0.0, 0.0]
+    candidates = [
+        unit([1.0, 0.1, 0.0]),
+        unit([1.0, 0.11, 0.0]),  # 与第一个几乎相同（重叠分片）
+        unit([0.7, 0.7, 0.0]),
+        unit([0.7, 0.0, 0.7]),
+    ]
+    # 两个候选相关性相同，与已选结果差异更大的优先
+    assert retriever_module.maximal_marginal_relevance(query, candidates, k=3, lambda_mult=0.5) == [0, 3, 2]
+    # 只看相关性时仍会丢弃近似重复
+    assert retriever_module.maximal_marginal_relevance(query, candidates, k=4, lambda_mult=1.0) == [0, 2, 3]
+    assert retriever_module.maximal_marginal_relevance(query, [], k=3) == []
+
+
+def test_search_removes_overlapping_chunks_and_applies_distance_cutoff(chroma_client, monkeypatch):
+    retriever = make_retriever(chroma_client, [
+        ("backup part 1", [1.0, 0.1, 0.0]),
+        ("backup part 1 (overlap)", [1.0, 0.11, 0.0]),
+        ("backup verification", [0.8, -0.6, 0.0]),
+        ("unrelated", [0.0, 0.0, 1.0]),
+    ])
+    results = asyncio.run(retriever.search_by_vector([1.0, 0.0, 0.0], n_results=2))
+    assert [doc.page_content for doc, _ in results] == ["backup part 1", "backup verification"]
+    assert results[0][1] < results[1][1]
+
+    monkeypatch.setattr(retriever_module, "RETRIEVAL_MAX_DISTANCE", 0.1)
+    results = asyncio.run(retriever.search_by_vector([1.0, 0.0, 0.0], n_results=3))
+    assert [doc.page_content for doc, _ in results] == ["backup part 1"]
+
+    # 不做多样化时按距离直接返回 top-k
+    monkeypatch.setattr(retriever_module, "RETRIEVAL_MAX_DISTANCE", 0.0)
+    results = asyncio.run(retriever.search_by_vector([1.0, 0.0, 0.0], n_results=2, diversify=False))
+    assert [doc.page_content for doc, _ in results] == ["backup part 1", "backup part 1 (overlap)"]
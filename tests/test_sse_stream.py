@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from utils.sse_stream import StreamStats, coalesce_tokens, sse_event
+
+
+async def token_stream(tokens, delay=0.0, error=None):
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield token
+    if error:
+        raise error
+
+
+async def collect(agen):
+    return [frame async for frame in agen]
+
+
+def test_first_token_sent_alone_then_coalesced():
+    stats = StreamStats()
+    frames = asyncio.run(collect(coalesce_tokens(token_stream(["a", "b", "c", "d"]), stats, interval=0.5)))
+    assert frames[0] == "a"
+    assert "".join(frames) == "abcd"
+    assert len(frames) == 2
+    assert stats.tokens == 4 and stats.frames == 2
+
+
+def test_flushes_when_buffer_exceeds_max_bytes():
+    frames = asyncio.run(collect(coalesce_tokens(
+        token_stream(["x"] + ["yy"] * 6), interval=10, max_bytes=4
+    )))
+    assert frames == ["x", "yyyy", "yyyy", "yyyy"]
+
+
+def test_flushes_after_interval():
+    frames = asyncio.run(collect(coalesce_tokens(
+        token_stream(["a", "b", "c"], delay=0.05), interval=0.01
+    )))
+    assert frames == ["a", "b", "c"]
+
+
+def test_upstream_error_flushes_buffer_then_raises():
+    async def run():
+        frames = []
+        with pytest.raises(RuntimeError):
+            async for frame in coalesce_tokens(
+                token_stream(["a", "b"], error=RuntimeError("boom")), interval=10
+            ):
+                frames.append(frame)
+        return frames
+
+    assert "".join(asyncio.run(run())) == "ab"
+
+
+def test_closing_consumer_cancels_upstream():
+    state = {"closed": False}
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "t"
+        finally:
+            state["closed"] = True
+
+    async def run():
+        stream = coalesce_tokens(endless(), interval=0.001)
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert state["closed"]
+
+
+def test_sse_event_format():
+    assert sse_event("[DONE]") == b"data: [DONE]\n\n"
+    assert sse_event({"content": "你好"}) == 'data: {"content":"你好"}\n\n'.encode("utf-8")
@@ -0,0 +1,47 @@
+import time
+
+from utils.ttl_cache import TTLCache
+
+
+def test_lru_eviction_calls_on_evict():
+    evicted = []
+    cache = TTLCache(max_size=2, on_evict=lambda key, value: evicted.append((key, value)))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert evicted == [("b", 2)]
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.evictions == 1
+
+
+def test_entries_expire():
+    evicted = []
+    cache = TTLCache(max_size=10, ttl=0.05, on_evict=lambda key, value: evicted.append(key))
+    cache.set("a", 1)
+    cache.set("forever", 2, ttl=0)
+    time.sleep(0.08)
+    assert cache.get("a") is None
+    assert cache.get("forever") == 2
+    assert evicted == ["a"]
+    assert cache.expirations == 1
+
+
+def test_refresh_on_access_extends_ttl():
+    cache = TTLCache(max_size=10, ttl=0.1, refresh_on_access=True)
+    cache.set("a", 1)
+    for _ in range(3):
+        time.sleep(0.06)
+        assert cache.get("a") == 1
+
+
+def test_purge_expired_and_stats():
+    cache = TTLCache(max_size=10, ttl=0.01)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    time.sleep(0.03)
+    assert cache.purge_expired() == 2
+    assert len(cache) == 0
+    cache.get("missing")
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["expirations"] == 2
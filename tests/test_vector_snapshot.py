@@ -0,0 +1,110 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.vector_snapshot import VectorSnapshot, VectorSnapshotRegistry
+
+
+class FakeCollection:
+    def __init__(self, name, embeddings, fail=False):
+        self.name = name
+        self.ids = [f"id{i}" for i in range(len(embeddings))]
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.fail = fail
+        self.loads = 0
+        self.queries = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit, offset):
+        self.loads += 1
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("chroma unavailable")
+        ids = self.ids[offset:offset + limit]
+        return {
+            "ids": ids,
+            "embeddings": self.embeddings[offset:offset + limit],
+            "documents": [f"doc-{vector_id}" for vector_id in ids],
+            "metadatas": [{"id": vector_id} for vector_id in ids],
+        }
+
+    def query(self, query_embeddings, n_results, where, include):
+        self.queries += 1
+        return {"ids": [[]]}
+
+
+def wait_for_build(registry, name):
+    deadline = time.monotonic() + 5
+    while name in registry._building and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # 等待加载线程释放锁
+    assert registry._load_lock.acquire(timeout=5)
+    registry._load_lock.release()
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_snapshot_query_matches_brute_force(dtype):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    snapshot = VectorSnapshot("kb", 8, dtype=dtype, capacity=4)
+    snapshot.upsert([f"id{i}" for i in range(50)], vectors, [str(i) for i in range(50)], [{}] * 50)
+
+    query = rng.normal(size=(1, 8)).astype(np.float32)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query[0] / np.linalg.norm(query[0]))))[:5]
+
+    result = snapshot.query(query, 5, include=["documents"])
+    assert result["ids"][0] == [f"id{i}" for i in expected]
+    assert result["embeddings"] is None
+
+
+def test_snapshot_delete_and_overwrite():
+    snapshot = VectorSnapshot("kb", 2)
+    snapshot.upsert(["a", "b"], [[1, 0], [0, 1]], ["a", "b"], [{}, {}])
+    snapshot.upsert(["b"], [[1, 0.1]], ["b2"], [{}])
+    snapshot.delete(["a"])
+    result = snapshot.query([[1, 0]], 5, include=[])
+    assert result["ids"] == [["b"]]
+    assert result["documents"] == [["b2"]]
+
+
+def test_registry_loads_hot_collection_in_background_and_replays_writes():
+    registry = VectorSnapshotRegistry(enabled=True, min_queries=2, refresh_seconds=0)
+    collection = FakeCollection("kb", [[1, 0], [0, 1]])
+    collection.release.clear()
+
+    registry.query(collection, [[1, 0]], 1, None, [])
+    registry.query(collection, [[1, 0]], 1, None, [])
+    assert "kb" in registry._building
+    # 加载期间本进程的写入和删除会在替换快照前重放
+    registry.upsert("kb", ["new"], [[0.9, 0.1]], ["new"], [{}])
+    registry.delete("kb", ["id0"])
+    collection.release.set()
+    wait_for_build(registry, "kb")
+    assert collection.queries == 2
+
+    result = registry.query(collection, [[1, 0]], 5, None, [])
+    assert result["ids"] == [["new", "id1"]]
+    assert registry.hits == 1
+
+
+def test_load_failure_is_not_retried_within_refresh_interval():
+    registry = VectorSnapshotRegistry(enabled=True, min_queries=1, refresh_seconds=60)
+    collection = FakeCollection("kb", [[1, 0]], fail=True)
+
+    registry.query(collection, [[1, 0]], 1, None, [])
+    wait_for_build(registry, "kb")
+    assert "kb" in registry._skipped
+
+    for _ in range(5):
+        registry.query(collection, [[1, 0]], 1, None, [])
+        wait_for_build(registry, "kb")
+    # 失败后在刷新间隔内不会再启动加载
+    assert collection.loads == 1
+    assert registry.fallbacks == 6
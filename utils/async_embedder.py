@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from threading import Lock
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, RateLimitError
+
+from utils.tokens import estimate_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 单个入库任务同时在途的嵌入请求数
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# 每秒请求数上限（进程内所有入库任务共享），0 表示不限制
+EMBED_REQUESTS_PER_SECOND = float(os.getenv("EMBED_REQUESTS_PER_SECOND", "25"))
+# 每秒 token 数上限（按估算值限流，进程内所有入库任务共享），0 表示不限制
+EMBED_TOKENS_PER_SECOND = float(os.getenv("EMBED_TOKENS_PER_SECOND", "20000"))
+# 429/5xx 时的最大重试次数
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+# 嵌入接口连接池配置
+EMBED_HTTP_MAX_CONNECTIONS = int(os.getenv("EMBED_HTTP_MAX_CONNECTIONS", "50"))
+EMBED_HTTP_TIMEOUT = float(os.getenv("EMBED_HTTP_TIMEOUT", "30"))
+
+
+def create_async_embedding_client(api_key: str, base_url: str, max_retries: Optional[int] = None) -> AsyncOpenAI:
+    """
+    创建带连接池的异步嵌入客户端，底层 HTTP 连接保持长连接复用
+    httpx 连接池绑定首次使用它的事件循环，每个事件循环应只创建一个并一直复用
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=EMBED_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=EMBED_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=60
+        ),
+        timeout=EMBED_HTTP_TIMEOUT
+    )
+    options = {"max_retries": max_retries} if max_retries is not None else {}
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, **options)
+
+
+class TokenBucket:
+    """
+    令牌桶限流器，rate 为每秒补充量，capacity 为桶容量（允许的突发量）
+    用线程锁预占令牌、在各自的事件循环中等待，可被不同线程中的多个事件循环共享
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """预占 amount 个令牌，返回需要等待的秒数（令牌不足时记为欠额，按先后顺序排队）"""
+        if self.rate <= 0:
+            return 0.0
+        # 单次请求超过桶容量时按容量计算，避免永远等待
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(-self._tokens, 0.0) / self.rate
+
+    async def acquire(self, amount: float = 1):
+        """获取 amount 个令牌，不足时等待补充；rate <= 0 时不限流"""
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# 进程内共享的嵌入限流器：所有入库任务（各 worker 线程中的事件循环）共用同一份请求数/token 数配额
+embed_request_bucket = TokenBucket(EMBED_REQUESTS_PER_SECOND)
+embed_token_bucket = TokenBucket(EMBED_TOKENS_PER_SECOND)
+
+
+class AsyncEmbeddingExecutor:
+    """
+    并发嵌入执行器（每个入库任务一个，统计该任务的吞吐量）
+    同时保持多个批次在途，按请求数/token 数双令牌桶限流，429/5xx 时指数退避重试；
+    令牌桶默认使用进程内共享的实例，多个任务并发时合计不超过配置的配额。
+    client 为带连接池的异步客户端（见 create_async_embedding_client），只能在创建它的事件循环中使用
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model_name: str,
+        embedding_dimensions: int,
+        concurrency: int = EMBED_CONCURRENCY,
+        request_bucket: Optional[TokenBucket] = None,
+        token_bucket: Optional[TokenBucket] = None,
+        max_retries: int = EMBED_MAX_RETRIES
+    ):
+        self.client = client
+        self.model_name = model_name
+        self.embedding_dimensions = embedding_dimensions
+        self.concurrency = max(concurrency, 1)
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._request_bucket = request_bucket or embed_request_bucket
+        self._token_bucket = token_bucket or embed_token_bucket
+
+        self.chunks = 0
+        self.tokens = 0
+        self.requests = 0
+        self.retries = 0
+        self._started = time.perf_counter()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """一次请求生成一批文本的向量（带限流和重试）"""
+        estimated = sum(estimate_tokens(text) for text in texts)
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._request_bucket.acquire(1)
+                await self._token_bucket.acquire(estimated)
+                try:
+                    response = await self.client.embeddings.create(
+                        model=self.model_name,
+                        input=texts,
+                        dimensions=self.embedding_dimensions,
+                        encoding_format="float"
+                    )
+                    break
+                except (RateLimitError, APIConnectionError, APITimeoutError, APIStatusError) as e:
+                    status = getattr(e, "status_code", None)
+                    retryable = isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError)) or (
+                        status is not None and status >= 500
+                    )
+                    if not retryable or attempt >= self.max_retries:
+                        raise
+                    self.retries += 1
+                    delay = self._retry_delay(e, attempt)
+                    logger.warning(f"嵌入请求失败（{status or type(e).__name__}），{delay:.1f}s 后第 {attempt + 1} 次重试")
+                    await asyncio.sleep(delay)
+
+        data = sorted(response.data, key=lambda item: item.index)
+        if len(data) != len(texts):
+            raise ValueError(f"Embedding返回数量不匹配: 输入 {len(texts)} 条, 返回 {len(data)} 条")
+
+        self.requests += 1
+        self.chunks += len(texts)
+        usage = getattr(response, "usage", None)
+        self.tokens += usage.total_tokens if usage else estimated
+        return [item.embedding for item in data]
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """优先使用服务端返回的 Retry-After，否则指数退避加随机抖动"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(2 ** attempt, 30) + random.uniform(0, 0.5)
+
+    async def map_ordered(
+        self,
+        batches: AsyncIterator[list],
+        embed_fn: Optional[Callable[[list], Awaitable[List[List[float]]]]] = None
+    ) -> AsyncIterator[Tuple[list, List[List[float]]]]:
+        """
+        并发处理批次并按提交顺序产出 (批次, 向量)
+        最多同时保持 concurrency 个批次在途，消费方处理结果时后续批次仍在请求
+        """
+        embed_fn = embed_fn or self.embed
+        pending = []
+        try:
+            async for batch in batches:
+                pending.append((batch, asyncio.create_task(embed_fn(batch))))
+                if len(pending) >= self.concurrency:
+                    batch, task = pending.pop(0)
+                    yield batch, await task
+            while pending:
+                batch, task = pending.pop(0)
+                yield batch, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """吞吐量统计"""
+        elapsed = time.perf_counter() - self._started
+        return {
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "requests": self.requests,
+            "retries": self.retries,
+            "elapsed": round(elapsed, 2),
+            "chunks_per_second": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+            "tokens_per_second": round(self.tokens / elapsed, 2) if elapsed else 0.0
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+from models.database import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 同时执行的后台任务数（如标题生成是一次完整的 LLM 调用，需要限制并发）
+POST_TASK_CONCURRENCY = int(os.getenv("POST_TASK_CONCURRENCY", "2"))
+# 排队任务数上限，队列满时丢弃新任务
+POST_TASK_QUEUE_SIZE = int(os.getenv("POST_TASK_QUEUE_SIZE", "1000"))
+# 停止时等待队列中任务完成的最长时间（秒）
+POST_TASK_SHUTDOWN_TIMEOUT = float(os.getenv("POST_TASK_SHUTDOWN_TIMEOUT", "10"))
+
+
+class PostResponseExecutor:
+    """
+    响应结束后的后台任务执行器（标题生成、对话摘要、缓存回填等）
+    任务在进程内的有界队列中排队，由固定数量的协程 worker 执行，不占用请求的 HTTP 连接和数据库会话；
+    通过 submit_with_db 提交的任务使用独立的数据库会话
+    """
+
+    def __init__(self, concurrency: int = POST_TASK_CONCURRENCY, queue_size: int = POST_TASK_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def start(self):
+        """启动 worker（需要在事件循环中调用）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"post-response-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"已启动 {self.concurrency} 个后台任务 worker")
+
+    async def stop(self, timeout: float = POST_TASK_SHUTDOWN_TIMEOUT):
+        """等待已排队的任务执行完（最多 timeout 秒）后停止 worker"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"后台任务未在 {timeout}s 内完成，剩余 {self._queue.qsize()} 个任务被丢弃")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, name: str, func: Callable[..., Awaitable], *args, **kwargs) -> bool:
+        """提交后台任务，func 为协程函数；队列已满时丢弃并返回 False"""
+        if not self._workers:
+            self.start()
+        try:
+            self._queue.put_nowait((name, func, args, kwargs, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"后台任务队列已满，丢弃任务: {name}")
+            return False
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def submit_with_db(self, name: str, func: Callable[..., Awaitable], *args, **kwargs) -> bool:
+        """提交需要数据库的后台任务，执行时以关键字参数 db 传入独立会话，任务结束后关闭"""
+        async def run_with_session():
+            db = SessionLocal()
+            try:
+                await func(*args, db=db, **kwargs)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        return self.submit(name, run_with_session)
+
+    async def _worker(self):
+        while True:
+            name, func, args, kwargs, enqueued_at = await self._queue.get()
+            started_at = time.perf_counter()
+            self._total_wait += started_at - enqueued_at
+            self.running += 1
+            try:
+                await func(*args, **kwargs)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"后台任务 {name} 执行失败: {e}", exc_info=True)
+            finally:
+                self.running -= 1
+                self._total_run += time.perf_counter() - started_at
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_depth": self.max_depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "avg_wait_seconds": round(self._total_wait / finished, 4) if finished else 0.0,
+            "avg_run_seconds": round(self._total_run / finished, 4) if finished else 0.0
+        }
+
+
+# 全局后台任务执行器
+post_response_executor = PostResponseExecutor()
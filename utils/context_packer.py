@@ -0,0 +1,182 @@
+import logging
+import os
+from threading import Lock
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from utils.tokens import estimate_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 检索上下文默认 token 预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# 按场景配置 token 预算，格式：testcase_generation=4000,product_manual=2000
+CONTEXT_SCENARIO_BUDGETS = os.getenv("CONTEXT_SCENARIO_BUDGETS", "")
+# 计数使用的 tiktoken 编码（DeepSeek 无公开 tiktoken 编码，用 cl100k_base 近似）
+CONTEXT_TOKENIZER_ENCODING = os.getenv("CONTEXT_TOKENIZER_ENCODING", "cl100k_base")
+# 片段之间的分隔符
+CONTEXT_SEPARATOR = "\n\n"
+
+
+def _parse_scenario_budgets(raw: str) -> Dict[str, int]:
+    budgets = {}
+    for item in raw.split(","):
+        if "=" in item:
+            scenario, budget = item.split("=", 1)
+            budgets[scenario.strip()] = int(budget)
+    return budgets
+
+
+_scenario_budgets = _parse_scenario_budgets(CONTEXT_SCENARIO_BUDGETS)
+
+
+_encoding = None
+_encoding_lock = Lock()
+
+
+def load_encoding():
+    """
+    加载 tiktoken 编码（首次使用可能需要下载词表，应在应用启动时于线程中调用）
+    不可用时（未安装或无法下载词表）保持为 None，计数退回按字符估算
+    """
+    global _encoding
+    with _encoding_lock:
+        if _encoding is not None:
+            return _encoding
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER_ENCODING)
+            logger.info(f"已加载 tiktoken 编码 {CONTEXT_TOKENIZER_ENCODING}")
+        except Exception as e:
+            logger.warning(f"tiktoken 编码 {CONTEXT_TOKENIZER_ENCODING} 不可用，改用估算计数: {e}")
+        return _encoding
+
+
+def _get_encoding():
+    """返回已加载的编码；请求路径上不触发加载，避免下载词表阻塞事件循环"""
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """计算文本 token 数"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使其不超过 max_tokens 个 token"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+    # 估算模式：按比例截断后逐步收缩
+    end = len(text)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = min(end - 1, int(end * max_tokens / estimate_tokens(text[:end])))
+    return text[:max(end, 0)]
+
+
+def get_token_budget(scenario: Optional[str]) -> int:
+    """获取场景对应的上下文 token 预算"""
+    return _scenario_budgets.get(scenario, CONTEXT_TOKEN_BUDGET)
+
+
+def _merge_group_key(metadata: dict) -> Optional[tuple]:
+    """
+    分片的合并分组：只有偏移量可比较的分片才能合并
+    新入库的分片 start_index 为整篇文档内的偏移（offset_scope=document），按文件分组；
+    旧数据的 start_index 是页内偏移（每页从 0 开始），只能在同一页内合并，缺少页码时不合并
+    """
+    start = metadata.get("start_index")
+    file_key = metadata.get("file_id") or metadata.get("source")
+    if start is None or start < 0 or not file_key:
+        return None
+    if metadata.get("offset_scope") == "document":
+        return metadata.get("source_kb_id"), file_key, "document"
+    page = metadata.get("page")
+    if page is None:
+        return None
+    return metadata.get("source_kb_id"), file_key, "page", page
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """
+    合并同一文件中重叠或相邻的分片（依据 file_id 和 start_index）
+    输入按相关性降序，输出同样按相关性降序，合并片段的排名取其中最靠前的分片
+    """
+    groups: Dict[tuple, List[tuple]] = {}
+    standalone = []
+    for rank, doc in enumerate(docs):
+        metadata = doc.metadata or {}
+        group_key = _merge_group_key(metadata)
+        if group_key is None:
+            standalone.append((rank, doc))
+            continue
+        groups.setdefault(group_key, []).append((metadata["start_index"], rank, doc))
+
+    spans = list(standalone)
+    for chunks in groups.values():
+        chunks.sort(key=lambda item: item[0])
+        start, rank, doc = chunks[0]
+        text, end, metadata = doc.page_content, start + len(doc.page_content), dict(doc.metadata)
+        for next_start, next_rank, next_doc in chunks[1:]:
+            if next_start <= end:
+                # 重叠或首尾相接：只追加超出当前片段末尾的部分
+                next_end = next_start + len(next_doc.page_content)
+                if next_end > end:
+                    text += next_doc.page_content[end - next_start:]
+                    end = next_end
+                rank = min(rank, next_rank)
+                continue
+            spans.append((rank, Document(page_content=text, metadata=metadata)))
+            text, end, rank, metadata = (
+                next_doc.page_content, next_start + len(next_doc.page_content), next_rank, dict(next_doc.metadata)
+            )
+        spans.append((rank, Document(page_content=text, metadata=metadata)))
+
+    spans.sort(key=lambda item: item[0])
+    return [doc for _, doc in spans]
+
+
+def format_chunk(doc: Document) -> str:
+    """格式化单个片段，多知识库检索时附带来源"""
+    source = (doc.metadata or {}).get("source_kb_name")
+    return f"【来源：{source}】{doc.page_content}" if source else doc.page_content
+
+
+def pack_context(docs: List[Document], scenario: Optional[str] = None, budget: Optional[int] = None) -> str:
+    """
+    将检索到的分片打包为提示词上下文
+    先合并重叠/相邻分片，再按相关性顺序在 token 预算内依次放入，放不下的片段跳过
+    :param docs: 按相关性降序排列的分片
+    :param scenario: 场景名称，用于确定 token 预算
+    :param budget: 显式指定 token 预算，优先于场景配置
+    """
+    budget = get_token_budget(scenario) if budget is None else budget
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    parts = []
+    used = 0
+    for doc in merge_chunks(docs):
+        text = format_chunk(doc)
+        tokens = count_tokens(text) + (separator_tokens if parts else 0)
+        if used + tokens <= budget:
+            parts.append(text)
+            used += tokens
+        elif not parts:
+            # 最相关的片段单独超出预算时截断放入，保证上下文不为空
+            parts.append(truncate_to_tokens(text, budget))
+            used = budget
+            break
+    logger.info(f"上下文打包: {len(docs)} 个分片 -> {len(parts)} 个片段, 约 {used}/{budget} tokens")
+    return CONTEXT_SEPARATOR.join(parts)
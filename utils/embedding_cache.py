@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+from threading import Lock
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./cache/embedding_cache.db")
+# 缓存文件中向量数据的总大小上限（字节），超过后按最近访问时间淘汰
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# 向量存储精度：float32 或 float16（float16 体积减半）
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float32")
+# SQLite 单条语句的参数数量有限，IN 查询按该大小分批
+SQLITE_IN_BATCH_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：统一 Unicode 形式并折叠空白字符"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    基于 SQLite 的嵌入向量持久化缓存
+    以 (模型, 维度, 规范化文本) 的哈希为键，向量以 float32/float16 二进制存储，
+    总大小超过上限时按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(self, path: str, max_bytes: int, dtype: str = "float32"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"不支持的向量存储精度: {dtype}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+        self._total_bytes = row[0]
+
+    @staticmethod
+    def make_key(text: str, model: str, dimensions: int) -> str:
+        """生成缓存键：sha256(模型, 维度, 规范化文本)"""
+        raw = f"{model}\x00{dimensions}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str], model: str, dimensions: int) -> List[Optional[List[float]]]:
+        """批量查询缓存，未命中的位置返回 None"""
+        keys = [self.make_key(text, model, dimensions) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for offset in range(0, len(unique_keys), SQLITE_IN_BATCH_SIZE):
+                part = unique_keys[offset:offset + SQLITE_IN_BATCH_SIZE]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], model: str, dimensions: int):
+        """批量写入缓存，写入后按需淘汰"""
+        now = time.time()
+        # 规范化后相同的文本对应同一个键，只保留最后一条，避免重复计入总大小
+        rows: Dict[str, tuple] = {}
+        for text, vector in zip(texts, vectors):
+            if not vector:
+                continue
+            key = self.make_key(text, model, dimensions)
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            rows[key] = (key, self.dtype, blob, len(blob), now)
+        if not rows:
+            return
+
+        with self._lock:
+            keys = list(rows)
+            existing = 0
+            for offset in range(0, len(keys), SQLITE_IN_BATCH_SIZE):
+                part = keys[offset:offset + SQLITE_IN_BATCH_SIZE]
+                placeholders = ",".join("?" * len(part))
+                existing += self._conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})",
+                    part
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dtype, vector, nbytes, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                list(rows.values())
+            )
+            self._total_bytes += sum(row[3] for row in rows.values()) - existing
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """超过大小上限时淘汰最久未访问的向量，直到降到上限的 90%"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access ASC")
+        evict_keys = []
+        for key, nbytes in cursor:
+            if self._total_bytes <= target:
+                break
+            evict_keys.append((key,))
+            self._total_bytes -= nbytes
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evict_keys)
+        self.evictions += len(evict_keys)
+        logger.info(f"嵌入缓存淘汰 {len(evict_keys)} 条向量，当前大小 {self._total_bytes} 字节")
+
+    def get_or_compute(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: int,
+        compute: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        """先查缓存，只对未命中的文本调用 compute 生成向量并回写缓存"""
+        vectors = self.get_many(texts, model, dimensions)
+        # 同一批次内重复的文本只请求一次
+        missing_texts = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None
+        ))
+        if missing_texts:
+            computed = dict(zip(missing_texts, compute(missing_texts)))
+            vectors = [
+                vector if vector is not None else computed[text]
+                for text, vector in zip(texts, vectors)
+            ]
+            self.put_many(missing_texts, list(computed.values()), model, dimensions)
+        return vectors
+
+    async def aget_or_compute(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: int,
+        compute: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """get_or_compute 的异步版本，compute 为协程函数"""
+        vectors = await asyncio.to_thread(self.get_many, texts, model, dimensions)
+        missing_texts = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None
+        ))
+        if missing_texts:
+            computed = dict(zip(missing_texts, await compute(missing_texts)))
+            vectors = [
+                vector if vector is not None else computed[text]
+                for text, vector in zip(texts, vectors)
+            ]
+            await asyncio.to_thread(self.put_many, missing_texts, list(computed.values()), model, dimensions)
+        return vectors
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "path": self.path,
+            "dtype": self.dtype,
+            "entries": count,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 全局嵌入缓存实例（关闭时为 None）
+embedding_cache = (
+    EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_MAX_BYTES, EMBED_CACHE_DTYPE)
+    if EMBED_CACHE_ENABLED else None
+)
@@ -1,7 +1,16 @@
 # from langchain_community.document_loaders import PyPDFLoader
+import asyncio
+import hashlib
+import aiofiles
+from itertools import islice
 import logging
-from typing import List, Optional
+import tarfile
+import time
+import threading
+from threading import Lock
 import uuid
+import zipfile
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional
 # from langchain.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -10,6 +19,15 @@ import os
 import chromadb
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from utils.async_embedder import AsyncEmbeddingExecutor, create_async_embedding_client
+from utils.embedding_cache import embedding_cache
+from utils.pdf_extract import (
+    PDF_EXTRACT_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+    count_pages,
+    iter_page_texts_parallel,
+)
+from utils.vector_snapshot import vector_snapshots
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +40,17 @@ ALIYUN_BASE_URL = os.getenv("ALIYUN_BASE_URL")
 RAG_DB_PATH = os.getenv("RAG_DB_PATH")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
 TEMP_UPLOAD_DIR = os.getenv("TEMP_UPLOAD_DIR", "./temp_uploads")
+EMBEDDING_MODEL = "text-embedding-v4"
+EMBEDDING_DIMENSIONS = 1024
+# 上传文件大小上限（字节）及流式写入的块大小
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# 批量上传的压缩包大小上限及可包含的文件数上限
+MAX_ARCHIVE_SIZE = int(os.getenv("MAX_ARCHIVE_SIZE", str(1024 * 1024 * 1024)))
+MAX_ARCHIVE_ENTRIES = int(os.getenv("MAX_ARCHIVE_ENTRIES", "500"))
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+# 每次请求嵌入接口的文本条数（text-embedding-v4 单次最多 10 条）
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "10"))
 
 # 确保上传目录存在
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -32,6 +61,32 @@ client = OpenAI(
     base_url=ALIYUN_BASE_URL
 )
 
+# 所有入库任务共用的事件循环（在独立线程中运行）及该循环上的异步嵌入客户端：
+# 各 worker 线程把入库协程提交到同一个循环，共享一个 HTTP 连接池，而不是每个任务各建一个事件循环
+_ingest_loop: Optional[asyncio.AbstractEventLoop] = None
+_ingest_loop_lock = Lock()
+_ingest_embedding_client = None
+
+
+def get_ingest_loop() -> asyncio.AbstractEventLoop:
+    """返回入库事件循环，首次调用时启动"""
+    global _ingest_loop
+    with _ingest_loop_lock:
+        if _ingest_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="ingest-loop", daemon=True).start()
+            _ingest_loop = loop
+        return _ingest_loop
+
+
+def get_ingest_embedding_client():
+    """入库向量化共用的异步客户端（只在入库事件循环中使用），重试由执行器统一处理，客户端自身不再重试"""
+    global _ingest_embedding_client
+    with _ingest_loop_lock:
+        if _ingest_embedding_client is None:
+            _ingest_embedding_client = create_async_embedding_client(ALIYUN_API_KEY, ALIYUN_BASE_URL, max_retries=0)
+        return _ingest_embedding_client
+
 
 # 初始化 ChromaDB 客户端
 chromadb_client = chromadb.PersistentClient(path=RAG_DB_PATH)
@@ -40,6 +95,9 @@ class DocumentProcessor:
     def __init__(self):
         self.client = client
         self.chromadb_client = chromadb_client
+        # 每个集合一把写锁，避免多个文件同时争用 Chroma 的 SQLite 写入
+        self._write_locks = {}
+        self._write_locks_guard = Lock()
     # def __init__(self):
     #     # 延迟初始化客户端，避免在导入时就需要环境变量
     #     self.client = None
@@ -58,29 +116,83 @@ class DocumentProcessor:
     def embed(self, text: str) -> List[float]:
         """生成文本的嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-v4",
-                input=text,
-                dimensions=1024,
-                encoding_format="float"
-            )
-            return response.data[0].embedding
+            return self.embed_batch([text])[0]
         except Exception as e:
             print(f"Embedding生成失败: {e}")
             return []
 
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本的嵌入向量，优先读取嵌入缓存，仅对未命中的文本请求接口"""
+        if embedding_cache is None:
+            return self._request_embeddings(texts)
+        return embedding_cache.get_or_compute(
+            texts, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, self._request_embeddings
+        )
+
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """一次请求嵌入接口处理多条文本"""
+        response = self.client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts,
+            dimensions=EMBEDDING_DIMENSIONS,
+            encoding_format="float"
+        )
+        # 按 index 排序，保证向量与输入文本一一对应
+        data = sorted(response.data, key=lambda item: item.index)
+        if len(data) != len(texts):
+            raise ValueError(f"Embedding返回数量不匹配: 输入 {len(texts)} 条, 返回 {len(data)} 条")
+        return [item.embedding for item in data]
+
     def load_pdf(self, file_path: str) -> List[Document]:
         """加载PDF文件并返回文档列表"""
         try:
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
-            for doc in docs:
-                doc.page_content = doc.page_content.replace('\n', ' ').strip()
-            return docs
+            return list(self.iter_pdf_pages(file_path))
         except Exception as e:
             print(f"PDF加载失败: {e}")
             raise
 
+    def iter_pdf_pages(self, file_path: str) -> Iterator[Document]:
+        """
+        逐页惰性读取PDF，每次只在内存中保留少量页面
+        配置了 PDF_EXTRACT_WORKERS 且页数较多时，使用进程池并行解析，按页码顺序产出
+        """
+        if PDF_EXTRACT_WORKERS > 1:
+            total_pages = count_pages(file_path)
+            if total_pages >= PDF_PARALLEL_MIN_PAGES:
+                logger.info(f"使用 {PDF_EXTRACT_WORKERS} 个进程并行解析PDF: {file_path}, 共 {total_pages} 页")
+                for page_no, text in iter_page_texts_parallel(file_path, total_pages):
+                    yield Document(
+                        page_content=text,
+                        metadata={"source": file_path, "page": page_no, "total_pages": total_pages}
+                    )
+                return
+
+        loader = PyPDFLoader(file_path)
+        for doc in loader.lazy_load():
+            doc.page_content = doc.page_content.replace('\n', ' ').strip()
+            yield doc
+
+    def iter_splits(self, pages: Iterable[Document],
+                    chunk_size: int = 1000,
+                    chunk_overlap: int = 200) -> Iterator[Document]:
+        """
+        逐页增量分块
+        start_index 为分片在整篇文档（各页文本依次拼接）中的偏移量，跨页保持连续，
+        并标记 offset_scope=document，与旧数据的页内偏移区分（检索时据此判断分片能否合并）
+        """
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True
+        )
+        page_offset = 0
+        for page in pages:
+            for split in text_splitter.split_documents([page]):
+                split.metadata["start_index"] += page_offset
+                split.metadata["offset_scope"] = "document"
+                yield split
+            page_offset += len(page.page_content)
+
     def split_documents(self, docs: list[Document],
                         chunk_size: int = 1000,
                         chunk_overlap: int = 200) -> list[Document]:
@@ -93,55 +205,170 @@ class DocumentProcessor:
         return text_splitter.split_documents(docs)
     
     def save_to_chroma(self, 
-                      splits: List[Document], 
+                      splits: Iterable[Document], 
                       collection_name: str,
-                      file_metadata: Optional[dict] = None) -> int:
-        """保存文档分片到ChromaDB"""
+                      file_metadata: Optional[dict] = None,
+                      batch_size: Optional[int] = None,
+                      skip_chunks: int = 0,
+                      on_batch_committed: Optional[Callable[[int], None]] = None,
+                      is_cancelled: Optional[Callable[[], bool]] = None) -> int:
+        """保存文档分片到ChromaDB（同步入口，供后台任务线程调用，协程在共享的入库事件循环中执行）"""
+        future = asyncio.run_coroutine_threadsafe(self.save_to_chroma_async(
+            splits, collection_name, file_metadata, batch_size, skip_chunks, on_batch_committed, is_cancelled
+        ), get_ingest_loop())
+        return future.result()
+
+    async def save_to_chroma_async(self,
+                                   splits: Iterable[Document],
+                                   collection_name: str,
+                                   file_metadata: Optional[dict] = None,
+                                   batch_size: Optional[int] = None,
+                                   skip_chunks: int = 0,
+                                   on_batch_committed: Optional[Callable[[int], None]] = None,
+                                   is_cancelled: Optional[Callable[[], bool]] = None) -> int:
+        """
+        保存文档分片到ChromaDB（按批次并发向量化并批量写入）
+        splits 可以是生成器，每凑满一批即提交向量化，多个批次同时在途，按顺序写入集合，
+        已写入的分片立即可被检索；应在入库事件循环中执行（见 save_to_chroma），同步操作都在线程中进行
+        :param skip_chunks: 跳过前 N 个已写入的分片（从检查点续传）
+        :param on_batch_committed: 每批写入后回调（在线程中执行），参数为累计已写入的分片数
+        :param is_cancelled: 每批写入前调用（在线程中执行），返回 True 时停止并抛出 IngestCancelledError
+        :return: 文档的总分片数（包含跳过的分片）
+        """
+        batch_size = batch_size or EMBED_BATCH_SIZE
+        if skip_chunks:
+            logger.info(f"集合 {collection_name} 从第 {skip_chunks} 个分片处续传")
+            splits = islice(splits, skip_chunks, None)
         try:
             # 获取或创建集合
-            collection = self.chromadb_client.get_or_create_collection(
-                name=collection_name
+            collection = await asyncio.to_thread(
+                self.chromadb_client.get_or_create_collection, name=collection_name
             )
-            
-            chunk_count = 0
-            for i, split in enumerate(splits):
-                # 生成唯一ID
-                doc_id = f"{collection_name}_{uuid.uuid4().hex}"
-                
-                # 准备元数据
-                metadata = split.metadata.copy() if split.metadata else {}
-                if file_metadata:
-                    metadata.update(file_metadata)
-                
-                # 生成向量
-                vector = self.embed(split.page_content)
-                
-                # 添加到集合
-                collection.add(
-                    ids=[doc_id],
-                    documents=[split.page_content],
-                    embeddings=[vector],
-                    metadatas=[metadata]
+
+            # 所有入库任务共用同一个客户端和限流器，并发处理多个文件时合计不超过配额
+            executor = AsyncEmbeddingExecutor(get_ingest_embedding_client(), EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+
+            async def embed_timed(batch: List[Document]):
+                batch_start = time.perf_counter()
+                embeddings = await self._aembed_batch(executor, [split.page_content for split in batch])
+                return embeddings, time.perf_counter() - batch_start
+
+            chunk_count = skip_chunks
+            batch_no = 0
+            batches = _aiter_batches(splits, batch_size)
+            async for batch, (embeddings, embed_elapsed) in executor.map_ordered(batches, embed_timed):
+                batch_no += 1
+                write_start = time.perf_counter()
+
+                ids, documents, metadatas = [], [], []
+                for split in batch:
+                    # 准备元数据
+                    metadata = split.metadata.copy() if split.metadata else {}
+                    if file_metadata:
+                        metadata.update(file_metadata)
+                    metadatas.append(metadata)
+
+                    # 由文件记录、文件内容和分片位置生成确定性ID，重复处理时覆盖而不是新增
+                    ids.append(make_chunk_id(
+                        collection_name,
+                        metadata.get("file_id", ""),
+                        metadata.get("file_hash", ""),
+                        metadata.get("start_index", 0),
+                        split.page_content
+                    ))
+                    documents.append(split.page_content)
+
+                # 写入前确认任务未被取消（文件已被删除时不再写入）
+                if is_cancelled and await asyncio.to_thread(is_cancelled):
+                    raise IngestCancelledError(f"入库任务已取消，集合 {collection_name} 停止写入")
+
+                # 整批写入集合（在线程中执行，不阻塞其他批次的向量化请求）
+                await asyncio.to_thread(
+                    self._write_batch,
+                    collection,
+                    ids=ids,
+                    documents=documents,
+                    embeddings=embeddings,
+                    metadatas=metadatas
                 )
-                chunk_count += 1
-            
-            logger.info(f"成功保存 {chunk_count} 个分片到集合 {collection_name}")
+                chunk_count += len(batch)
+                if on_batch_committed:
+                    await asyncio.to_thread(on_batch_committed, chunk_count)
+                logger.info(
+                    f"集合 {collection_name} 第 {batch_no} 批写入 {len(batch)} 个分片, "
+                    f"向量化 {embed_elapsed * 1000:.0f}ms, "
+                    f"写入 {(time.perf_counter() - write_start) * 1000:.0f}ms"
+                )
+
+            stats = executor.stats()
+            logger.info(
+                f"成功保存 {chunk_count - skip_chunks} 个分片到集合 {collection_name}, 耗时 {stats['elapsed']}s, "
+                f"吞吐 {stats['chunks_per_second']} 分片/s, {stats['tokens_per_second']} tokens/s, "
+                f"重试 {stats['retries']} 次"
+            )
             return chunk_count
             
+        except IngestCancelledError:
+            raise
         except Exception as e:
             logger.error(f"保存到ChromaDB失败: {e}")
             raise
 
+    def collection_write_lock(self, collection_name: str) -> Lock:
+        """
+        获取集合的写锁
+        线程锁只串行化本进程内的写入，不能保护其他进程（如 python -m services.ingest_queue 启动的独立 worker），
+        同一个 RAG_DB_PATH 应只由一个进程执行入库
+        """
+        with self._write_locks_guard:
+            return self._write_locks.setdefault(collection_name, Lock())
+
+    def _write_batch(self, collection, **kwargs):
+        """持有集合写锁写入一批向量（upsert，重复写入同一分片是幂等的）"""
+        with self.collection_write_lock(collection.name):
+            collection.upsert(**kwargs)
+            # 同步到内存快照（集合未加载快照时忽略）
+            vector_snapshots.upsert(collection.name, **kwargs)
+
+    async def _aembed_batch(self, executor: AsyncEmbeddingExecutor, texts: List[str]) -> List[List[float]]:
+        """异步批量生成向量，优先读取嵌入缓存"""
+        if embedding_cache is None:
+            return await executor.embed(texts)
+        return await embedding_cache.aget_or_compute(
+            texts, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, executor.embed
+        )
+
     def delete_collection(self, collection_name: str) -> bool:
         """删除ChromaDB集合"""
         try:
             self.chromadb_client.delete_collection(name=collection_name)
+            vector_snapshots.drop(collection_name)
             logger.info(f"成功删除集合: {collection_name}")
             return True
         except Exception as e:
             logger.error(f"删除集合失败: {e}")
             return False
     
+    def delete_file_vectors(self, collection_name: str, file_id: str, batch_size: int = 500) -> int:
+        """按 file_id 分批删除集合中某个文件的全部向量，返回删除的分片数"""
+        try:
+            collection = self.chromadb_client.get_collection(name=collection_name)
+        except Exception:
+            return 0
+
+        deleted = 0
+        while True:
+            result = collection.get(where={"file_id": file_id}, limit=batch_size, include=[])
+            ids = result.get("ids") or []
+            if not ids:
+                break
+            with self.collection_write_lock(collection_name):
+                collection.delete(ids=ids)
+                vector_snapshots.delete(collection_name, ids)
+            deleted += len(ids)
+        logger.info(f"已从集合 {collection_name} 删除文件 {file_id} 的 {deleted} 个分片")
+        return deleted
+    
     def get_collection_info(self, collection_name: str) -> Optional[dict]:
         """获取集合信息"""
         try:
@@ -154,5 +381,125 @@ class DocumentProcessor:
         except Exception:
             return None
 
+class FileTooLargeError(Exception):
+    """上传文件超过大小限制"""
+
+
+class IngestCancelledError(Exception):
+    """入库过程中文件被删除，任务取消"""
+
+
+async def save_upload_file(upload_file, save_path: str, max_size: int = MAX_UPLOAD_SIZE) -> tuple[int, str]:
+    """
+    将上传文件分块流式写入磁盘，同时计算大小和 SHA-256，超过大小限制时中止
+    :return: (文件大小, SHA-256)
+    """
+    sha256 = hashlib.sha256()
+    file_size = 0
+    async with aiofiles.open(save_path, "wb") as buffer:
+        while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > max_size:
+                raise FileTooLargeError(f"文件大小超过限制 {max_size // (1024 * 1024)}MB")
+            sha256.update(chunk)
+            await buffer.write(chunk)
+    return file_size, sha256.hexdigest()
+
+def is_archive(filename: str) -> bool:
+    """根据扩展名判断是否为支持的压缩包"""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _copy_stream(src, save_path: str, max_size: int) -> tuple[int, str]:
+    """将文件流分块复制到磁盘，同时计算大小和 SHA-256"""
+    sha256 = hashlib.sha256()
+    file_size = 0
+    with open(save_path, "wb") as buffer:
+        for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+            file_size += len(chunk)
+            if file_size > max_size:
+                raise FileTooLargeError(f"文件大小超过限制 {max_size // (1024 * 1024)}MB")
+            sha256.update(chunk)
+            buffer.write(chunk)
+    return file_size, sha256.hexdigest()
+
+
+def _iter_archive_pdfs(archive_path: str) -> Iterator[tuple]:
+    """逐个产出压缩包中的 PDF 条目 (文件名, 文件流)，不一次性解压到内存"""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                with zf.open(info) as src:
+                    yield os.path.basename(info.filename), src
+    else:
+        # 流式模式读取 tar，按顺序逐个条目处理
+        with tarfile.open(archive_path, "r|*") as tf:
+            for member in tf:
+                if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                    continue
+                src = tf.extractfile(member)
+                if src is not None:
+                    yield os.path.basename(member.name), src
+
+
+def extract_archive_pdfs(archive_path: str, dest_dir: str, max_size: int = MAX_UPLOAD_SIZE) -> List[dict]:
+    """
+    流式解压压缩包中的 PDF 到目标目录，单个条目超过 max_size 时中止
+    :return: [{"filename", "file_path", "file_size", "file_hash"}]
+    """
+    extracted = []
+    try:
+        for filename, src in _iter_archive_pdfs(archive_path):
+            if len(extracted) >= MAX_ARCHIVE_ENTRIES:
+                raise ValueError(f"压缩包中的文件数超过限制 {MAX_ARCHIVE_ENTRIES}")
+            save_path = os.path.join(dest_dir, f"{uuid.uuid4().hex}.pdf")
+            extracted.append({"filename": filename, "file_path": save_path})
+            file_size, file_hash = _copy_stream(src, save_path, max_size)
+            extracted[-1].update(file_size=file_size, file_hash=file_hash)
+    except Exception:
+        for item in extracted:
+            if os.path.exists(item["file_path"]):
+                os.remove(item["file_path"])
+        raise
+    return extracted
+
+def compute_file_hash(file_path: str) -> str:
+    """流式计算文件内容的 SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def make_chunk_id(collection_name: str, file_id: str, file_hash: str, start_index: int, text: str) -> str:
+    """
+    分片ID = 集合名 + sha256(文件ID, 文件内容哈希, 分片起始位置, 分片文本哈希)
+    同一文件记录重复处理时ID不变（幂等覆盖）；同一内容重复上传为不同文件记录时各自独立，
+    按 file_id 删除其中一个不会影响另一个
+    """
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    digest = hashlib.sha256(f"{file_id}:{file_hash}:{start_index}:{text_hash}".encode("utf-8")).hexdigest()
+    return f"{collection_name}_{digest[:32]}"
+
+def _iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    """将可迭代对象按 batch_size 切分为列表"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+async def _aiter_batches(items: Iterable, batch_size: int) -> AsyncIterator[list]:
+    """在线程中拉取下一批数据（PDF解析等同步耗时操作），避免阻塞事件循环"""
+    iterator = _iter_batches(items, batch_size)
+    while True:
+        batch = await asyncio.to_thread(next, iterator, None)
+        if batch is None:
+            return
+        yield batch
+
 # 全局处理器实例
 document_processor = DocumentProcessor()
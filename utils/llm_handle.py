@@ -1,15 +1,24 @@
 import asyncio
 import functools
-import json
+import logging
 from typing import AsyncGenerator
 
 from requests import Session
-from sqlalchemy import func
-from models.chat import Conversation, Message
+from models.chat import Conversation
 from prompts.prompts import get_prompt
+from services.chat_service import ROLE_LABELS, ChatService
+from utils.context_packer import truncate_to_tokens
+from utils.response_buffer import ResponseBuffer
+from utils.sse_stream import StreamStats, coalesce_tokens, record_stream_stats, sse_event
 from langchain.chat_models import init_chat_model
 import os
 
+# 生成摘要时每条消息最多保留的 token 数（测试用例表格等长回答只取开头部分）
+SUMMARY_MESSAGE_TOKENS = int(os.getenv("SUMMARY_MESSAGE_TOKENS", "500"))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 # 模型初始化（延迟加载）
 @functools.lru_cache(maxsize=1)
 def _get_cached_llm_model():
@@ -33,7 +42,7 @@ def _get_cached_llm_model():
 async def call_llm_model(prompt: str) -> AsyncGenerator[str, None]:
     """异步调用LLM模型并流式返回token（优化后）"""
     model = _get_cached_llm_model()
-    full_response = ""
+    response_length = 0
     
     try:
         # 添加超时控制
@@ -41,9 +50,7 @@ async def call_llm_model(prompt: str) -> AsyncGenerator[str, None]:
 
             async for token in model.astream(prompt):  
                 yield token.content
-                full_response += token.content
-                # 控制速率
-                await asyncio.sleep(0.001)
+                response_length += len(token.content)
                 
     except asyncio.TimeoutError:
         yield "[错误：生成响应超时]"
@@ -55,72 +62,89 @@ async def call_llm_model(prompt: str) -> AsyncGenerator[str, None]:
         logging.error(f"LLM调用异常: {e}", exc_info=True)
     finally:
         # 可选：记录完整响应（用于分析或调试）
-        if full_response:
+        if response_length:
             import logging
-            logging.debug(f"完整响应长度: {len(full_response)}")
+            logging.debug(f"完整响应长度: {response_length}")
+
 
+async def replay_cached_answer(answer: str, chunk_size: int = 64) -> AsyncGenerator[str, None]:
+    """将缓存的回答按固定长度切片，按流式 token 的形式返回"""
+    for i in range(0, len(answer), chunk_size):
+        yield answer[i:i + chunk_size]
 
-async def generate_response(request, prompt, conversation_id, is_new_conversation, message, db):
-    ai_response = ""
-    full_response_saved = False
+
+async def generate_response(request, prompt, conversation_id, cached_answer=None, on_complete=None):
+    """
+    流式返回模型响应
+    :param cached_answer: 命中回答缓存时直接回放该回答，不调用模型
+    :param on_complete: 模型完整生成回答后的回调，参数为完整回答（用于写入回答缓存）
+    """
+    # 回答按片段缓冲，生成过程中定期写入数据库
+    ai_response = ResponseBuffer(conversation_id)
+    completed = False
+    interrupted = False
+    stats = StreamStats()
     
+    words = replay_cached_answer(cached_answer) if cached_answer else call_llm_model(prompt)
+    # 按时间窗口/字节数合并 token 后再发送，断开连接时立即取消上游生成
+    frames = coalesce_tokens(words, stats=stats)
     try:
-        words = call_llm_model(prompt)
-        async for token in words:
-            # 检查客户端是否断开连接
+        async for text in frames:
+            ai_response.append(text)
+            yield sse_event({"token": text})
+            ai_response.maybe_checkpoint(stats.tokens)
+
+            # 每帧检查一次客户端是否断开连接
             if await request.is_disconnected():
                 print("客户端已断开连接")
                 break
-                
-            ai_response += token
-            yield f"data: {json.dumps({'token': token})}\n\n"
-            await asyncio.sleep(0.02)
-    except GeneratorExit:
+        else:
+            completed = True
+    except (GeneratorExit, asyncio.CancelledError):
         # 处理客户端断开连接
         print("流式响应被中断")
+        interrupted = True
+        raise
     finally:
-
-
+        await frames.aclose()
+        record_stream_stats(stats, "（缓存回放）" if cached_answer else "")
     
         # 保存响应
-        print(f"AI响应结束，长度: {ai_response}")
+        print(f"AI响应结束，长度: {len(ai_response)}")
+
+        if ai_response:
+            # 大部分内容已在生成过程中写入，这里只写入最后的增量
+            await ai_response.flush()
 
-        if ai_response and not full_response_saved:
-            await save_ai_response(ai_response, conversation_id, db)
-            full_response_saved = True
+            # 只缓存完整生成且没有出错的回答
+            if completed and on_complete and not cached_answer and not ai_response.startswith("[错误"):
+                try:
+                    on_complete(ai_response.getvalue())
+                except Exception as e:
+                    print(f"写入回答缓存失败: {e}")
   
-            yield "data: [DONE]\n\n"
-        if is_new_conversation:
-            await generate_and_update_title(message, conversation_id, db)
-
-async def save_ai_response(content, conversation_id, db: Session):
-    """保存AI响应到数据库"""
-    if content:
-        ai_message = Message(
-            conversation_id=conversation_id,
-            role="assistant",
-            content=content
+            # 生成器已被关闭时不能再发送数据
+            if not interrupted:
+                yield sse_event("[DONE]")
+
+def _load_conversation(conversation_id: str, db: Session):
+    return db.query(Conversation).filter(Conversation.id == conversation_id).first()
+
+
+def _save_title(conversation_id: str, title: str, db: Session):
+    """写入对话标题（在线程中执行）"""
+    try:
+        db.query(Conversation).filter(Conversation.id == conversation_id).update(
+            {Conversation.title: title}, synchronize_session=False
         )
-        db.add(ai_message)
-        try:
-            db.commit()
-            print("保存AI消息成功")
-        except Exception as e:
-            db.rollback()
-            print(f"保存消息失败: {e}")
-        
-        # 更新对话时间
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if conversation:
-            conversation.updated_at = func.now()
-            try:
-                db.commit()
-            except:
-                db.rollback()
-    
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
 
 async def generate_and_update_title(user_message: str, conversation_id: str, db: Session):
-    """异步生成并更新对话标题"""
+    """异步生成并更新对话标题（由后台任务执行器调用，db 为独立会话，数据库操作在线程中执行）"""
     try:
         title_prompt = get_prompt(scenario="title_generation", question=user_message)
         # 注意：call_llm_model 现在是异步生成器
@@ -135,19 +159,71 @@ async def generate_and_update_title(user_message: str, conversation_id: str, db:
         
         if len(title) > 10:
             title = title[:10] + "..."
-        
-        # 获取对话实例
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
 
         # 更新数据库
-        conversation.title = title
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-
-        # logger.info(f"对话标题已更新: {title}")
+        await asyncio.to_thread(_save_title, conversation_id, title, db)
+        logger.info(f"对话标题已更新: {title}")
     except Exception as e:
-        # logger.error(f"生成标题失败: {e}")
+        logger.error(f"生成标题失败: {e}")
         # 失败时设置默认标题
-        conversation.title = user_message[:20] + "..."
-        db.commit()
\ No newline at end of file
+        await asyncio.to_thread(_save_title, conversation_id, user_message[:20] + "...", db)
+
+
+def _load_summary_input(conversation_id: str, exclude_message_id: int, db: Session):
+    """读取已有摘要和需要并入摘要的消息（在线程中执行）"""
+    conversation = _load_conversation(conversation_id, db)
+    if not conversation:
+        return None
+    messages = ChatService.get_messages_to_summarize(conversation, db, exclude_message_id)
+    return {
+        "summary": conversation.summary,
+        "summary_until_id": conversation.summary_until_id,
+        "messages": [(msg.id, msg.role, msg.content) for msg in messages]
+    }
+
+
+def _save_summary(conversation_id: str, summary: str, start_until_id, new_until_id: int, db: Session) -> bool:
+    """
+    条件更新摘要（在线程中执行）：只有 summary_until_id 仍是本次任务开始时读到的值才写入，
+    避免较早开始、较晚完成的摘要任务覆盖较新的摘要或使 summary_until_id 回退
+    """
+    condition = Conversation.summary_until_id.is_(None) if start_until_id is None \
+        else Conversation.summary_until_id == start_until_id
+    try:
+        updated = db.query(Conversation).filter(Conversation.id == conversation_id, condition).update(
+            {Conversation.summary: summary, Conversation.summary_until_id: new_until_id},
+            synchronize_session=False
+        )
+        db.commit()
+        return updated > 0
+    except Exception:
+        db.rollback()
+        raise
+
+
+async def generate_and_update_summary(conversation_id: str, exclude_message_id: int = None, db: Session = None):
+    """将较早的对话增量并入会话摘要（由后台任务执行器调用，db 为独立会话，数据库操作在线程中执行）"""
+    state = await asyncio.to_thread(_load_summary_input, conversation_id, exclude_message_id, db)
+    if not state or not state["messages"]:
+        return
+
+    lines = []
+    if state["summary"]:
+        lines.append(f"已有摘要：{state['summary']}")
+    for _, role, content in state["messages"]:
+        lines.append(f"{ROLE_LABELS.get(role, role)}：{truncate_to_tokens(content, SUMMARY_MESSAGE_TOKENS)}")
+    summary_prompt = get_prompt(scenario="history_summary", history="\n".join(lines))
+
+    model = _get_cached_llm_model()
+    response = await model.ainvoke(summary_prompt)
+    summary = (response.content or "").strip()
+    if not summary:
+        return
+
+    saved = await asyncio.to_thread(
+        _save_summary, conversation_id, summary, state["summary_until_id"], state["messages"][-1][0], db
+    )
+    if saved:
+        logger.info(f"对话 {conversation_id} 摘要已更新，并入 {len(state['messages'])} 条消息")
+    else:
+        logger.info(f"对话 {conversation_id} 摘要已被其他任务更新，丢弃本次结果")
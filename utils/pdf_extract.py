@@ -0,0 +1,89 @@
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pypdf import PdfReader
+
+# 注意：该模块会在子进程中导入，只能依赖 pypdf 等轻量库，不要导入 Chroma/OpenAI 等全局客户端
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 并行解析的进程数，0 或 1 表示不启用进程池
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+# 每个子任务解析的页数
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# 页数少于该值时直接在当前进程解析，避免进程间通信开销
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+
+_pool_lock = Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """获取进程池单例（spawn 方式启动，避免在多线程的 Web 进程中 fork）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"已启动PDF解析进程池，进程数: {PDF_EXTRACT_WORKERS}")
+        return _pool
+
+
+def shutdown_pool():
+    """关闭进程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def count_pages(file_path: str) -> int:
+    """获取PDF页数"""
+    return len(PdfReader(file_path).pages)
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """在子进程中解析 [start, end) 范围的页面，返回 (页码, 文本) 列表"""
+    reader = PdfReader(file_path)
+    pages = []
+    for page_no in range(start, min(end, len(reader.pages))):
+        text = reader.pages[page_no].extract_text() or ""
+        pages.append((page_no, text.replace('\n', ' ').strip()))
+    return pages
+
+
+def iter_page_texts_parallel(file_path: str, total_pages: int) -> Iterator[Tuple[int, str]]:
+    """
+    将页码范围分派到进程池并行解析，按页码顺序依次产出 (页码, 文本)
+    同时在途的子任务数量限制为进程数的 2 倍，内存占用与文件大小无关
+    """
+    pool = _get_pool()
+    ranges = deque(
+        (start, min(start + PDF_PAGES_PER_TASK, total_pages))
+        for start in range(0, total_pages, PDF_PAGES_PER_TASK)
+    )
+    pending = deque()
+    max_in_flight = max(PDF_EXTRACT_WORKERS * 2, 1)
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < max_in_flight:
+                start, end = ranges.popleft()
+                pending.append(pool.submit(extract_page_range, file_path, start, end))
+            # 按提交顺序取结果，保证页面顺序
+            for page in pending.popleft().result():
+                yield page
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+
+from models.chat import Conversation, Message
+from models.database import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 流式生成过程中，每累计多少个 token 将已生成内容写入数据库
+STREAM_CHECKPOINT_TOKENS = int(os.getenv("STREAM_CHECKPOINT_TOKENS", "200"))
+# 距上次写入超过多少秒时写入数据库
+STREAM_CHECKPOINT_SECONDS = float(os.getenv("STREAM_CHECKPOINT_SECONDS", "5"))
+
+
+class ResponseBuffer:
+    """
+    流式回答缓冲区
+    片段追加到列表中，需要时才拼接（避免逐 token 字符串拼接的平方复杂度）；
+    生成过程中按 token 数或时间间隔把已生成内容写入 messages 表：首次写入插入消息行，之后只 UPDATE 该行，
+    进程崩溃或客户端断开时已生成的内容不会丢失，结束时的 flush 只需写入最后一个检查点之后的增量
+    """
+
+    def __init__(
+        self,
+        conversation_id: str,
+        checkpoint_tokens: int = STREAM_CHECKPOINT_TOKENS,
+        checkpoint_seconds: float = STREAM_CHECKPOINT_SECONDS
+    ):
+        self.conversation_id = conversation_id
+        self.checkpoint_tokens = checkpoint_tokens
+        self.checkpoint_seconds = checkpoint_seconds
+        self.message_id: Optional[int] = None
+        self._parts: List[str] = []
+        self._length = 0
+        self._saved_length = 0
+        self._tokens_at_checkpoint = 0
+        self._checkpoint_at = time.monotonic()
+        self._pending: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, text: str):
+        self._parts.append(text)
+        self._length += len(text)
+
+    def getvalue(self) -> str:
+        """拼接当前内容，拼接结果替换片段列表，之后只需拼接新增片段"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def startswith(self, prefix: str) -> bool:
+        return self.getvalue().startswith(prefix)
+
+    def maybe_checkpoint(self, tokens: int):
+        """
+        达到 token 数或时间间隔时在后台写入检查点，不阻塞流式发送
+        上一次写入尚未完成时跳过本次
+        """
+        if self._pending is not None and not self._pending.done():
+            return
+        due = tokens - self._tokens_at_checkpoint >= self.checkpoint_tokens or \
+            time.monotonic() - self._checkpoint_at >= self.checkpoint_seconds
+        if not due or self._length == self._saved_length:
+            return
+        self._tokens_at_checkpoint = tokens
+        self._checkpoint_at = time.monotonic()
+        self._pending = asyncio.create_task(self._save(self.getvalue()))
+
+    async def flush(self) -> Optional[int]:
+        """等待进行中的检查点完成，写入剩余内容，返回消息ID"""
+        if self._pending is not None:
+            await asyncio.gather(self._pending, return_exceptions=True)
+            self._pending = None
+        if self._length != self._saved_length:
+            await self._save(self.getvalue(), touch_conversation=True)
+        return self.message_id
+
+    async def _save(self, content: str, touch_conversation: bool = False):
+        try:
+            await asyncio.to_thread(self._write, content, touch_conversation)
+        except Exception as e:
+            logger.error(f"保存AI消息失败: {e}")
+
+    def _write(self, content: str, touch_conversation: bool):
+        """在独立会话中写入消息内容（在线程中执行）"""
+        db = SessionLocal()
+        try:
+            message_id = self.message_id
+            if message_id is None:
+                message = Message(conversation_id=self.conversation_id, role="assistant", content=content)
+                db.add(message)
+                db.flush()
+                message_id = message.id
+            else:
+                db.query(Message).filter(Message.id == self.message_id).update(
+                    {Message.content: content}, synchronize_session=False
+                )
+            if touch_conversation:
+                db.query(Conversation).filter(Conversation.id == self.conversation_id).update(
+                    {Conversation.updated_at: func.now()}, synchronize_session=False
+                )
+            db.commit()
+            self.message_id = message_id
+            self._saved_length = len(content)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
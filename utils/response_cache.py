@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+import time
+from threading import Lock
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.ttl_cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+# 精确匹配缓存的最大条目数
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# 语义匹配的余弦相似度阈值
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+# 每个 (知识库, 版本, 场景) 下语义缓存的最大条目数
+RESPONSE_CACHE_SEMANTIC_SIZE = int(os.getenv("RESPONSE_CACHE_SEMANTIC_SIZE", "256"))
+# 默认过期时间（秒）
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "1800"))
+# 按场景配置过期时间，格式：testcase_generation=3600,devops_tool=600
+RESPONSE_CACHE_SCENARIO_TTLS = os.getenv("RESPONSE_CACHE_SCENARIO_TTLS", "")
+
+
+def _parse_scenario_ttls(raw: str) -> Dict[str, float]:
+    ttls = {}
+    for item in raw.split(","):
+        if "=" in item:
+            scenario, ttl = item.split("=", 1)
+            ttls[scenario.strip()] = float(ttl)
+    return ttls
+
+
+class _SemanticBucket:
+    """同一 (知识库, 版本, 场景) 下的语义缓存：查询向量矩阵 + 答案列表"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.vectors: Optional[np.ndarray] = None
+        self.answers: List[str] = []
+        self.expires_at: List[float] = []
+        self.lock = Lock()
+
+    def search(self, query: np.ndarray, threshold: float) -> Optional[str]:
+        with self.lock:
+            if self.vectors is None:
+                return None
+            scores = self.vectors @ query
+            scores[np.asarray(self.expires_at) <= time.monotonic()] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                return self.answers[best]
+            return None
+
+    def add(self, query: np.ndarray, answer: str, ttl: float):
+        with self.lock:
+            now = time.monotonic()
+            # 清理过期条目，超出上限时淘汰最早写入的条目
+            keep = [i for i, expires_at in enumerate(self.expires_at) if expires_at > now]
+            keep = keep[-(self.max_size - 1):] if self.max_size > 1 else []
+            vectors = self.vectors[keep] if self.vectors is not None and keep else np.empty((0, query.shape[0]), np.float32)
+            self.vectors = np.vstack([vectors, query[None, :]])
+            self.answers = [self.answers[i] for i in keep] + [answer]
+            self.expires_at = [self.expires_at[i] for i in keep] + [now + ttl]
+
+
+class ResponseCache:
+    """
+    /api/chat 回答缓存（两级）
+    一级：(场景, 知识库, 版本, 检索上下文, 问题) 哈希精确匹配
+    二级：同一知识库版本和场景下，查询向量余弦相似度超过阈值的语义匹配
+    """
+
+    def __init__(
+        self,
+        max_size: int = RESPONSE_CACHE_SIZE,
+        similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+        semantic_size: int = RESPONSE_CACHE_SEMANTIC_SIZE,
+        default_ttl: float = RESPONSE_CACHE_TTL,
+        scenario_ttls: Optional[Dict[str, float]] = None
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.semantic_size = semantic_size
+        self.default_ttl = default_ttl
+        self.scenario_ttls = scenario_ttls or {}
+        self._exact = TTLCache(max_size=max_size, ttl=default_ttl)
+        self._semantic = TTLCache(max_size=max(max_size // 10, 16), ttl=0)
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def ttl_for(self, scenario: str) -> float:
+        return self.scenario_ttls.get(scenario, self.default_ttl)
+
+    @staticmethod
+    def make_key(scenario: str, kb_id: Optional[str], kb_version: Optional[int], context: str, question: str) -> str:
+        raw = "\x00".join([scenario or "", kb_id or "", str(kb_version), context, question.strip()])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _lookup_exact(self, scenario, kb_id, kb_version, context, question) -> Optional[str]:
+        answer = self._exact.get(self.make_key(scenario, kb_id, kb_version, context, question))
+        if answer is not None:
+            self.exact_hits += 1
+        return answer
+
+    def _lookup_semantic(self, scenario, kb_id, kb_version, query_vector: List[float]) -> Optional[str]:
+        bucket = self._semantic.get((kb_id, kb_version, scenario))
+        if bucket is None:
+            return None
+        answer = bucket.search(self._normalize(query_vector), self.similarity_threshold)
+        if answer is not None:
+            self.semantic_hits += 1
+        return answer
+
+    def lookup(
+        self,
+        scenario: str,
+        kb_id: Optional[str],
+        kb_version: Optional[int],
+        context: str,
+        question: str,
+        query_vector: Optional[List[float]] = None
+    ) -> Optional[str]:
+        """查询缓存，先精确匹配再语义匹配，未命中返回 None"""
+        answer = self._lookup_exact(scenario, kb_id, kb_version, context, question)
+        if answer is None and query_vector:
+            answer = self._lookup_semantic(scenario, kb_id, kb_version, query_vector)
+        if answer is None:
+            self.misses += 1
+        return answer
+
+    async def alookup(
+        self,
+        scenario: str,
+        kb_id: Optional[str],
+        kb_version: Optional[int],
+        context: str,
+        question: str,
+        embed: Optional[Callable[[], Awaitable[List[float]]]] = None
+    ) -> Tuple[Optional[str], Optional[List[float]]]:
+        """
+        查询缓存，精确匹配未命中时才调用 embed 生成查询向量做语义匹配
+        :return: (缓存的回答, 查询向量)，查询向量供写入缓存时复用；未生成时为 None
+        """
+        answer = self._lookup_exact(scenario, kb_id, kb_version, context, question)
+        query_vector = None
+        if answer is None and embed is not None and self.ttl_for(scenario) > 0:
+            try:
+                query_vector = await embed()
+            except Exception as e:
+                logger.warning(f"生成查询向量失败，跳过语义缓存: {e}")
+            if query_vector:
+                answer = self._lookup_semantic(scenario, kb_id, kb_version, query_vector)
+        if answer is None:
+            self.misses += 1
+        return answer, query_vector
+
+    def store(
+        self,
+        scenario: str,
+        kb_id: Optional[str],
+        kb_version: Optional[int],
+        context: str,
+        question: str,
+        answer: str,
+        query_vector: Optional[List[float]] = None
+    ):
+        """写入缓存"""
+        ttl = self.ttl_for(scenario)
+        if ttl <= 0 or not answer:
+            return
+        self._exact.set(self.make_key(scenario, kb_id, kb_version, context, question), answer, ttl=ttl)
+
+        if query_vector:
+            namespace = (kb_id, kb_version, scenario)
+            bucket = self._semantic.get(namespace)
+            if bucket is None:
+                bucket = _SemanticBucket(self.semantic_size)
+                self._semantic.set(namespace, bucket)
+            bucket.add(self._normalize(query_vector), answer, ttl)
+
+    def stats(self) -> dict:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 4) if total else 0.0,
+            "exact_entries": len(self._exact),
+            "semantic_namespaces": len(self._semantic)
+        }
+
+
+# 全局回答缓存实例（未启用时为 None）
+response_cache = (
+    ResponseCache(scenario_ttls=_parse_scenario_ttls(RESPONSE_CACHE_SCENARIO_TTLS))
+    if RESPONSE_CACHE_ENABLED else None
+)
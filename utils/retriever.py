@@ -1,14 +1,23 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import functools
+import json
 from threading import Lock
 import chromadb
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import Depends
-from openai import OpenAI  
+import numpy as np
+from openai import AsyncOpenAI
 from langchain_core.documents import Document
 from dotenv import load_dotenv
 import os
+import unicodedata
 from models.database import get_db
 from services import knowlege_service
+from utils.async_embedder import create_async_embedding_client
+from utils.embedding_cache import embedding_cache
+from utils.ttl_cache import TTLCache
+from utils.vector_snapshot import vector_snapshots
 from sqlalchemy.orm import Session
 import logging
 
@@ -21,6 +30,116 @@ ALIYUN_BASE_URL = os.getenv("ALIYUN_BASE_URL")
 
 deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
 RAG_DB_PATH = os.getenv("RAG_DB_PATH")
+# Chroma 查询专用线程池大小（限制同时进行的向量检索数）
+CHROMA_QUERY_THREADS = int(os.getenv("CHROMA_QUERY_THREADS", "4"))
+
+# 查询向量的进程内缓存配置
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+QUERY_EMBED_CACHE_TTL = float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600"))
+
+# 批量检索时单次嵌入请求的最大文本数（text-embedding-v4 单次最多 10 条）
+QUERY_EMBED_BATCH_SIZE = int(os.getenv("QUERY_EMBED_BATCH_SIZE", "10"))
+# 批量检索接口单次请求的最大查询数
+BATCH_RETRIEVE_MAX_QUERIES = int(os.getenv("BATCH_RETRIEVE_MAX_QUERIES", "200"))
+
+# 检索候选集大小：先取 fetch_k 个候选，再经距离过滤和 MMR 选出 n_results 个
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "12"))
+# 距离阈值（Chroma 默认平方 L2 距离，归一化向量下等于 2 - 2·余弦相似度），<= 0 表示不过滤
+RETRIEVAL_MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE", "0"))
+# MMR 相关性权重：1 只看相关性，0 只看多样性
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.5"))
+# 与已选分片的余弦相似度超过该值时视为重复分片直接丢弃（分片重叠造成的近似重复）
+RETRIEVAL_DUPLICATE_SIMILARITY = float(os.getenv("RETRIEVAL_DUPLICATE_SIMILARITY", "0.95"))
+
+# 检索结果缓存配置（按知识库版本号失效，TTL 仅用于限制长期占用）
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", str(24 * 3600)))
+
+# 查询向量缓存：键为 (模型, 维度, 规范化查询)，命中时跳过嵌入接口
+_query_embedding_cache = TTLCache(max_size=QUERY_EMBED_CACHE_SIZE, ttl=QUERY_EMBED_CACHE_TTL)
+
+# 检索结果缓存：键为 (集合名, 知识库版本号, 规范化查询, n_results, 过滤条件)
+_retrieval_result_cache = TTLCache(max_size=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：统一全角/半角，转小写，去除标点并折叠空白"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+
+def get_query_embedding_cache_stats() -> dict:
+    """查询向量缓存的命中率统计"""
+    return _query_embedding_cache.stats()
+
+
+def get_retrieval_cache_stats() -> dict:
+    """检索结果缓存的命中率统计"""
+    return _retrieval_result_cache.stats()
+
+def maximal_marginal_relevance(
+    query_vector,
+    candidate_vectors,
+    k: int,
+    lambda_mult: float = RETRIEVAL_MMR_LAMBDA,
+    duplicate_similarity: float = RETRIEVAL_DUPLICATE_SIMILARITY
+) -> List[int]:
+    """
+    最大边际相关性（MMR）选择
+    :param query_vector: 查询向量
+    :param candidate_vectors: 候选向量矩阵（按相关性降序）
+    :param k: 最多选出的数量
+    :param duplicate_similarity: 与已选结果的相似度不低于该值的候选直接丢弃
+    :return: 选中的候选下标，按选择顺序
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if candidates.ndim != 2 or not len(candidates) or k <= 0:
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    query_similarity = candidates @ query
+    pairwise_similarity = candidates @ candidates.T
+    # 每个候选与已选集合的最大相似度
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected = []
+    while len(selected) < k and available.any():
+        if selected:
+            scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        else:
+            scores = query_similarity.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise_similarity[best])
+        available &= redundancy < duplicate_similarity
+    return selected
+
+
+# Chroma 查询是同步调用，放到专用线程池执行，避免阻塞事件循环
+_chroma_query_executor = ThreadPoolExecutor(
+    max_workers=CHROMA_QUERY_THREADS,
+    thread_name_prefix="chroma-query"
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_openai_client() -> AsyncOpenAI:
+    """应用事件循环内共享的异步嵌入客户端，底层 HTTP 连接池保持长连接复用"""
+    return create_async_embedding_client(ALIYUN_API_KEY, ALIYUN_BASE_URL)
+
+
+async def run_in_chroma_executor(func, *args, **kwargs):
+    """在 Chroma 查询线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _chroma_query_executor, functools.partial(func, *args, **kwargs)
+    )
 
 
 
@@ -49,49 +168,237 @@ class ChromaRetriever:
         self.embedding_dimensions = embedding_dimensions
         self.encoding_format = encoding_format
 
-        # 初始化 OpenAI 客户端
-        # self.openai_client = OpenAI(api_key=openai_api_key)
-        self.openai_client = OpenAI(
-            api_key=os.getenv("ALIYUN_API_KEY"), 
-            base_url=os.getenv("ALIYUN_BASE_URL")
-        )
+        # 使用共享的异步 OpenAI 客户端（连接池复用）
+        self.openai_client = _get_async_openai_client()
 
         # 获取 Chroma 集合
         self.collection = self.chroma_client.get_collection(name=collection_name)
 
     async def embed(self, text: str) -> List[float]:
         """
-        生成文本的嵌入向量
+        生成文本的嵌入向量（依次查询进程内查询向量缓存、持久化嵌入缓存，都未命中才请求接口）
         :param text: 输入文本
         :return: 嵌入向量
         """
-        response = self.openai_client.embeddings.create(
+        query_key = (self.model_name, self.embedding_dimensions, normalize_query(text))
+        vector = _query_embedding_cache.get(query_key)
+        if vector is not None:
+            return vector
+
+        vector = await self._embed_uncached(text)
+        _query_embedding_cache.set(query_key, vector)
+        return vector
+
+    async def _embed_uncached(self, text: str) -> List[float]:
+        """查询持久化嵌入缓存，未命中时请求嵌入接口"""
+        use_cache = embedding_cache is not None and self.encoding_format == "float"
+        if use_cache:
+            cached = (await asyncio.to_thread(
+                embedding_cache.get_many, [text], self.model_name, self.embedding_dimensions
+            ))[0]
+            if cached is not None:
+                return cached
+
+        response = await self.openai_client.embeddings.create(
             model=self.model_name,
             input=text,
             dimensions=self.embedding_dimensions,
             encoding_format=self.encoding_format
         )
         print(f"使用的 token 数量为：{response.usage.total_tokens}")
-        return response.data[0].embedding  # 返回向量数据
+        vector = response.data[0].embedding  # 返回向量数据
+        if use_cache:
+            await asyncio.to_thread(
+                embedding_cache.put_many, [text], [vector], self.model_name, self.embedding_dimensions
+            )
+        return vector
 
-    async def get_relevant_documents(self, query: str, n_results: int = 3) -> List[Document]:
-        """LangChain标准接口方法"""
-        query_vector = await self.embed(query)
-        results = self.collection.query(
-            query_embeddings=[query_vector],
-            n_results=n_results,
-            include=["documents", "metadatas"]
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量生成嵌入向量：已缓存的查询直接返回，其余查询去重后按批请求嵌入接口
+        :param texts: 输入文本列表
+        :return: 与输入顺序一致的嵌入向量列表
+        """
+        query_keys = [(self.model_name, self.embedding_dimensions, normalize_query(text)) for text in texts]
+        vectors = [_query_embedding_cache.get(key) for key in query_keys]
+        # 规范化后相同的查询只请求一次（与查询向量缓存的键一致）
+        missing = {}
+        for text, key, vector in zip(texts, query_keys, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            missing_texts = list(missing.values())
+            if embedding_cache is not None and self.encoding_format == "float":
+                computed_vectors = await embedding_cache.aget_or_compute(
+                    missing_texts, self.model_name, self.embedding_dimensions, self._request_embeddings
+                )
+            else:
+                computed_vectors = await self._request_embeddings(missing_texts)
+            computed = dict(zip(missing, computed_vectors))
+            for index, vector in enumerate(vectors):
+                if vector is None:
+                    vectors[index] = computed[query_keys[index]]
+                    _query_embedding_cache.set(query_keys[index], vectors[index])
+        return vectors
+
+    async def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按接口单次上限切分，并发请求嵌入接口"""
+        async def request(batch: List[str]) -> List[List[float]]:
+            response = await self.openai_client.embeddings.create(
+                model=self.model_name,
+                input=batch,
+                dimensions=self.embedding_dimensions,
+                encoding_format=self.encoding_format
+            )
+            print(f"使用的 token 数量为：{response.usage.total_tokens}")
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        batches = [texts[i:i + QUERY_EMBED_BATCH_SIZE] for i in range(0, len(texts), QUERY_EMBED_BATCH_SIZE)]
+        results = await asyncio.gather(*(request(batch) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def _result_cache_key(self, query: str, n_results: int, where: Optional[dict], kb_version: int) -> tuple:
+        return (
+            self.collection_name,
+            kb_version,
+            normalize_query(query),
+            n_results,
+            json.dumps(where, sort_keys=True, ensure_ascii=False) if where else ""
         )
-        
-        # 将结果转换为LangChain Document对象
-        documents = []
-        if results.get('documents'):
-            for doc_list in results['documents']:
-                for i, text in enumerate(doc_list):
-                    metadata = results['metadatas'][0][i] if results.get('metadatas') else {}
-                    documents.append(Document(page_content=text, metadata=metadata))
+
+    async def get_relevant_documents(
+        self,
+        query: str,
+        n_results: int = 3,
+        where: Optional[dict] = None,
+        kb_version: Optional[int] = None
+    ) -> List[Document]:
+        """
+        LangChain标准接口方法
+        :param where: 元数据过滤条件
+        :param kb_version: 知识库版本号，传入时启用检索结果缓存，版本变化后旧结果不再命中
+        """
+        cache_key = None
+        if kb_version is not None:
+            cache_key = self._result_cache_key(query, n_results, where, kb_version)
+            cached = _retrieval_result_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+
+        query_vector = await self.embed(query)
+        results = await self.search_by_vector(query_vector, n_results=n_results, where=where)
+        documents = [doc for doc, _ in results]
+
+        if cache_key is not None:
+            _retrieval_result_cache.set(cache_key, tuple(documents))
         return documents
     
+    async def get_relevant_documents_batch(
+        self,
+        queries: List[str],
+        n_results: int = 3,
+        where: Optional[dict] = None,
+        kb_version: Optional[int] = None
+    ) -> List[List[Document]]:
+        """
+        批量检索：所有未命中缓存的查询一次性向量化，并通过一次 collection.query 检索
+        :param queries: 查询文本列表
+        :param kb_version: 知识库版本号，传入时启用检索结果缓存
+        :return: 与输入顺序一致的文档列表
+        """
+        results: List[Optional[List[Document]]] = [None] * len(queries)
+        cache_keys: List[Optional[tuple]] = [None] * len(queries)
+        if kb_version is not None:
+            for index, query in enumerate(queries):
+                cache_keys[index] = self._result_cache_key(query, n_results, where, kb_version)
+                cached = _retrieval_result_cache.get(cache_keys[index])
+                if cached is not None:
+                    results[index] = list(cached)
+
+        pending = [index for index, documents in enumerate(results) if documents is None]
+        if pending:
+            query_vectors = await self.embed_batch([queries[index] for index in pending])
+            batch_results = await self.search_by_vectors(query_vectors, n_results=n_results, where=where)
+            for index, pairs in zip(pending, batch_results):
+                results[index] = [doc for doc, _ in pairs]
+                if cache_keys[index] is not None:
+                    _retrieval_result_cache.set(cache_keys[index], tuple(results[index]))
+        return results
+
+    async def search_by_vector(
+        self,
+        query_vector: List[float],
+        n_results: int = 3,
+        where: Optional[dict] = None,
+        diversify: bool = True
+    ) -> List[Tuple[Document, float]]:
+        """
+        使用已有的查询向量检索
+        :return: [(Document, 距离)]，按距离升序
+        """
+        return (await self.search_by_vectors(
+            [query_vector], n_results=n_results, where=where, diversify=diversify
+        ))[0]
+
+    async def search_by_vectors(
+        self,
+        query_vectors: List[List[float]],
+        n_results: int = 3,
+        where: Optional[dict] = None,
+        diversify: bool = True
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        使用多个查询向量一次性检索
+        :param diversify: 为 True 时先取较大的候选集，经距离阈值过滤和 MMR 去重后最多返回 n_results 个
+        :return: 每个查询向量对应一组 [(Document, 距离)]，按距离升序
+        """
+        if not query_vectors:
+            return []
+        fetch_k = max(RETRIEVAL_FETCH_K, n_results) if diversify else n_results
+        include = ["documents", "metadatas", "distances"]
+        if fetch_k > n_results:
+            include.append("embeddings")
+        # 热点集合优先走内存快照，否则走 collection.query
+        results = await run_in_chroma_executor(
+            vector_snapshots.query,
+            self.collection,
+            query_embeddings=query_vectors,
+            n_results=fetch_k,
+            where=where,
+            include=include
+        )
+
+        # 将结果转换为LangChain Document对象
+        all_documents = []
+        for query_index, doc_list in enumerate(results.get('documents') or []):
+            metadatas = results['metadatas'][query_index] if results.get('metadatas') else None
+            distances = results['distances'][query_index] if results.get('distances') else None
+            embeddings = results.get('embeddings')
+            embeddings = embeddings[query_index] if embeddings is not None else None
+
+            # 丢弃超过距离阈值的候选
+            keep = [
+                i for i in range(len(doc_list))
+                if not (RETRIEVAL_MAX_DISTANCE > 0 and distances and distances[i] > RETRIEVAL_MAX_DISTANCE)
+            ]
+            if embeddings is not None and len(keep) > 1:
+                # 在剩余候选中做 MMR，去掉重叠分片造成的近似重复
+                chosen = maximal_marginal_relevance(
+                    query_vectors[query_index], [embeddings[i] for i in keep], n_results
+                )
+                keep = sorted(keep[i] for i in chosen)
+            keep = keep[:n_results]
+
+            documents = []
+            for i in keep:
+                metadata = metadatas[i] if metadatas else {}
+                distance = distances[i] if distances else 0.0
+                documents.append((Document(page_content=doc_list[i], metadata=dict(metadata or {})), distance))
+            all_documents.append(documents)
+        # 集合为空时 Chroma 可能不返回结果，按查询数补齐
+        all_documents.extend([] for _ in range(len(query_vectors) - len(all_documents)))
+        return all_documents
+
     async def query(
         self,
         query_text: str,
@@ -105,9 +412,10 @@ class ChromaRetriever:
         :param kwargs: 其他查询参数（传递给 chroma 的 query 方法）
         :return: 查询结果（包含文档和元数据）
         """
-        query_vector = self.embed(query_text)
-        results = self.collection.query(
-            query_embeddings=query_vector,
+        query_vector = await self.embed(query_text)
+        results = await run_in_chroma_executor(
+            self.collection.query,
+            query_embeddings=[query_vector],
             n_results=n_results,
             **kwargs
         )
@@ -116,23 +424,33 @@ class ChromaRetriever:
     @staticmethod
     async def clear_retriever_cache(kb_id: str):
         """清除指定知识库的检索器缓存"""
-        with _retriever_lock:
-            if kb_id in _retriever_cache:
-                del _retriever_cache[kb_id]
-                logger.info(f"已清除知识库 {kb_id} 的检索器缓存")
-                return True
-            return False
+        if _retriever_cache.pop(kb_id) is not None:
+            logger.info(f"已清除知识库 {kb_id} 的检索器缓存")
+            return True
+        return False
 
     @staticmethod
     async def clear_all_retriever_caches():
         """清除所有检索器缓存"""
-        with _retriever_lock:
-            _retriever_cache.clear()
-            logger.info("已清除所有检索器缓存")
+        _retriever_cache.clear()
+        logger.info("已清除所有检索器缓存")
 
-# 缓存检索器
+# 缓存检索器：有界 LRU，空闲超过 RETRIEVER_CACHE_IDLE_TTL 秒的检索器自动过期
+RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "64"))
+RETRIEVER_CACHE_IDLE_TTL = float(os.getenv("RETRIEVER_CACHE_IDLE_TTL", "1800"))
 _retriever_lock = Lock()
-_retriever_cache = {}
+_retriever_cache = TTLCache(
+    max_size=RETRIEVER_CACHE_SIZE,
+    ttl=RETRIEVER_CACHE_IDLE_TTL,
+    refresh_on_access=True
+)
+# 每个知识库一把创建锁，避免并发的首次请求重复创建检索器
+_retriever_creation_locks: Dict[str, asyncio.Lock] = {}
+
+
+def get_retriever_cache_stats() -> dict:
+    """检索器缓存统计（大小、命中、未命中、淘汰数）"""
+    return _retriever_cache.stats()
 
 @functools.lru_cache(maxsize=2)  # 最多缓存2个不同场景的检索器
 def _get_cached_chroma_client():
@@ -156,9 +474,14 @@ def get_rag_retriever(scenario: str):
     collection_name = COLLECTION_MAP[scenario]
     
     # 检查缓存
+    retriever = _retriever_cache.get(scenario)
+    if retriever is not None:
+        return retriever
+
     with _retriever_lock:
-        if scenario in _retriever_cache:
-            return _retriever_cache[scenario]
+        retriever = _retriever_cache.get(scenario)
+        if retriever is not None:
+            return retriever
         
         try:
             # 使用缓存的客户端
@@ -171,7 +494,7 @@ def get_rag_retriever(scenario: str):
             )
             
             # 存入缓存
-            _retriever_cache[scenario] = retriever
+            _retriever_cache.set(scenario, retriever)
             print(f"已为场景 '{scenario}' 创建并缓存检索器")
             return retriever
             
@@ -181,51 +504,83 @@ def get_rag_retriever(scenario: str):
             logging.error(f"创建 {scenario} 场景检索器失败: {e}", exc_info=True)
             return None
         
-async def get_rag_retriever_by_kb(kb_id: str = "", db: Session = Depends(get_db)):
-    """根据知识库ID获取检索器"""
+async def get_rag_retriever_by_kb(kb_id: str = "", db: Session = Depends(get_db), collection_name: Optional[str] = None):
+    """
+    根据知识库ID获取检索器
+    :param collection_name: 调用方已查询到知识库时直接传入集合名，避免再次查询数据库
+    """
 
     # 检查缓存
+    retriever = _retriever_cache.get(kb_id)
+    if retriever is not None:
+        return retriever
+
     with _retriever_lock:
-        if kb_id in _retriever_cache:
-            logger.info(f"从缓存获取知识库 {kb_id} 的检索器")
-            return _retriever_cache[kb_id]
-
-    # 获取知识库信息    
-    try:
-        # kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
-        kb = await knowlege_service.get_knowledge_base_by_id(db=db, kb_id=kb_id)
-        if not kb:
-            return None
-        
-        collection_name = kb.collection_name
-        
-        # 获取 ChromaDB 客户端
-        chroma_client = _get_cached_chroma_client()
-        
-        # 检查集合是否存在
+        creation_lock = _retriever_creation_locks.setdefault(kb_id, asyncio.Lock())
+
+    async with creation_lock:
+        # 等待锁期间可能已被其他请求创建
+        retriever = _retriever_cache.get(kb_id)
+        if retriever is not None:
+            return retriever
+
         try:
-            # 尝试获取集合，如果不存在会抛出异常
-            collection = chroma_client.get_collection(name=collection_name)
-            logger.info(f"知识库 {kb_id} 的向量集合存在，包含 {collection.count()} 个向量")
+            if not collection_name:
+                kb = await knowlege_service.get_knowledge_base_by_id(db=db, kb_id=kb_id)
+                if not kb:
+                    return None
+                collection_name = kb.collection_name
+
+            # 创建检索器（获取集合是同步调用，在 Chroma 线程池中执行；集合不存在时会抛出异常）
+            retriever = await run_in_chroma_executor(
+                ChromaRetriever,
+                collection_name=collection_name,
+                chroma_client=_get_cached_chroma_client(),
+                model_name="text-embedding-v4"
+            )
+
+            # 存入缓存
+            _retriever_cache.set(kb_id, retriever)
+            logger.info(f"已为知识库 {kb_id} 创建检索器，集合名称: {collection_name}")
+            return retriever
         except Exception as e:
-            logger.error(f"知识库 {kb_id} 的向量集合不存在: {e}")
+            logger.error(f"创建知识库 {kb_id} 的检索器失败: {e}", exc_info=True)
             return None
-        
-        # 创建检索器
-        retriever = ChromaRetriever(
-            collection_name=collection_name,
-            chroma_client=chroma_client,
-            model_name="text-embedding-v4"
-        )
-                
-        # 存入缓存
-        with _retriever_lock:
-            _retriever_cache[kb_id] = retriever
-        
-        logger.info(f"已为知识库 {kb_id} 创建检索器，集合名称: {collection_name}")
-        return retriever
-    except Exception as e:
-        import logging
-        logging.error(f"创建知识库 {kb_id} 的检索器失败: {e}", exc_info=True)
-        return None
-    
+        finally:
+            # 创建完成后移除创建锁（仍在等待的请求持有同一把锁，会直接命中缓存）
+            with _retriever_lock:
+                if _retriever_creation_locks.get(kb_id) is creation_lock:
+                    del _retriever_creation_locks[kb_id]
+
+
+async def federated_retrieve(knowledge_bases: list, query: str, n_results: int = 3, db: Session = None) -> List[Document]:
+    """
+    多知识库联合检索：查询只向量化一次，并发检索所有集合，按距离合并为全局 top-k
+    返回的 Document 元数据中附带来源知识库（source_kb_id / source_kb_name）和距离
+    """
+    retrievers = await asyncio.gather(*(
+        get_rag_retriever_by_kb(kb.id, db, collection_name=kb.collection_name)
+        for kb in knowledge_bases
+    ))
+    sources = [(kb, retriever) for kb, retriever in zip(knowledge_bases, retrievers) if retriever]
+    if not sources:
+        return []
+
+    # 各知识库使用同一嵌入模型，查询向量只需生成一次
+    query_vector = await sources[0][1].embed(query)
+    results = await asyncio.gather(
+        *(retriever.search_by_vector(query_vector, n_results=n_results) for _, retriever in sources),
+        return_exceptions=True
+    )
+
+    merged = []
+    for (kb, _), result in zip(sources, results):
+        if isinstance(result, Exception):
+            logger.error(f"检索知识库 {kb.id} 失败: {result}")
+            continue
+        for doc, distance in result:
+            doc.metadata.update(source_kb_id=kb.id, source_kb_name=kb.name, distance=distance)
+            merged.append((distance, doc))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged[:n_results]]
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+import orjson
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 合并 token 的时间窗口（秒）：窗口内到达的 token 合并为一个 SSE 帧
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0.05"))
+# 单帧缓冲达到该字节数时立即发送
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "512"))
+# 保留最近多少次响应的流式指标
+SSE_METRICS_WINDOW = int(os.getenv("SSE_METRICS_WINDOW", "500"))
+
+_END = object()
+
+
+def sse_event(payload) -> bytes:
+    """序列化为一个 SSE 数据帧"""
+    data = payload if isinstance(payload, str) else orjson.dumps(payload).decode("utf-8")
+    return f"data: {data}\n\n".encode("utf-8")
+
+
+class StreamStats:
+    """单次流式响应的指标：首 token 延迟和生成速度"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.tokens = 0
+        self.frames = 0
+        self.chars = 0
+
+    def on_token(self, token: str):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+        self.chars += len(token)
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.first_token_at is None or self.finished_at is None:
+            return 0.0
+        elapsed = self.finished_at - self.first_token_at
+        return self.tokens / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "ttft": round(self.ttft, 4) if self.ttft is not None else None,
+            "total": round((self.finished_at or time.perf_counter()) - self.started_at, 4),
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "chars": self.chars,
+            "tokens_per_second": round(self.tokens_per_second, 2)
+        }
+
+
+_recent_stats = deque(maxlen=SSE_METRICS_WINDOW)
+# 最近若干次请求在开始生成前各阶段的耗时
+_recent_stage_timings = deque(maxlen=SSE_METRICS_WINDOW)
+
+
+def record_stream_stats(stats: StreamStats, label: str = ""):
+    """记录一次流式响应的指标"""
+    stats.finish()
+    summary = stats.to_dict()
+    _recent_stats.append(summary)
+    logger.info(
+        f"流式响应{label}: 首token {summary['ttft']}s, 总耗时 {summary['total']}s, "
+        f"{summary['tokens']} tokens / {summary['frames']} 帧, {summary['tokens_per_second']} tokens/s"
+    )
+
+
+def record_stage_timings(timings: dict):
+    """记录一次请求各准备阶段的耗时（秒）"""
+    _recent_stage_timings.append(dict(timings))
+
+
+def get_stream_stats() -> dict:
+    """最近若干次流式响应的指标汇总"""
+    items = list(_recent_stats)
+    ttfts = sorted(item["ttft"] for item in items if item["ttft"] is not None)
+    speeds = sorted(item["tokens_per_second"] for item in items if item["tokens_per_second"])
+
+    def pct(values, p):
+        # 最近秩法
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)] if values else None
+
+    stages = {}
+    for timings in list(_recent_stage_timings):
+        for name, seconds in timings.items():
+            stages.setdefault(name, []).append(seconds)
+
+    return {
+        "responses": len(items),
+        "ttft_p50": pct(ttfts, 50),
+        "ttft_p95": pct(ttfts, 95),
+        "tokens_per_second_p50": pct(speeds, 50),
+        "stages": {
+            name: {"p50": round(pct(sorted(values), 50), 4), "p95": round(pct(sorted(values), 95), 4)}
+            for name, values in stages.items()
+        }
+    }
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str],
+    stats: Optional[StreamStats] = None,
+    interval: float = SSE_FLUSH_INTERVAL,
+    max_bytes: int = SSE_FLUSH_BYTES
+) -> AsyncIterator[str]:
+    """
+    将上游 token 流合并为文本帧
+    首个 token 立即发送；之后在 interval 时间窗口内到达的 token 合并发送，缓冲超过 max_bytes 时提前发送。
+    上游在独立任务中读取，本生成器被关闭或取消时立即取消上游（停止 model.astream）
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+            queue.put_nowait(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            queue.put_nowait(e)
+
+    pump_task = asyncio.create_task(pump())
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    frames = 0
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is _END or isinstance(item, Exception):
+                if buffer:
+                    if stats:
+                        stats.frames += 1
+                    yield "".join(buffer)
+                if isinstance(item, Exception):
+                    raise item
+                return
+
+            if item:
+                if stats:
+                    stats.on_token(item)
+                buffer.append(item)
+                buffered_bytes += len(item.encode("utf-8"))
+                if deadline is None:
+                    # 首帧不等待，尽快送达；之后从当前时刻开始计算合并窗口
+                    deadline = time.perf_counter() + (interval if frames else 0)
+
+            flush_due = deadline is not None and time.perf_counter() >= deadline
+            if buffer and (flush_due or buffered_bytes >= max_bytes):
+                text = "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+                frames += 1
+                if stats:
+                    stats.frames += 1
+                yield text
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            try:
+                await pump_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        aclose = getattr(tokens, "aclose", None)
+        if aclose:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -0,0 +1,4 @@
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个 token，其他字符按 4 个字符 1 个 token"""
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uf900' <= ch <= '\ufaff')
+    return cjk + (len(text) - cjk) // 4 + 1
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    线程安全的内存 LRU 缓存，支持过期时间
+    :param max_size: 最大条目数，超出时淘汰最久未使用的条目
+    :param ttl: 过期时间（秒），<= 0 表示不过期
+    :param refresh_on_access: 为 True 时每次命中都会刷新过期时间（空闲过期）
+    :param on_evict: 条目被淘汰或过期时的回调，参数为 (key, value)
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float = 0,
+        refresh_on_access: bool = False,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_on_access = refresh_on_access
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，命中时移到 LRU 队尾"""
+        expired = _MISSING
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                expired = value
+            else:
+                self._data.move_to_end(key)
+                if self.refresh_on_access and self.ttl > 0:
+                    self._data[key] = (value, time.monotonic() + self.ttl)
+                self.hits += 1
+                return value
+        if self.on_evict and expired is not _MISSING:
+            self.on_evict(key, expired)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl 为空时使用默认过期时间"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl > 0 else 0
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        if self.on_evict:
+            for evicted_key, (evicted_value, _) in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """删除并返回缓存条目"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def purge_expired(self) -> int:
+        """清理所有已过期的条目"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [(key, value) for key, (value, expires_at) in self._data.items()
+                       if expires_at and expires_at <= now]
+            for key, _ in expired:
+                del self._data[key]
+            self.expirations += len(expired)
+        if self.on_evict:
+            for key, value in expired:
+                self.on_evict(key, value)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not (item[1] and item[1] <= time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
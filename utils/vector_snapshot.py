@@ -0,0 +1,354 @@
+import logging
+import os
+import threading
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+VECTOR_SNAPSHOT_ENABLED = os.getenv("VECTOR_SNAPSHOT_ENABLED", "false").lower() == "true"
+# 集合被查询多少次后视为热点集合并加载快照
+VECTOR_SNAPSHOT_MIN_QUERIES = int(os.getenv("VECTOR_SNAPSHOT_MIN_QUERIES", "20"))
+# 单个集合允许加载快照的最大向量数
+VECTOR_SNAPSHOT_MAX_VECTORS = int(os.getenv("VECTOR_SNAPSHOT_MAX_VECTORS", "100000"))
+# 同时保留快照的集合数上限
+VECTOR_SNAPSHOT_MAX_COLLECTIONS = int(os.getenv("VECTOR_SNAPSHOT_MAX_COLLECTIONS", "8"))
+# 快照矩阵精度：float32 或 float16（float16 内存减半，查询时分块转换为 float32 计算，速度略慢）
+VECTOR_SNAPSHOT_DTYPE = os.getenv("VECTOR_SNAPSHOT_DTYPE", "float32")
+# 快照定期从 Chroma 重新加载的间隔（秒），用于同步其他进程（如独立入库 worker）的写入，<= 0 表示不刷新
+VECTOR_SNAPSHOT_REFRESH_SECONDS = float(os.getenv("VECTOR_SNAPSHOT_REFRESH_SECONDS", "300"))
+# 从 Chroma 加载时每页读取的条数
+VECTOR_SNAPSHOT_LOAD_PAGE_SIZE = 1000
+# float16 快照查询时每次转换为 float32 计算的行数（CPU 上 float16 矩阵乘法很慢，分块转换控制临时内存）
+VECTOR_SNAPSHOT_UPCAST_ROWS = 8192
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorSnapshot:
+    """
+    单个集合的内存向量快照：连续存储的归一化向量矩阵 + ID/文档/元数据数组
+    查询时一次矩阵-向量乘法得到余弦相似度，再用 argpartition 取 top-k；
+    返回的距离换算为 2 - 2·余弦相似度（归一化向量下与 Chroma 默认的平方 L2 距离一致）
+    """
+
+    def __init__(self, name: str, dimensions: int, dtype: str = VECTOR_SNAPSHOT_DTYPE, capacity: int = 1024):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"不支持的快照精度: {dtype}")
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self._matrix = np.zeros((capacity, dimensions), dtype=self.dtype)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._ids: List[Optional[str]] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[dict]] = []
+        self._positions: Dict[str, int] = {}
+        self._size = 0
+        self._lock = Lock()
+        self.loaded_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def nbytes(self) -> int:
+        return self._matrix.nbytes
+
+    def _ensure_capacity(self, extra: int):
+        required = self._size + extra
+        if required <= len(self._matrix):
+            return
+        capacity = max(required, len(self._matrix) * 2)
+        matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=self.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._matrix, self._alive = matrix, alive
+
+    def _compact(self):
+        """删除过多时压缩矩阵，回收已删除行"""
+        keep = np.flatnonzero(self._alive[:self._size])
+        count = len(keep)
+        self._matrix[:count] = self._matrix[keep]
+        self._alive[:count] = True
+        self._alive[count:] = False
+        self._ids = [self._ids[i] for i in keep]
+        self._documents = [self._documents[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._positions = {vector_id: position for position, vector_id in enumerate(self._ids)}
+        self._size = count
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        """写入或覆盖向量"""
+        if not len(ids):
+            return
+        vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32)).astype(self.dtype)
+        with self._lock:
+            new_rows = sum(1 for vector_id in dict.fromkeys(ids) if vector_id not in self._positions)
+            self._ensure_capacity(new_rows)
+            for vector_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                position = self._positions.get(vector_id)
+                if position is None:
+                    position = self._size
+                    self._size += 1
+                    self._positions[vector_id] = position
+                    self._ids.append(vector_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                else:
+                    self._documents[position] = document
+                    self._metadatas[position] = metadata
+                self._matrix[position] = vector
+                self._alive[position] = True
+
+    def delete(self, ids: List[str]):
+        """删除向量（标记删除，删除行过多时压缩）"""
+        with self._lock:
+            for vector_id in ids:
+                position = self._positions.pop(vector_id, None)
+                if position is not None:
+                    self._alive[position] = False
+                    self._ids[position] = self._documents[position] = self._metadatas[position] = None
+            if self._size and len(self._positions) < self._size // 2:
+                self._compact()
+
+    def _scores(self, matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """(n, d) @ (d, q) -> (n, q)：所有查询的余弦相似度，始终以 float32 计算"""
+        if matrix.dtype == np.float32:
+            return matrix @ queries.T
+        scores = np.empty((len(matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(matrix), VECTOR_SNAPSHOT_UPCAST_ROWS):
+            block = matrix[start:start + VECTOR_SNAPSHOT_UPCAST_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        return scores
+
+    def query(self, query_embeddings, n_results: int, include: List[str]) -> dict:
+        """与 collection.query 返回格式一致的 top-k 检索"""
+        queries = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        with self._lock:
+            size = self._size
+            matrix = self._matrix[:size]
+            scores = self._scores(matrix, queries)
+            scores[~self._alive[:size]] = -np.inf
+            k = min(n_results, len(self._positions))
+            for column in range(scores.shape[1]):
+                column_scores = scores[:, column]
+                if k <= 0:
+                    top = np.empty(0, dtype=np.int64)
+                elif k < size:
+                    top = np.argpartition(-column_scores, k - 1)[:k]
+                    top = top[np.argsort(-column_scores[top])]
+                else:
+                    top = np.argsort(-column_scores)[:k]
+                result["ids"].append([self._ids[i] for i in top])
+                result["documents"].append([self._documents[i] for i in top])
+                result["metadatas"].append([self._metadatas[i] for i in top])
+                result["distances"].append((2.0 - 2.0 * column_scores[top]).tolist())
+                if "embeddings" in include:
+                    result["embeddings"].append(matrix[top].astype(np.float32))
+        if "embeddings" not in include:
+            result["embeddings"] = None
+        return result
+
+
+class VectorSnapshotRegistry:
+    """
+    热点集合的内存快照管理
+    集合查询次数达到阈值且向量数不超过上限时从 Chroma 加载快照；
+    本进程内的写入和删除会增量同步到快照，其他进程的写入依靠定期重新加载同步。
+    加载和重新加载在后台线程中进行，期间查询继续使用旧快照（或 Chroma）；
+    加载期间本进程的写入会被记录，新快照替换旧快照前重放，避免丢失
+    """
+
+    def __init__(
+        self,
+        enabled: bool = VECTOR_SNAPSHOT_ENABLED,
+        min_queries: int = VECTOR_SNAPSHOT_MIN_QUERIES,
+        max_vectors: int = VECTOR_SNAPSHOT_MAX_VECTORS,
+        max_collections: int = VECTOR_SNAPSHOT_MAX_COLLECTIONS,
+        refresh_seconds: float = VECTOR_SNAPSHOT_REFRESH_SECONDS
+    ):
+        self.enabled = enabled
+        self.min_queries = min_queries
+        self.max_vectors = max_vectors
+        self.max_collections = max_collections
+        self.refresh_seconds = refresh_seconds
+        self._snapshots: Dict[str, VectorSnapshot] = {}
+        self._query_counts: Dict[str, int] = {}
+        # 集合过大、为空或加载失败时，在刷新间隔内不再尝试加载
+        self._skipped: Dict[str, float] = {}
+        # 正在后台加载的集合 -> 加载期间发生的写入（("upsert", 参数) / ("delete", ids)）
+        self._building: Dict[str, list] = {}
+        self._lock = Lock()
+        self._load_lock = Lock()
+        self.hits = 0
+        self.fallbacks = 0
+
+    def load(self, collection) -> Optional[VectorSnapshot]:
+        """从 Chroma 分页读取集合的全部向量构建快照"""
+        count = collection.count()
+        if count > self.max_vectors:
+            logger.info(f"集合 {collection.name} 有 {count} 个向量，超过快照上限 {self.max_vectors}，不加载")
+            self._skipped[collection.name] = time.monotonic()
+            return None
+
+        start = time.perf_counter()
+        snapshot = None
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=VECTOR_SNAPSHOT_LOAD_PAGE_SIZE,
+                offset=offset
+            )
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+            if snapshot is None:
+                snapshot = VectorSnapshot(collection.name, embeddings.shape[1], capacity=max(count, len(ids)))
+            snapshot.upsert(ids, embeddings, page["documents"], page["metadatas"])
+            offset += len(ids)
+
+        if snapshot is None:
+            self._skipped[collection.name] = time.monotonic()
+            return None
+        logger.info(
+            f"已加载集合 {collection.name} 的内存快照: {len(snapshot)} 个向量, "
+            f"{snapshot.nbytes / 1024 / 1024:.1f}MB, 耗时 {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        return snapshot
+
+    def _get_or_load(self, collection) -> Optional[VectorSnapshot]:
+        """返回可用的快照；需要加载或刷新时在后台线程中进行，不阻塞本次查询"""
+        name = collection.name
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+            stale = snapshot is not None and self.refresh_seconds > 0 and \
+                time.monotonic() - snapshot.loaded_at > self.refresh_seconds
+            if snapshot is not None and not stale:
+                return snapshot
+            if snapshot is None:
+                self._query_counts[name] = self._query_counts.get(name, 0) + 1
+                skipped_at = self._skipped.get(name)
+                retry_skipped = skipped_at is not None and self.refresh_seconds > 0 and \
+                    time.monotonic() - skipped_at > self.refresh_seconds
+                if self._query_counts[name] < self.min_queries or (skipped_at and not retry_skipped):
+                    return None
+            if name in self._building:
+                return snapshot
+
+        # 同一时间只加载一个集合，其余查询继续使用旧快照或走 Chroma
+        if not self._load_lock.acquire(blocking=False):
+            return snapshot
+        with self._lock:
+            self._building[name] = []
+        threading.Thread(
+            target=self._build, args=(collection,), name=f"snapshot-load-{name}", daemon=True
+        ).start()
+        return snapshot
+
+    def _build(self, collection):
+        """后台加载快照，完成后重放加载期间的写入并替换旧快照"""
+        name = collection.name
+        try:
+            try:
+                fresh = self.load(collection)
+            except Exception as e:
+                logger.error(f"加载集合 {name} 的内存快照失败: {e}")
+                fresh = None
+
+            with self._lock:
+                pending = self._building.pop(name, None)
+                if pending is None:
+                    # 加载期间集合已被删除
+                    return
+                if fresh is None:
+                    # 记录跳过时间，刷新间隔内不再重复加载（加载失败时同样适用，避免每次查询都重试）
+                    self._skipped[name] = time.monotonic()
+                    self._snapshots.pop(name, None)
+                    return
+                for operation, args in pending:
+                    if operation == "upsert":
+                        fresh.upsert(*args)
+                    else:
+                        fresh.delete(args)
+                self._skipped.pop(name, None)
+                self._snapshots[name] = fresh
+                # 超出集合数上限时丢弃最早加载的快照
+                while len(self._snapshots) > self.max_collections:
+                    oldest = min(self._snapshots, key=lambda key: self._snapshots[key].loaded_at)
+                    del self._snapshots[oldest]
+                    self._query_counts.pop(oldest, None)
+        finally:
+            self._load_lock.release()
+
+    def query(self, collection, query_embeddings, n_results: int, where: Optional[dict], include: List[str]) -> dict:
+        """优先从内存快照检索，快照不可用或带过滤条件时退回 collection.query"""
+        snapshot = self._get_or_load(collection) if self.enabled and not where else None
+        if snapshot is None:
+            self.fallbacks += 1
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                include=include
+            )
+        self.hits += 1
+        return snapshot.query(query_embeddings, n_results, include)
+
+    def upsert(self, collection_name: str, ids, embeddings, documents, metadatas):
+        """同步本进程写入的向量（仅对已加载或正在加载的快照生效）"""
+        with self._lock:
+            pending = self._building.get(collection_name)
+            if pending is not None:
+                pending.append(("upsert", (ids, embeddings, documents, metadatas)))
+            snapshot = self._snapshots.get(collection_name)
+        if snapshot is not None:
+            snapshot.upsert(ids, embeddings, documents, metadatas)
+
+    def delete(self, collection_name: str, ids):
+        """同步本进程删除的向量（仅对已加载或正在加载的快照生效）"""
+        with self._lock:
+            pending = self._building.get(collection_name)
+            if pending is not None:
+                pending.append(("delete", list(ids)))
+            snapshot = self._snapshots.get(collection_name)
+        if snapshot is not None:
+            snapshot.delete(ids)
+
+    def drop(self, collection_name: str):
+        """丢弃集合的快照（集合被删除时调用）"""
+        with self._lock:
+            self._snapshots.pop(collection_name, None)
+            self._query_counts.pop(collection_name, None)
+            self._skipped.pop(collection_name, None)
+            self._building.pop(collection_name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            collections = {
+                name: {"vectors": len(snapshot), "bytes": snapshot.nbytes}
+                for name, snapshot in self._snapshots.items()
+            }
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "collections": collections
+        }
+
+
+# 全局快照管理实例
+vector_snapshots = VectorSnapshotRegistry()